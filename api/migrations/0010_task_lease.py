@@ -0,0 +1,35 @@
+# Generated by Django 5.1.6 on 2026-10-18 09:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0009_apikey_api_type"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="task",
+            name="attempts",
+            field=models.IntegerField(default=0, help_text="已领取次数"),
+        ),
+        migrations.AddField(
+            model_name="task",
+            name="heartbeat_at",
+            field=models.DateTimeField(blank=True, help_text="最后心跳时间", null=True),
+        ),
+        migrations.AddField(
+            model_name="task",
+            name="lease_expires_at",
+            field=models.DateTimeField(blank=True, help_text="租约过期时间", null=True),
+        ),
+        migrations.AddField(
+            model_name="task",
+            name="lease_owner",
+            field=models.CharField(
+                blank=True, help_text="持有租约的worker", max_length=255, null=True
+            ),
+        ),
+    ]
@@ -0,0 +1,55 @@
+# Generated by Django 5.1.6 on 2026-10-18 14:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0011_task_content_hash_document_content_hash"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="TranslationMemory",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "source_hash",
+                    models.CharField(help_text="规范化原文的SHA-256", max_length=64),
+                ),
+                (
+                    "target_language",
+                    models.CharField(help_text="目标语言", max_length=64),
+                ),
+                ("source_text", models.TextField(help_text="原文")),
+                ("translated_text", models.TextField(help_text="译文")),
+                ("hit_count", models.IntegerField(default=0, help_text="复用次数")),
+                (
+                    "created_at",
+                    models.DateTimeField(auto_now_add=True, help_text="创建时间"),
+                ),
+                (
+                    "updated_at",
+                    models.DateTimeField(auto_now=True, help_text="最后更新时间"),
+                ),
+            ],
+            options={
+                "ordering": ["-created_at"],
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("source_hash", "target_language"),
+                        name="unique_translation_memory",
+                    )
+                ],
+            },
+        ),
+    ]
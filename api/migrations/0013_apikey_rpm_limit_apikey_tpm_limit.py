@@ -0,0 +1,27 @@
+# Generated by Django 5.1.6 on 2026-10-18 14:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0012_translationmemory"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="apikey",
+            name="rpm_limit",
+            field=models.PositiveIntegerField(
+                blank=True, help_text="每分钟请求数上限", null=True
+            ),
+        ),
+        migrations.AddField(
+            model_name="apikey",
+            name="tpm_limit",
+            field=models.PositiveIntegerField(
+                blank=True, help_text="每分钟 token 数上限", null=True
+            ),
+        ),
+    ]
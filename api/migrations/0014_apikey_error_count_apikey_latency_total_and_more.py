@@ -0,0 +1,28 @@
+# Generated by Django 5.1.6 on 2026-10-18 16:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0013_apikey_rpm_limit_apikey_tpm_limit"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="apikey",
+            name="error_count",
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="apikey",
+            name="latency_total",
+            field=models.FloatField(default=0, help_text="成功请求的总耗时（秒）"),
+        ),
+        migrations.AddField(
+            model_name="apikey",
+            name="latency_count",
+            field=models.IntegerField(default=0),
+        ),
+    ]
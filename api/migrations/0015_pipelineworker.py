@@ -0,0 +1,45 @@
+# Generated by Django 5.1.6 on 2026-10-18 16:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0014_apikey_error_count_apikey_latency_total_and_more"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="PipelineWorker",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "worker_id",
+                    models.CharField(help_text="worker标识", max_length=255, unique=True),
+                ),
+                ("hostname", models.CharField(help_text="所在主机", max_length=255)),
+                ("capacity", models.IntegerField(help_text="同时处理的文档数")),
+                (
+                    "active_tasks",
+                    models.IntegerField(default=0, help_text="正在处理的任务数"),
+                ),
+                (
+                    "started_at",
+                    models.DateTimeField(auto_now_add=True, help_text="启动时间"),
+                ),
+                ("heartbeat_at", models.DateTimeField(help_text="最后心跳时间")),
+            ],
+            options={
+                "ordering": ["hostname", "started_at"],
+            },
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 5.1.6 on 2026-10-18 18:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0015_pipelineworker"),
+    ]
+
+    operations = [
+        migrations.RemoveConstraint(
+            model_name="translationmemory",
+            name="unique_translation_memory",
+        ),
+        migrations.AddField(
+            model_name="translationmemory",
+            name="model",
+            field=models.CharField(
+                blank=True, default="", help_text="生成译文的模型", max_length=255
+            ),
+        ),
+        migrations.AddField(
+            model_name="translationmemory",
+            name="prompt_version",
+            field=models.CharField(default="1", help_text="翻译提示词版本", max_length=32),
+        ),
+        migrations.AddConstraint(
+            model_name="translationmemory",
+            constraint=models.UniqueConstraint(
+                fields=("source_hash", "target_language", "prompt_version", "model"),
+                name="unique_translation_memory_version",
+            ),
+        ),
+    ]
@@ -30,10 +30,18 @@ class ApiKey(models.Model):
     counter = models.IntegerField(default=0)
     last_used_at = models.DateTimeField(null=True, blank=True)
     last_error_message = models.TextField(null=True, blank=True)
+    # 由 UsageRecorder 定期批量写回
+    error_count = models.IntegerField(default=0)
+    latency_total = models.FloatField(default=0, help_text='成功请求的总耗时（秒）')
+    latency_count = models.IntegerField(default=0)
 
     # 直接使用 CharField，而不限制 choices
     api_type = models.CharField(max_length=10, default='gemini', help_text='API 类型 (gemini 或 openai)')
 
+    # 配额，为空表示不限制
+    rpm_limit = models.PositiveIntegerField(null=True, blank=True, help_text='每分钟请求数上限')
+    tpm_limit = models.PositiveIntegerField(null=True, blank=True, help_text='每分钟 token 数上限')
+
     def __str__(self):
         return f"{self.api_type.upper()} - {self.key[:10]}..."
 
@@ -72,12 +80,47 @@ class Task(models.Model):
     # 元数据
     metadata = models.JSONField(default=dict, blank=True, help_text='额外的任务元数据')
 
+    # 租约：领取任务的worker需要定期心跳续约，租约过期的任务会被重新领取
+    lease_owner = models.CharField(max_length=255, null=True, blank=True, help_text='持有租约的worker')
+    lease_expires_at = models.DateTimeField(null=True, blank=True, help_text='租约过期时间')
+    heartbeat_at = models.DateTimeField(null=True, blank=True, help_text='最后心跳时间')
+    attempts = models.IntegerField(default=0, help_text='已领取次数')
+
+    # 上传文件内容的 SHA-256，用于识别重复上传
+    content_hash = models.CharField(max_length=64, null=True, blank=True, db_index=True, help_text='文件内容哈希')
+
+    # 尚未结束、可以被领取的任务状态
+    ACTIVE_STATUSES = [
+        Status.PENDING,
+        Status.PREPROCESSING,
+        Status.EXTRACTING,
+        Status.TRANSLATING,
+    ]
+
     def __str__(self):
         return f"{self.title} - {self.status}"
 
     class Meta:
         ordering = ['-created_at']
 
+class PipelineWorker(models.Model):
+    """
+    文档处理 worker 的注册表
+    每个 worker 启动时登记自己能同时处理的文档数，由心跳线程定期更新正在处理的任务数
+    """
+    worker_id = models.CharField(max_length=255, unique=True, help_text='worker标识')
+    hostname = models.CharField(max_length=255, help_text='所在主机')
+    capacity = models.IntegerField(help_text='同时处理的文档数')
+    active_tasks = models.IntegerField(default=0, help_text='正在处理的任务数')
+    started_at = models.DateTimeField(auto_now_add=True, help_text='启动时间')
+    heartbeat_at = models.DateTimeField(help_text='最后心跳时间')
+
+    def __str__(self):
+        return f"{self.worker_id} ({self.active_tasks}/{self.capacity})"
+
+    class Meta:
+        ordering = ['hostname', 'started_at']
+
 class TextSection(models.Model):
     linked_file_path = models.CharField(max_length=1000, help_text='关联的文件路径')
     title = models.CharField(max_length=255, help_text='文本标题')
@@ -101,6 +144,7 @@ class Document(models.Model):
 
     linked_file_path = models.CharField(max_length=1000, help_text='关联的文件路径')
     linked_task = models.ForeignKey(Task, on_delete=models.CASCADE, related_name='documents')
+    content_hash = models.CharField(max_length=64, null=True, blank=True, db_index=True, help_text='文件内容哈希')
 
     def __str__(self):
         return f"{self.title} - {self.linked_task.title} - {self.linked_file_path}"
@@ -143,3 +187,25 @@ class MindMap(models.Model):
 
     class Meta:
         ordering = ['-created_at']
+
+class TranslationMemory(models.Model):
+    # 段落级翻译记忆，按规范化后原文的哈希复用已有译文
+    source_hash = models.CharField(max_length=64, help_text='规范化原文的SHA-256')
+    target_language = models.CharField(max_length=64, help_text='目标语言')
+    # 提示词修改后旧译文不再复用；按模型或提示词版本可以清除有问题的译文
+    prompt_version = models.CharField(max_length=32, default='1', help_text='翻译提示词版本')
+    model = models.CharField(max_length=255, blank=True, default='', help_text='生成译文的模型')
+    source_text = models.TextField(help_text='原文')
+    translated_text = models.TextField(help_text='译文')
+    hit_count = models.IntegerField(default=0, help_text='复用次数')
+    created_at = models.DateTimeField(auto_now_add=True, help_text='创建时间')
+    updated_at = models.DateTimeField(auto_now=True, help_text='最后更新时间')
+
+    def __str__(self):
+        return f"{self.target_language} - {self.source_text[:30]}"
+
+    class Meta:
+        ordering = ['-created_at']
+        constraints = [
+            models.UniqueConstraint(fields=['source_hash', 'target_language', 'prompt_version', 'model'], name='unique_translation_memory_version'),
+        ]
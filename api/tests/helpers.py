@@ -0,0 +1,47 @@
+from unittest import mock
+
+from django.test import SimpleTestCase
+
+from clients.client_pool import ClientPool
+from clients.qos import Lane
+
+class FakeClock:
+    """代替模块中的 time，测试中手动推进 time.monotonic()"""
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self) -> float:
+        return self.now
+
+    def advance(self, seconds: float):
+        self.now += seconds
+
+class ClockTestCase(SimpleTestCase):
+    """clock_modules 中各模块的 time 替换为 self.clock"""
+    clock_modules = ()
+
+    def setUp(self):
+        self.clock = FakeClock()
+        for module in self.clock_modules:
+            patcher = mock.patch(f"{module}.time", self.clock)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+class FakeClient:
+    def __init__(self, api_key: str):
+        self.api_key = api_key
+        self.api_key_model = None
+
+    def get_model_name(self, operation: str) -> str:
+        return 'fake-model'
+
+class ClientPoolTestCase(SimpleTestCase):
+    """两个客户端的客户端池，每个客户端初始并发上限为 2"""
+    def setUp(self):
+        self.first = FakeClient('first-key')
+        self.second = FakeClient('second-key')
+        self.pool = ClientPool([self.first, self.second], max_concurrent_requests=2, retry_delay=0)
+
+    def acquire(self):
+        acquired = self.pool._acquire_client(lane=Lane.INTERACTIVE)
+        return acquired[0] if acquired else None
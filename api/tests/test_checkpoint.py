@@ -0,0 +1,107 @@
+import os
+import shutil
+import tempfile
+from pathlib import Path
+
+from django.test import SimpleTestCase, override_settings
+
+from pipeline.checkpoint import TaskCheckpoint
+from pipeline.document_pipeline import DocumentPipeline
+from prepdocs.config import Section, Page, FileType
+
+class CheckpointTestCase(SimpleTestCase):
+    """检查点的保存、读取和任务重试时只处理缺失的页面"""
+    def setUp(self):
+        self.persist_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.persist_dir, True)
+        persist_override = override_settings(PERSIST_DIR=self.persist_dir)
+        persist_override.enable()
+        self.addCleanup(persist_override.disable)
+        self.checkpoint = TaskCheckpoint(1)
+
+    def render_pages(self, count: int, content=None) -> list[Page]:
+        render_dir = Path(tempfile.mkdtemp(dir=self.persist_dir))
+        pages = []
+        for i in range(count):
+            path = render_dir / f"render_{i}.png"
+            path.write_bytes(b'png')
+            pages.append(Page(file_path=str(path), content=content))
+        return pages
+
+    @staticmethod
+    def text_section(contents: list[str]) -> Section:
+        return Section(title='doc', pages=[Page(content=content) for content in contents],
+                       file_type=FileType.TEXT, filename='doc')
+
+    def test_image_section_round_trip(self):
+        section = Section(title='doc', pages=self.render_pages(3), file_type=FileType.IMAGE, filename='doc.pdf')
+        saved = self.checkpoint.save_image_section(section)
+
+        self.assertEqual(len(saved.pages), 3)
+        for page in saved.pages:
+            self.assertTrue(Path(page.file_path).is_relative_to(self.checkpoint.image_dir))
+            self.assertTrue(os.path.exists(page.file_path))
+        # 进程重启后从同一目录恢复
+        loaded = TaskCheckpoint(1).load_image_section()
+        self.assertEqual([page.file_path for page in loaded.pages], [page.file_path for page in saved.pages])
+        self.assertEqual(loaded.filename, 'doc.pdf')
+
+    def test_missing_image_invalidates_section(self):
+        section = Section(title='doc', pages=self.render_pages(2), file_type=FileType.IMAGE, filename='doc.pdf')
+        saved = self.checkpoint.save_image_section(section)
+        os.remove(saved.pages[1].file_path)
+        self.assertIsNone(self.checkpoint.load_image_section())
+
+    def test_unfinished_stream_has_no_section(self):
+        pages = self.checkpoint.iter_save_image_pages('doc', 'doc.pdf', iter(self.render_pages(3)))
+        next(pages)
+        # manifest 在全部页面保存后才写入
+        self.assertIsNone(self.checkpoint.load_image_section())
+
+    def test_text_layer_pages_saved_as_extracted(self):
+        section = Section(title='doc', pages=self.render_pages(2, content='text layer'),
+                          file_type=FileType.IMAGE, filename='doc.pdf')
+        self.checkpoint.save_image_section(section)
+        self.assertEqual([page.content for page in self.checkpoint.load_pages('en', 2)], ['text layer', 'text layer'])
+
+    def test_resume_only_missing_pages(self):
+        self.checkpoint.save_page('zh', 1, Page(content='saved 1'))
+        processed = []
+
+        def process(sub_section, on_page_done):
+            for idx, page in enumerate(sub_section.pages):
+                processed.append(page.content)
+                on_page_done(idx, Page(content=page.content.upper()))
+            return sub_section
+
+        result = DocumentPipeline._resume_pages(self.text_section(['page 0', 'page 1', 'page 2']),
+                                                self.checkpoint, 'zh', process)
+        self.assertEqual(processed, ['page 0', 'page 2'])
+        self.assertEqual([page.content for page in result.pages], ['PAGE 0', 'saved 1', 'PAGE 2'])
+
+    def test_resume_complete_checkpoint_skips_processing(self):
+        for i in range(2):
+            self.checkpoint.save_page('en', i, Page(content=f"saved {i}"))
+
+        def process(sub_section, on_page_done):
+            self.fail('所有页面都已在检查点中')
+
+        result = DocumentPipeline._resume_pages(self.text_section(['a', 'b']), self.checkpoint, 'en', process)
+        self.assertEqual([page.content for page in result.pages], ['saved 0', 'saved 1'])
+
+    def test_resume_reports_failed_pages(self):
+        def process(sub_section, on_page_done):
+            # 只有第一页处理成功
+            on_page_done(0, Page(content='done'))
+            return sub_section
+
+        with self.assertRaisesMessage(ValueError, '[2, 3]'):
+            DocumentPipeline._resume_pages(self.text_section(['a', 'b', 'c']), self.checkpoint, 'en', process)
+        # 已完成的页面保留在检查点中，重试时不再处理
+        self.assertEqual(self.checkpoint.load_page('en', 0).content, 'done')
+
+    def test_cleanup(self):
+        self.checkpoint.save_page('en', 0, Page(content='text'))
+        self.checkpoint.cleanup()
+        self.assertFalse(self.checkpoint.root.exists())
+        self.checkpoint.cleanup()
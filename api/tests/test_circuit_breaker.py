@@ -0,0 +1,146 @@
+from unittest import mock
+
+from django.test import SimpleTestCase
+
+from api.tests.helpers import ClockTestCase, ClientPoolTestCase, FakeClient
+from clients.circuit_breaker import CircuitBreaker, ErrorClass, classify_error
+from clients.client_pool import ClientPool
+
+class ClassifyErrorTestCase(SimpleTestCase):
+    def test_classify_error(self):
+        self.assertEqual(classify_error('401 Unauthorized'), ErrorClass.AUTH)
+        self.assertEqual(classify_error('API key not valid. Please pass a valid API key.'), ErrorClass.AUTH)
+        self.assertEqual(classify_error('处理请求时发生错误: 429 Too Many Requests'), ErrorClass.QUOTA)
+        self.assertEqual(classify_error('RESOURCE_EXHAUSTED'), ErrorClass.QUOTA)
+        self.assertEqual(classify_error('Error code: 400 - invalid_argument'), ErrorClass.REQUEST)
+        self.assertEqual(classify_error('413 Request Entity Too Large'), ErrorClass.REQUEST)
+        self.assertEqual(classify_error('处理请求时发生错误: 不支持的图片格式'), ErrorClass.REQUEST)
+        self.assertEqual(classify_error('503 Service Unavailable'), ErrorClass.TRANSIENT)
+        self.assertEqual(classify_error('Connection reset by peer'), ErrorClass.TRANSIENT)
+
+    def test_key_scoped_errors_trip_breaker(self):
+        # base_url 错误、模型不存在或密钥过期只与当前密钥有关
+        self.assertEqual(classify_error('404 Not Found'), ErrorClass.AUTH)
+        self.assertEqual(classify_error("Error code: 404 - {'error': 'The model `gpt-x` does not exist'}"), ErrorClass.AUTH)
+        self.assertEqual(classify_error('400 API key expired. Please renew the API key.'), ErrorClass.AUTH)
+        self.assertEqual(classify_error('400 API key not valid. [reason: API_KEY_INVALID] invalid_argument'), ErrorClass.AUTH)
+        self.assertEqual(classify_error('400 Bad Request'), ErrorClass.TRANSIENT)
+        self.assertEqual(classify_error('Quota exceeded for consumer api_key:abc'), ErrorClass.QUOTA)
+
+class CircuitBreakerTestCase(ClockTestCase):
+    clock_modules = ('clients.circuit_breaker',)
+
+    def setUp(self):
+        super().setUp()
+        self.breaker = CircuitBreaker(failure_threshold=3, transient_cooldown=10, quota_cooldown=20,
+                                      auth_cooldown=3600, max_cooldown=40)
+
+    def open_transient(self):
+        for _ in range(3):
+            self.breaker.record_failure(ErrorClass.TRANSIENT)
+
+    def test_transient_errors_open_after_threshold(self):
+        for _ in range(2):
+            self.breaker.record_failure(ErrorClass.TRANSIENT)
+        self.assertEqual(self.breaker.state, CircuitBreaker.CLOSED)
+        self.breaker.record_failure(ErrorClass.TRANSIENT)
+        self.assertEqual(self.breaker.state, CircuitBreaker.OPEN)
+        self.assertFalse(self.breaker.available())
+        self.assertEqual(self.breaker.retry_after(), 10)
+
+    def test_success_resets_failure_count(self):
+        for _ in range(2):
+            self.breaker.record_failure(ErrorClass.TRANSIENT)
+        self.breaker.record_success()
+        for _ in range(2):
+            self.breaker.record_failure(ErrorClass.TRANSIENT)
+        self.assertEqual(self.breaker.state, CircuitBreaker.CLOSED)
+
+    def test_quota_and_auth_open_immediately(self):
+        self.breaker.record_failure(ErrorClass.QUOTA)
+        self.assertEqual(self.breaker.state, CircuitBreaker.OPEN)
+        self.assertEqual(self.breaker.retry_after(), 20)
+
+        auth_breaker = CircuitBreaker(auth_cooldown=3600)
+        auth_breaker.record_failure(ErrorClass.AUTH)
+        self.assertEqual(auth_breaker.retry_after(), 3600)
+
+    def test_request_errors_ignored(self):
+        for _ in range(10):
+            self.breaker.record_failure(ErrorClass.REQUEST)
+        self.assertEqual(self.breaker.state, CircuitBreaker.CLOSED)
+        self.assertEqual(self.breaker.health, 1.0)
+
+    def test_half_open_allows_single_probe(self):
+        self.open_transient()
+        self.clock.advance(10)
+        self.assertTrue(self.breaker.available())
+        self.breaker.on_selected()
+        self.assertEqual(self.breaker.state, CircuitBreaker.HALF_OPEN)
+        self.assertFalse(self.breaker.available())
+        # 探测请求没有实际发送时释放探测名额
+        self.breaker.on_released()
+        self.assertTrue(self.breaker.available())
+
+    def test_probe_success_closes(self):
+        self.open_transient()
+        self.clock.advance(10)
+        self.breaker.on_selected()
+        self.breaker.record_success()
+        self.assertEqual(self.breaker.state, CircuitBreaker.CLOSED)
+        self.assertEqual(self.breaker.open_count, 0)
+        self.assertTrue(self.breaker.available())
+
+    def test_probe_failure_doubles_cooldown(self):
+        self.open_transient()
+        for cooldown in (20, 40, 40):
+            self.clock.advance(self.breaker.retry_after())
+            self.breaker.on_selected()
+            self.breaker.record_failure(ErrorClass.TRANSIENT)
+            self.assertEqual(self.breaker.state, CircuitBreaker.OPEN)
+            # 冷却时间加倍，不超过 max_cooldown
+            self.assertEqual(self.breaker.retry_after(), cooldown)
+
+    def test_health(self):
+        self.breaker.record_failure(ErrorClass.TRANSIENT)
+        self.assertAlmostEqual(self.breaker.health, 0.8)
+        self.breaker.record_success()
+        self.assertAlmostEqual(self.breaker.health, 0.84)
+
+class BreakerPoolTestCase(ClientPoolTestCase):
+    """熔断的客户端不会被选中"""
+    def test_open_breaker_excludes_client(self):
+        self.pool._record_failure(self.pool.client_status[self.first], '401 Unauthorized')
+        self.assertEqual({self.acquire() for _ in range(2)}, {self.second})
+
+    def test_all_open_beyond_max_circuit_wait(self):
+        for client in (self.first, self.second):
+            self.pool._record_failure(self.pool.client_status[client], '401 Unauthorized')
+        self.assertIsNone(self.acquire())
+        with self.pool.pool_lock:
+            self.assertIsNone(self.pool._wait_time_locked())
+
+class BrokenClient(FakeClient):
+    def chat_with_text(self, message):
+        return {'error': '404 Not Found'}
+
+class WorkingClient(FakeClient):
+    def chat_with_text(self, message):
+        return {'text': f"reply to {message}"}
+
+class FailoverTestCase(SimpleTestCase):
+    """只与某个密钥有关的错误换下一个密钥重试"""
+    def setUp(self):
+        self.broken = BrokenClient('broken-key')
+        self.working = WorkingClient('working-key')
+        self.pool = ClientPool([self.broken, self.working], retry_delay=0)
+
+    def test_404_fails_over_to_next_key(self):
+        # 总是选择第一个可用的客户端，保证先使用出错的密钥
+        with mock.patch('clients.client_pool.random.choices', lambda clients, weights: clients[:1]):
+            result = self.pool.execute_with_retry('chat_with_text', 'hello', use_cache=False)
+
+        self.assertEqual(result['text'], 'reply to hello')
+        self.assertEqual(self.pool.client_status[self.broken].breaker.state, CircuitBreaker.OPEN)
+        self.assertEqual(self.pool.client_status[self.broken].failed_requests, 1)
+
@@ -0,0 +1,74 @@
+from api.tests.helpers import ClockTestCase, ClientPoolTestCase
+from clients.circuit_breaker import CircuitBreaker
+from clients.concurrency import AIMDConcurrency
+from clients.qos import Lane
+
+class AIMDConcurrencyTestCase(ClockTestCase):
+    clock_modules = ('clients.concurrency',)
+
+    def test_additive_increase_when_saturated(self):
+        concurrency = AIMDConcurrency(initial_limit=2, max_limit=4)
+        for _ in range(3):
+            concurrency.on_success('chat_with_text', 1.0, in_flight=2)
+        # 每个成功请求增加 1/limit，约一轮请求增加 1
+        self.assertEqual(concurrency.max_in_flight, 3)
+
+    def test_no_increase_when_idle(self):
+        concurrency = AIMDConcurrency(initial_limit=2)
+        for _ in range(20):
+            concurrency.on_success('chat_with_text', 1.0, in_flight=1)
+        self.assertEqual(concurrency.limit, 2)
+
+    def test_capped_at_max_limit(self):
+        concurrency = AIMDConcurrency(initial_limit=3, max_limit=4)
+        for _ in range(50):
+            concurrency.on_success('chat_with_text', 1.0, in_flight=concurrency.max_in_flight)
+        self.assertEqual(concurrency.limit, 4)
+
+    def test_quota_error_halves_once_per_window(self):
+        concurrency = AIMDConcurrency(initial_limit=8)
+        concurrency.on_quota_error()
+        self.assertEqual(concurrency.limit, 4)
+        # 同一轮请求内的多个 429 只缩减一次
+        concurrency.on_quota_error()
+        self.assertEqual(concurrency.limit, 4)
+        self.clock.advance(1)
+        concurrency.on_quota_error()
+        self.assertEqual(concurrency.limit, 2)
+
+    def test_decrease_floor(self):
+        concurrency = AIMDConcurrency(initial_limit=2, min_limit=1)
+        for _ in range(5):
+            concurrency.on_quota_error()
+            self.clock.advance(1)
+        self.assertEqual(concurrency.limit, 1)
+        self.assertEqual(concurrency.max_in_flight, 1)
+
+    def test_transient_error_backoff(self):
+        concurrency = AIMDConcurrency(initial_limit=10)
+        concurrency.on_transient_error()
+        self.assertAlmostEqual(concurrency.limit, 8)
+
+    def test_latency_increase_backoff(self):
+        concurrency = AIMDConcurrency(initial_limit=10, min_samples=10)
+        for _ in range(10):
+            concurrency.on_success('chat_with_text', 1.0, in_flight=1)
+        for _ in range(10):
+            concurrency.on_success('chat_with_text', 10.0, in_flight=1)
+        self.assertLess(concurrency.limit, 10)
+
+class ConcurrencyPoolTestCase(ClientPoolTestCase):
+    """客户端池按每个密钥的并发上限分配名额"""
+    def test_concurrency_limit(self):
+        acquired = [self.acquire() for _ in range(4)]
+        self.assertEqual(sorted(client.api_key for client in acquired), ['first-key', 'first-key', 'second-key', 'second-key'])
+        self.assertIsNone(self.acquire())
+        # 释放名额后可以再次选中
+        self.pool._release(self.pool.client_status[self.first], Lane.INTERACTIVE)
+        self.assertIs(self.acquire(), self.first)
+
+    def test_quota_error_shrinks_concurrency(self):
+        status = self.pool.client_status[self.first]
+        self.pool._record_failure(status, '429 Too Many Requests')
+        self.assertEqual(status.breaker.state, CircuitBreaker.OPEN)
+        self.assertEqual(status.concurrency.max_in_flight, 1)
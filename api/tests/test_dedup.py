@@ -0,0 +1,73 @@
+import shutil
+import tempfile
+from pathlib import Path
+
+from django.test import TestCase, override_settings
+
+from api.models import Task, Document, Collection
+from pipeline.document_pipeline import DocumentPipeline
+
+class DuplicateTestCase(TestCase):
+    """内容相同的上传复用已处理完成的文档"""
+    def setUp(self):
+        self.pipeline = DocumentPipeline()
+        self.temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.temp_dir, True)
+        self.source_task = Task.objects.create(
+            title='source', file_path='source.pdf', status=Task.Status.COMPLETED, content_hash='abc'
+        )
+        self.document = Document.objects.create(
+            title='source', linked_file_path=self.temp_dir, linked_task=self.source_task, content_hash='abc'
+        )
+        self.collection = Collection.objects.create(name='collection')
+
+    def upload(self) -> str:
+        path = Path(self.temp_dir) / 'upload.pdf'
+        path.write_bytes(b'%PDF-1.4')
+        return str(path)
+
+    def test_add_task_links_duplicate(self):
+        file_path = self.upload()
+        task_id = self.pipeline.add_task('upload', file_path, self.collection.id, 'abc')
+
+        task = Task.objects.get(id=task_id)
+        self.assertEqual(task.status, Task.Status.COMPLETED)
+        self.assertEqual(task.progress, 100)
+        self.assertEqual(task.metadata['duplicate_of'], self.document.id)
+        self.assertIn(self.document, self.collection.documents.all())
+        self.assertEqual(Document.objects.count(), 1)
+        self.assertFalse(Path(file_path).exists())
+        # 已完成的任务不进入队列
+        self.assertFalse(self.pipeline.wakeup_event.is_set())
+        self.assertIsNone(self.pipeline._claim_task())
+
+    def test_add_task_without_duplicate_queued(self):
+        file_path = self.upload()
+        task_id = self.pipeline.add_task('upload', file_path, self.collection.id, 'other')
+
+        task = Task.objects.get(id=task_id)
+        self.assertEqual(task.status, Task.Status.PENDING)
+        self.assertTrue(self.pipeline.wakeup_event.is_set())
+        self.assertTrue(Path(file_path).exists())
+        self.assertFalse(self.collection.documents.exists())
+
+    def test_unfinished_document_not_reused(self):
+        Task.objects.filter(id=self.source_task.id).update(status=Task.Status.FAILED)
+        self.assertIsNone(self.pipeline._find_duplicate('abc'))
+        self.assertIsNone(self.pipeline._find_duplicate(None))
+
+    def test_duplicate_finished_while_queued(self):
+        # 排队期间已有相同内容的文档处理完成，领取后直接链接
+        file_path = self.upload()
+        Task.objects.create(title='upload', file_path=file_path, collection_id=self.collection.id, content_hash='abc')
+        task = self.pipeline._claim_task()
+
+        with override_settings(PERSIST_DIR=self.temp_dir):
+            self.assertEqual(self.pipeline._process_document(task), self.document)
+
+        task.refresh_from_db()
+        self.assertEqual(task.status, Task.Status.COMPLETED)
+        self.assertIsNone(task.lease_owner)
+        self.assertEqual(task.metadata['duplicate_of'], self.document.id)
+        self.assertIn(self.document, self.collection.documents.all())
+        self.assertFalse(Path(file_path).exists())
@@ -0,0 +1,34 @@
+from django.test import SimpleTestCase
+
+from prepdocs.parse_images import split_marked_pages
+
+class SplitMarkedPagesTestCase(SimpleTestCase):
+    """按页面标记拆分批量解析的结果"""
+    def test_all_pages(self):
+        text = "<<<PAGE 1>>>\n# Title\n\n<<<PAGE 2>>>\nbody\n<<<PAGE 3>>>\n| a | b |"
+        self.assertEqual(split_marked_pages(text, 3), ['# Title', 'body', '| a | b |'])
+
+    def test_marker_with_spaces(self):
+        self.assertEqual(split_marked_pages("  <<<PAGE 1>>>  \none\n<<<PAGE 2>>>\ntwo", 2), ['one', 'two'])
+
+    def test_inline_marker_not_split(self):
+        text = "<<<PAGE 1>>>\nsee <<<PAGE 2>>> here\n<<<PAGE 2>>>\ntwo"
+        self.assertEqual(split_marked_pages(text, 2), ['see <<<PAGE 2>>> here', 'two'])
+
+    def test_truncated_output_drops_last_page(self):
+        # 只输出了前两个标记，第 2 页可能被截断
+        text = "<<<PAGE 1>>>\none\n<<<PAGE 2>>>\ntw"
+        self.assertEqual(split_marked_pages(text, 3), ['one'])
+
+    def test_text_before_first_marker(self):
+        self.assertEqual(split_marked_pages("Sure!\n<<<PAGE 1>>>\none\n<<<PAGE 2>>>\ntwo", 2), [])
+
+    def test_out_of_order_markers(self):
+        self.assertEqual(split_marked_pages("<<<PAGE 2>>>\ntwo\n<<<PAGE 1>>>\none", 2), [])
+        self.assertEqual(split_marked_pages("<<<PAGE 1>>>\none\n<<<PAGE 3>>>\nthree", 3), [])
+
+    def test_too_many_markers(self):
+        self.assertEqual(split_marked_pages("<<<PAGE 1>>>\none\n<<<PAGE 2>>>\ntwo", 1), [])
+
+    def test_no_markers(self):
+        self.assertEqual(split_marked_pages("one\n\ntwo", 2), [])
@@ -0,0 +1,94 @@
+from datetime import timedelta
+
+from django.test import TestCase
+from django.utils import timezone
+
+from api.models import Task
+from pipeline.document_pipeline import DocumentPipeline, LeaseLostError
+
+class LeaseTestCase(TestCase):
+    """任务领取、租约过期后重新领取、重试次数上限和按租约持有者写入"""
+    def setUp(self):
+        # 不调用 start()，由测试直接领取任务
+        self.pipeline = DocumentPipeline(max_attempts=2)
+        self.other = DocumentPipeline(max_attempts=2)
+
+    @staticmethod
+    def create_task(**kwargs):
+        return Task.objects.create(title='doc', file_path='doc.pdf', collection_id=0, **kwargs)
+
+    @staticmethod
+    def expire_lease(task: Task):
+        Task.objects.filter(id=task.id).update(lease_expires_at=timezone.now() - timedelta(seconds=1))
+
+    def test_claim_sets_lease(self):
+        task = self.create_task()
+        claimed = self.pipeline._claim_task()
+        self.assertEqual(claimed.id, task.id)
+        self.assertEqual(claimed.lease_owner, self.pipeline.worker_id)
+        self.assertEqual(claimed.attempts, 1)
+        self.assertGreater(claimed.lease_expires_at, timezone.now())
+
+    def test_claim_in_creation_order(self):
+        first = self.create_task()
+        second = self.create_task()
+        self.assertEqual(self.pipeline._claim_task().id, first.id)
+        self.assertEqual(self.other._claim_task().id, second.id)
+
+    def test_leased_task_not_claimed_again(self):
+        self.create_task()
+        self.assertIsNotNone(self.pipeline._claim_task())
+        self.assertIsNone(self.other._claim_task())
+
+    def test_finished_task_not_claimed(self):
+        self.create_task(status=Task.Status.COMPLETED)
+        self.create_task(status=Task.Status.FAILED)
+        self.assertIsNone(self.pipeline._claim_task())
+
+    def test_expired_lease_reclaimed(self):
+        task = self.create_task()
+        self.pipeline._claim_task()
+        self.expire_lease(task)
+        claimed = self.other._claim_task()
+        self.assertEqual(claimed.lease_owner, self.other.worker_id)
+        self.assertEqual(claimed.attempts, 2)
+
+    def test_stale_worker_fenced(self):
+        task = self.create_task()
+        stale = self.pipeline._claim_task()
+        self.expire_lease(task)
+        current = self.other._claim_task()
+
+        with self.assertRaises(LeaseLostError):
+            self.pipeline._update_task_status(stale, Task.Status.EXTRACTING, 50)
+        self.other._update_task_status(current, Task.Status.TRANSLATING, 75)
+
+        task.refresh_from_db()
+        self.assertEqual(task.lease_owner, self.other.worker_id)
+        self.assertEqual(task.status, Task.Status.TRANSLATING)
+        self.assertEqual(task.progress, 75)
+
+    def test_completion_releases_lease(self):
+        task = self.create_task()
+        claimed = self.pipeline._claim_task()
+        self.pipeline._update_task_status(claimed, Task.Status.COMPLETED, 100)
+        task.refresh_from_db()
+        self.assertEqual(task.status, Task.Status.COMPLETED)
+        self.assertIsNone(task.lease_owner)
+        self.assertIsNone(task.lease_expires_at)
+        self.assertIsNotNone(task.completed_at)
+
+    def test_max_attempts(self):
+        task = self.create_task()
+        self.pipeline._claim_task()
+        self.expire_lease(task)
+        self.other._claim_task()
+        self.expire_lease(task)
+
+        # 已领取 max_attempts 次仍未完成，标记为失败而不是再次领取
+        self.assertIsNone(self.pipeline._claim_task())
+        task.refresh_from_db()
+        self.assertEqual(task.status, Task.Status.FAILED)
+        self.assertEqual(task.attempts, 2)
+        self.assertIsNone(task.lease_owner)
+        self.assertIn('2', task.error_message)
@@ -0,0 +1,73 @@
+from api.tests.helpers import ClockTestCase, ClientPoolTestCase
+from clients.rate_limiter import TokenBucket, RateLimiter
+
+class TokenBucketTestCase(ClockTestCase):
+    clock_modules = ('clients.rate_limiter',)
+
+    def test_refill(self):
+        bucket = TokenBucket(60)
+        self.assertEqual(bucket.wait_time(1), 0)
+        bucket.consume(60)
+        self.assertAlmostEqual(bucket.wait_time(1), 1)
+        self.clock.advance(30)
+        self.assertEqual(bucket.wait_time(30), 0)
+        self.assertAlmostEqual(bucket.tokens, 30)
+
+    def test_refill_capped_at_capacity(self):
+        bucket = TokenBucket(60)
+        self.clock.advance(600)
+        bucket.consume(0)
+        self.assertEqual(bucket.tokens, 60)
+
+    def test_oversized_request_waits_for_full_bucket(self):
+        bucket = TokenBucket(100)
+        bucket.consume(50)
+        self.assertAlmostEqual(bucket.wait_time(1000), 30)
+        bucket.consume(1000)
+        self.assertEqual(bucket.tokens, -50)
+
+    def test_refund(self):
+        bucket = TokenBucket(60)
+        bucket.consume(10)
+        bucket.refund(20)
+        self.assertEqual(bucket.tokens, 60)
+
+    def test_set_limit_keeps_consumed(self):
+        bucket = TokenBucket(60)
+        bucket.consume(50)
+        bucket.set_limit(120)
+        self.assertEqual(bucket.capacity, 120)
+        self.assertEqual(bucket.tokens, 10)
+        bucket.set_limit(5)
+        self.assertEqual(bucket.tokens, 5)
+
+    def test_rate_limiter(self):
+        limiter = RateLimiter(rpm_limit=2, tpm_limit=1000)
+        limiter.acquire(100)
+        self.assertEqual(limiter.wait_time(100), 0)
+        limiter.acquire(100)
+        # RPM 用尽，等待补充一个请求
+        self.assertAlmostEqual(limiter.wait_time(100), 30)
+        limiter.refund(100)
+        # TPM 不足时按 token 数等待
+        self.assertAlmostEqual(limiter.wait_time(1000), 6)
+
+    def test_rate_limiter_without_limits(self):
+        limiter = RateLimiter()
+        limiter.acquire(10 ** 6)
+        self.assertEqual(limiter.wait_time(10 ** 6), 0)
+        limiter.update_limits(rpm_limit=1, tpm_limit=None)
+        self.assertIsNone(limiter.tokens)
+        self.assertEqual(limiter.requests.capacity, 1)
+
+class RateLimitedPoolTestCase(ClientPoolTestCase):
+    """配额不足的客户端不会被选中"""
+    def test_rate_limit_excludes_client(self):
+        for client in (self.first, self.second):
+            self.pool.client_status[client].rate_limiter.update_limits(rpm_limit=1, tpm_limit=None)
+        self.assertIsNotNone(self.acquire())
+        self.assertIsNotNone(self.acquire())
+        self.assertIsNone(self.acquire())
+        with self.pool.pool_lock:
+            # 等待配额恢复，而不是等待名额释放
+            self.assertGreater(self.pool._wait_time_locked(), 30)
@@ -0,0 +1,134 @@
+import asyncio
+from unittest import mock
+
+from asgiref.sync import async_to_sync
+from django.test import SimpleTestCase, TestCase
+
+from backend.setup_env import global_env
+
+from api.models import TranslationMemory
+from prepdocs import translation_memory
+from prepdocs.translate import (
+    MAX_SEGMENTS_PER_CHUNK, PROMPT_VERSION, SEGMENT_MARKER_RE,
+    pack_segments, split_marked_translation, translate_chunk, translate_pages
+)
+from prepdocs.translation_memory import segment_hash
+
+class FakeClientPool:
+    """
+    按提示词中的段落标记返回译文的客户端池
+    :param max_segments: 一次请求超过该段落数时返回丢失标记的译文
+    :param misaligned: 多段请求返回的每段译文都与原文长度不对应
+    """
+    def __init__(self, max_segments: int = MAX_SEGMENTS_PER_CHUNK, misaligned: bool = False):
+        self.max_segments = max_segments
+        self.misaligned = misaligned
+        self.requests = []
+
+    def get_model_names(self, operation):
+        return ['fake-model']
+
+    async def aexecute_with_retry(self, operation, prompt):
+        parts = SEGMENT_MARKER_RE.split(prompt)
+        ids, segments = parts[1::2], [part.strip() for part in parts[2::2]]
+        if not ids:
+            # 单个段落的请求，提示词最后一行是原文
+            self.requests.append(1)
+            return {'text': f"T:{prompt.strip().splitlines()[-1]}", 'model': 'fake-model'}
+        self.requests.append(len(ids))
+        if len(ids) > self.max_segments:
+            return {'text': 'T:' + ' '.join(segments), 'model': 'fake-model'}
+        if self.misaligned:
+            return {'text': '\n\n'.join(f"<<<{i}>>>\nT" for i in ids), 'model': 'fake-model'}
+        return {'text': '\n\n'.join(f"<<<{i}>>>\nT:{segment}" for i, segment in zip(ids, segments)),
+                'model': 'fake-model'}
+
+def make_chunk(segments: list[str]) -> list[tuple[str, str]]:
+    return [(segment_hash(segment), segment) for segment in segments]
+
+class PackSegmentsTestCase(SimpleTestCase):
+    """按 token 预算打包段落和按标记拆分译文"""
+    def test_pack_segments_by_tokens(self):
+        # 每个段落约 11 个 token
+        segments = make_chunk([f"{i}" * 40 for i in range(5)])
+        chunks = pack_segments(segments, max_tokens=25)
+        self.assertEqual([len(chunk) for chunk in chunks], [2, 2, 1])
+        self.assertEqual([segment for chunk in chunks for segment in chunk], segments)
+
+    def test_pack_segments_oversized_segment(self):
+        segments = make_chunk(['short', 'x' * 400, 'short too'])
+        chunks = pack_segments(segments, max_tokens=20)
+        self.assertEqual(chunks, [segments[:1], segments[1:2], segments[2:]])
+
+    def test_pack_segments_by_count(self):
+        segments = make_chunk([f"segment {i}" for i in range(MAX_SEGMENTS_PER_CHUNK + 1)])
+        chunks = pack_segments(segments, max_tokens=100000)
+        self.assertEqual([len(chunk) for chunk in chunks], [MAX_SEGMENTS_PER_CHUNK, 1])
+
+    def test_split_marked_translation(self):
+        self.assertEqual(split_marked_translation("<<<1>>>\n一\n\n<<<2>>>\n二", 2), ['一', '二'])
+
+    def test_split_marked_translation_rejects_mismatch(self):
+        self.assertIsNone(split_marked_translation("<<<1>>>\n一", 2))
+        self.assertIsNone(split_marked_translation("<<<2>>>\n二\n<<<1>>>\n一", 2))
+        self.assertIsNone(split_marked_translation("译文：\n<<<1>>>\n一\n<<<2>>>\n二", 2))
+        self.assertIsNone(split_marked_translation("<<<1>>>\n\n<<<2>>>\n二", 2))
+
+class TranslateChunkTestCase(TestCase):
+    """一次请求翻译多个段落，拆分失败时对半拆分重试"""
+    def translate(self, client_pool, segments: list[str]) -> dict[str, str]:
+        return async_to_sync(translate_chunk)(client_pool, make_chunk(segments), 'Simplified Chinese')
+
+    def test_translate_and_store(self):
+        segments = ['first paragraph', 'second paragraph']
+        client_pool = FakeClientPool()
+        results = self.translate(client_pool, segments)
+
+        self.assertEqual(client_pool.requests, [2])
+        self.assertEqual(results, {segment_hash(segment): f"T:{segment}" for segment in segments})
+        memory = translation_memory.lookup(segments, 'Simplified Chinese', PROMPT_VERSION)
+        self.assertEqual(memory, results)
+        self.assertEqual(set(TranslationMemory.objects.values_list('model', flat=True)), {'fake-model'})
+
+    def test_halving_on_missing_markers(self):
+        segments = [f"paragraph {i}" for i in range(4)]
+        client_pool = FakeClientPool(max_segments=1)
+        results = self.translate(client_pool, segments)
+
+        # 4 段 -> 2 + 2 -> 1 + 1 + 1 + 1
+        self.assertEqual(sorted(client_pool.requests, reverse=True), [4, 2, 2, 1, 1, 1, 1])
+        self.assertEqual(results, {segment_hash(segment): f"T:{segment}" for segment in segments})
+
+    def test_halving_on_misaligned_segments(self):
+        segments = [f"paragraph {i} " + 'long sentence ' * 5 for i in range(2)]
+        client_pool = FakeClientPool(misaligned=True)
+        results = self.translate(client_pool, segments)
+
+        self.assertEqual(client_pool.requests, [2, 1, 1])
+        self.assertEqual(results, {segment_hash(segment): f"T:{segment.strip()}" for segment in segments})
+
+class TranslatePagesTestCase(TestCase):
+    """多个页面的段落按 token 预算合并到同一个请求中"""
+    def translate(self, client_pool, contents: list[str]) -> dict:
+        done = {}
+
+        async def on_page_done(idx, page):
+            done[idx] = page.content
+
+        with mock.patch.dict(global_env, {'gemini_client_pool': client_pool}):
+            async_to_sync(translate_pages)(client_pool, contents, 'Simplified Chinese', on_page_done,
+                                           asyncio.Semaphore(2))
+        return done
+
+    def test_small_pages_share_request(self):
+        contents = ['first page', 'second page', 'third page']
+        client_pool = FakeClientPool()
+        done = self.translate(client_pool, contents)
+
+        self.assertEqual(client_pool.requests, [3])
+        self.assertEqual(done, {i: f"T:{content}" for i, content in enumerate(contents)})
+
+    def test_failed_request_skips_pages(self):
+        client_pool = FakeClientPool()
+        client_pool.aexecute_with_retry = mock.AsyncMock(return_value={'error': 'quota exceeded'})
+        self.assertEqual(self.translate(client_pool, ['first page', 'second page']), {})
@@ -0,0 +1,68 @@
+from django.test import SimpleTestCase, TestCase
+
+from api.models import TranslationMemory
+from prepdocs import translation_memory
+from prepdocs.translate import PROMPT_VERSION
+from prepdocs.translation_memory import split_segments, segment_hash, is_aligned
+
+class SegmentTestCase(SimpleTestCase):
+    """按段落切分页面和判断译文是否对应原文"""
+    def test_split_segments(self):
+        content = "# Title\n\nfirst line\nsecond line\n\n\n\nlast"
+        self.assertEqual(split_segments(content), ['# Title', 'first line\nsecond line', 'last'])
+
+    def test_split_segments_keeps_blocks(self):
+        content = "before\n\n```\ncode\n\nmore code\n```\n\n$$\na\n\nb\n$$\n\n$$x$$\n\nafter"
+        self.assertEqual(split_segments(content), [
+            'before', "```\ncode\n\nmore code\n```", "$$\na\n\nb\n$$", '$$x$$', 'after'
+        ])
+
+    def test_split_segments_empty(self):
+        self.assertEqual(split_segments(''), [])
+        self.assertEqual(split_segments(None), [])
+
+    def test_is_aligned(self):
+        source = 'word ' * 20
+        self.assertTrue(is_aligned(source, '词' * 30))
+        self.assertFalse(is_aligned(source, '词'))
+        self.assertFalse(is_aligned(source, '词' * 500))
+        # 原文较短时只要求译文非空
+        self.assertTrue(is_aligned('Hi', '你好，世界'))
+        self.assertFalse(is_aligned('Hi', ' '))
+
+class TranslationMemoryTestCase(TestCase):
+    """按提示词版本查询、保存和清除翻译记忆"""
+    def test_misaligned_pairs_not_stored(self):
+        source = 'a long paragraph that is clearly longer than the checked length'
+        translation_memory.store([(source, '短'), ('Hi', '你好')], 'Simplified Chinese', PROMPT_VERSION, 'fake-model')
+        memory = translation_memory.lookup([source, 'Hi'], 'Simplified Chinese', PROMPT_VERSION)
+        self.assertEqual(memory, {segment_hash('Hi'): '你好'})
+
+    def test_lookup_in_batches(self):
+        segments = [f"segment {i}" for i in range(translation_memory.LOOKUP_BATCH_SIZE + 10)]
+        translation_memory.store([(segment, f"段落 {segment}") for segment in segments],
+                                 'Simplified Chinese', PROMPT_VERSION, 'fake-model')
+        memory = translation_memory.lookup(segments, 'Simplified Chinese', PROMPT_VERSION)
+        self.assertEqual(len(memory), len(segments))
+        self.assertFalse(translation_memory.lookup(segments, 'Simplified Chinese', 'other-version'))
+
+    def test_evict_by_model(self):
+        translation_memory.store([('Hello', '你好')], 'Simplified Chinese', PROMPT_VERSION, 'bad-model')
+        translation_memory.store([('World', '世界')], 'Simplified Chinese', PROMPT_VERSION, 'good-model')
+        self.assertEqual(translation_memory.evict(model='bad-model'), 1)
+        memory = translation_memory.lookup(['Hello', 'World'], 'Simplified Chinese', PROMPT_VERSION)
+        self.assertEqual(memory, {segment_hash('World'): '世界'})
+
+    def test_lookup_prefers_current_model(self):
+        for model in ('old-model', 'new-model', 'other-model'):
+            translation_memory.store([('Hello', f"你好 {model}")], 'Simplified Chinese', PROMPT_VERSION, model)
+
+        memory = translation_memory.lookup(['Hello'], 'Simplified Chinese', PROMPT_VERSION, ['new-model'])
+        self.assertEqual(memory, {segment_hash('Hello'): '你好 new-model'})
+        # 当前模型没有译文时，取最早写入的一条
+        memory = translation_memory.lookup(['Hello'], 'Simplified Chinese', PROMPT_VERSION, ['missing-model'])
+        self.assertEqual(memory, {segment_hash('Hello'): '你好 old-model'})
+
+        hit_counts = dict(TranslationMemory.objects.values_list('model', 'hit_count'))
+        self.assertEqual(hit_counts, {'old-model': 1, 'new-model': 1, 'other-model': 0})
+
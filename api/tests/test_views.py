@@ -0,0 +1,102 @@
+import json
+import shutil
+import tempfile
+from pathlib import Path
+
+from constance.test import override_config
+from django.test import TestCase
+
+from api.models import Task, Document, TextSection, Collection
+
+class RemoveDocumentTestCase(TestCase):
+    """相同内容的文档被多个集合共用时，只从当前集合中移除"""
+    def setUp(self):
+        session = self.client.session
+        session['is_superuser'] = True
+        session.save()
+
+        self.document_dir = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, self.document_dir, True)
+        (self.document_dir / 'original.pdf').write_bytes(b'%PDF-1.4')
+
+        self.task = Task.objects.create(title='doc', file_path='doc.pdf', status=Task.Status.COMPLETED, content_hash='abc')
+        self.document = Document.objects.create(
+            title='doc', linked_file_path=str(self.document_dir), linked_task=self.task, content_hash='abc'
+        )
+        self.english = TextSection.objects.create(linked_file_path=str(self.document_dir), title='en')
+        self.chinese = TextSection.objects.create(linked_file_path=str(self.document_dir), title='zh')
+        self.document.english_sections.add(self.english)
+        self.document.chinese_sections.add(self.chinese)
+
+        self.first = Collection.objects.create(name='first')
+        self.second = Collection.objects.create(name='second')
+        self.first.documents.add(self.document)
+        self.second.documents.add(self.document)
+        Task.objects.filter(id=self.task.id).update(collection_id=self.first.id)
+
+    def remove(self, **data):
+        return self.client.post('/api/documents/remove/', json.dumps(data), content_type='application/json')
+
+    def test_remove_shared_document_keeps_other_collection(self):
+        response = self.remove(document_id=self.document.id, collection_id=self.first.id)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(self.first.documents.exists())
+        self.assertIn(self.document, self.second.documents.all())
+        self.assertEqual(TextSection.objects.filter(id__in=[self.english.id, self.chinese.id]).count(), 2)
+        self.assertTrue(self.document_dir.exists())
+
+    def test_remove_last_reference_deletes_document(self):
+        self.remove(document_id=self.document.id, collection_id=self.first.id)
+        response = self.remove(document_id=self.document.id, collection_id=self.second.id)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(Document.objects.filter(id=self.document.id).exists())
+        self.assertFalse(TextSection.objects.filter(id__in=[self.english.id, self.chinese.id]).exists())
+        self.assertFalse(self.document_dir.exists())
+
+    def test_missing_collection_id(self):
+        response = self.remove(document_id=self.document.id)
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.document.collections.count(), 2)
+
+    def test_unknown_ids(self):
+        self.assertEqual(self.remove(document_id=0, collection_id=self.first.id).status_code, 404)
+        self.assertEqual(self.remove(task_id=0).status_code, 404)
+
+    def test_remove_task_of_shared_document(self):
+        response = self.remove(task_id=self.task.id)
+
+        # 文档仍被另一个集合使用，保留文档和它依赖的任务
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(self.first.documents.exists())
+        self.assertIn(self.document, self.second.documents.all())
+        self.assertTrue(Task.objects.filter(id=self.task.id).exists())
+        self.assertTrue(self.document_dir.exists())
+
+    def test_remove_task_of_last_reference(self):
+        self.second.documents.remove(self.document)
+        response = self.remove(task_id=self.task.id)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(Task.objects.filter(id=self.task.id).exists())
+        self.assertFalse(Document.objects.filter(id=self.document.id).exists())
+        self.assertFalse(self.document_dir.exists())
+
+    def test_remove_pending_task(self):
+        task = Task.objects.create(title='pending', file_path='pending.pdf', collection_id=self.first.id)
+        response = self.remove(task_id=task.id)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(Task.objects.filter(id=task.id).exists())
+        self.assertEqual(self.document.collections.count(), 2)
+
+    @override_config(GUEST_CAN_DELETE=False)
+    def test_requires_permission(self):
+        # 未登录的访客
+        self.client.cookies.clear()
+        response = self.remove(document_id=self.document.id, collection_id=self.first.id)
+
+        self.assertEqual(response.status_code, 403)
+        self.assertEqual(self.document.collections.count(), 2)
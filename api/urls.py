@@ -4,10 +4,14 @@ from . import views
 urlpatterns = [
     path('gemini_chat', views.gemini_chat, name='gemini_chat'),
     path('gemini_chat_image', views.gemini_chat_image, name='gemini_chat_image'),
+    path('gemini_chat_stream', views.gemini_chat_stream, name='gemini_chat_stream'),
     path('add_api_key', views.add_api_key, name='add_api_key'),
     path('upload_api_keys', views.upload_api_keys, name='upload_api_keys'),
     path('list_api_keys', views.list_api_keys, name='list_api_keys'),
     path('delete_api_key', views.delete_api_key, name='delete_api_key'),
+    path('llm_cache_stats', views.llm_cache_stats, name='llm_cache_stats'),
+    path('llm_lane_stats', views.llm_lane_stats, name='llm_lane_stats'),
+    path('pipeline_workers', views.pipeline_workers, name='pipeline_workers'),
     # 项目相关的端点
     path('projects/', views.list_projects, name='list_projects'),
     path('projects/create/', views.create_project, name='create_project'),
@@ -23,6 +27,7 @@ urlpatterns = [
     path('documents/remove/', views.remove_document, name='remove_document'),
     path('documents/<int:document_id>/', views.get_document, name='get_document'),
     path('documents/status/<str:task_id>/', views.get_document_status, name='get_document_status'),
+    path('documents/retry/<int:task_id>/', views.retry_document, name='retry_document'),
     path('documents/view/<int:document_id>.pdf', views.view_document, name='view_document'),
     path('documents/text_section/<int:document_id>/', views.get_document_text_section, name='get_document_text_section'),
     path('documents/thumbnail/<int:document_id>.png', views.get_document_thumbnail, name='get_document_thumbnail'),
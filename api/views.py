@@ -1,8 +1,11 @@
+import asyncio
 import datetime
+import time
 
-from asgiref.sync import async_to_sync
+from asgiref.sync import async_to_sync, sync_to_async, iscoroutinefunction
 from django.shortcuts import render
-from django.http import JsonResponse, FileResponse
+from django.conf import settings
+from django.http import JsonResponse, FileResponse, StreamingHttpResponse
 import json
 
 from django.utils.timezone import localtime
@@ -11,14 +14,19 @@ from backend.setup_env import global_env
 from clients.gemini_client import GeminiClient
 from clients.openai_client import OpenAIClient
 from clients.client_pool import ClientPool
+from clients.qos import Lane
 from .models import ApiKey, Document, Task, Project, Collection, MindMap
 from pipeline.document_pipeline import DocumentPipeline
+from pipeline.checkpoint import TaskCheckpoint
 import tempfile
+import hashlib
+import shutil
 import logging
 import io
 from pathlib import Path
 from constance import config
 from django.utils import timezone
+from django.db import transaction
 
 logger = logging.getLogger(__name__)
 
@@ -51,9 +59,20 @@ def require_delete_permission(func):
         return func(request, *args, **kwargs)
     return wrapper
 
+def can_use_api(request):
+    return request.session.get('is_superuser') or config.GUEST_CAN_USE_API
+
 def require_use_api_permission(func):
+    if iscoroutinefunction(func):
+        # 异步视图：session 和 constance 配置需要在线程中读取
+        async def async_wrapper(request, *args, **kwargs):
+            if not await sync_to_async(can_use_api)(request):
+                return JsonResponse({'error': '权限不足'}, status=403)
+            return await func(request, *args, **kwargs)
+        return async_wrapper
+
     def wrapper(request, *args, **kwargs):
-        if not request.session.get('is_superuser') and not config.GUEST_CAN_USE_API:
+        if not can_use_api(request):
             return JsonResponse({'error': '权限不足'}, status=403)
         return func(request, *args, **kwargs)
     return wrapper
@@ -103,57 +122,102 @@ def change_password(request):
 
 # Create your views here.
 
+def llm_error_response(response):
+    """大模型调用失败时的响应，超过截止时间返回 504"""
+    return JsonResponse({'error': response['error']}, status=504 if response.get('timed_out') else 500)
+
+# 调用大模型的视图是异步的，等待响应时不占用工作线程
+
 @require_use_api_permission
-def gemini_chat(request):
+async def gemini_chat(request):
     json_data = json.loads(request.body)
     prompt = json_data.get('prompt')
     client_pool: ClientPool = global_env['gemini_client_pool']
-    if not client_pool._get_clients():
+    if not await client_pool.aget_clients():
         return JsonResponse({'error': 'No Client available. Please check your API keys and permissions.'}, status=500)
     
-    client = client_pool._select_client()
-    if client is None:
-        return JsonResponse({'error': 'No available client'}, status=500)
-        
-    # 动态获取并调用方法
-    chat_method = getattr(client, 'chat_with_text')
-    response = chat_method(prompt)
+    # 交互请求限制总耗时，超时后立即返回
+    response = await client_pool.aexecute_with_retry(
+        'chat_with_text', prompt,
+        use_cache=False, timeout=settings.INTERACTIVE_LLM_TIMEOUT, lane=Lane.INTERACTIVE
+    )
     
     if 'error' in response:
-        return JsonResponse({'error': response['error']}, status=500)
+        return llm_error_response(response)
     return JsonResponse({'response': response['text']})
 
 @require_use_api_permission
-def gemini_chat_image(request):
+async def gemini_chat_image(request):
     json_data = json.loads(request.body)
     prompt = json_data.get('prompt')
     image_data = json_data.get('image_data')
     image_type = json_data.get('image_type', 'base64')
     client_pool: ClientPool = global_env['gemini_client_pool']
-    if not client_pool._get_clients():
+    if not await client_pool.aget_clients():
         return JsonResponse({'error': 'No Client available. Please check your API keys and permissions.'}, status=500)
     
     # 根据是否有图片数据来决定使用哪个方法
     method_name = 'chat_with_text' if not image_data else 'chat_with_image'
     
+    # 对话中重复提问时应重新生成回答，不使用响应缓存
+    timeout = settings.INTERACTIVE_LLM_TIMEOUT
     if not image_data:
-        response = client_pool.execute_with_retry(method_name, prompt)
+        response = await client_pool.aexecute_with_retry(
+            method_name, prompt, use_cache=False, timeout=timeout, lane=Lane.INTERACTIVE
+        )
     else:
-        response = client_pool.execute_with_retry(method_name, prompt, image_data, image_type)
+        response = await client_pool.aexecute_with_retry(
+            method_name, prompt, image_data, image_type, use_cache=False, timeout=timeout, lane=Lane.INTERACTIVE
+        )
         
     if 'error' in response:
-        return JsonResponse({
-            'error': response['error']
-        }, status=500)
+        return llm_error_response(response)
     return JsonResponse({
         'response': response['text']
     })
 
+async def sse_events(events):
+    """将 {'text': 片段} 事件转换为 Server-Sent Events，失败时发送 error 事件，正常结束时发送 done 事件"""
+    async for event in events:
+        if 'error' in event:
+            yield f"event: error\ndata: {json.dumps(event, ensure_ascii=False)}\n\n"
+            return
+        yield f"data: {json.dumps(event, ensure_ascii=False)}\n\n"
+    yield "event: done\ndata: {}\n\n"
+
+@require_use_api_permission
+async def gemini_chat_stream(request):
+    """gemini_chat_image 的流式版本，以 Server-Sent Events 逐段返回回答"""
+    json_data = json.loads(request.body)
+    prompt = json_data.get('prompt')
+    image_data = json_data.get('image_data')
+    image_type = json_data.get('image_type', 'base64')
+    client_pool: ClientPool = global_env['gemini_client_pool']
+    if not await client_pool.aget_clients():
+        return JsonResponse({'error': 'No Client available. Please check your API keys and permissions.'}, status=500)
+
+    timeout = settings.INTERACTIVE_LLM_TIMEOUT
+    if not image_data:
+        events = client_pool.astream_with_retry('chat_with_text', prompt, timeout=timeout, lane=Lane.INTERACTIVE)
+    else:
+        events = client_pool.astream_with_retry(
+            'chat_with_image', prompt, image_data, image_type, timeout=timeout, lane=Lane.INTERACTIVE
+        )
+
+    response = StreamingHttpResponse(sse_events(events), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    # 禁止反向代理缓冲，片段到达后立即发送给浏览器
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
 def add_api_key(request):
         json_data = json.loads(request.body)
         key = json_data.get('key')
         base_url = json_data.get('base_url', 'https://gemini.geid.top/')
         api_type = json_data.get('apiType', 'gemini')  # 默认值为 gemini
+        # 可选的配额，为空表示不限制
+        rpm_limit = json_data.get('rpm_limit') or None
+        tpm_limit = json_data.get('tpm_limit') or None
         
         # 选择合适的 Client 进行测试
         if api_type == 'gemini':
@@ -165,8 +229,8 @@ def add_api_key(request):
         if 'error' in response:
             return JsonResponse({'error': response['error']}, status=500)
         
-        ApiKey.objects.create(key=key, base_url=base_url, api_type=api_type)
-        global_env['gemini_client_pool'] = ClientPool()
+        ApiKey.objects.create(key=key, base_url=base_url, api_type=api_type, rpm_limit=rpm_limit, tpm_limit=tpm_limit)
+        global_env['gemini_client_pool'].refresh_clients()
         return JsonResponse({'message': 'API key added successfully'})
 
 def upload_api_keys(request):
@@ -175,6 +239,8 @@ def upload_api_keys(request):
     
     api_type = request.POST.get('api_type', 'gemini')
     base_url = request.POST.get('base_url', 'https://gemini.geid.top/')
+    rpm_limit = request.POST.get('rpm_limit') or None
+    tpm_limit = request.POST.get('tpm_limit') or None
     file = request.FILES.get('file')
     if not file:
         return JsonResponse({'error': 'No file uploaded'}, status=400)
@@ -204,9 +270,9 @@ def upload_api_keys(request):
         if 'error' in response:
             return JsonResponse({'error': response['error']}, status=500)
         else:
-            ApiKey.objects.create(key=api_key, api_type=api_type)
-    # refresh gemini client pool
-    global_env['gemini_client_pool'] = ClientPool()
+            ApiKey.objects.create(key=api_key, api_type=api_type, rpm_limit=rpm_limit, tpm_limit=tpm_limit)
+    # 增量刷新客户端池，进行中的请求不受影响
+    global_env['gemini_client_pool'].refresh_clients()
     return JsonResponse({'message': 'All API keys added successfully'})
 
 @require_use_api_permission
@@ -218,9 +284,31 @@ def list_api_keys(request):
         'counter': api_key.counter,
         'created_at': localtime(api_key.created_at).strftime('%Y-%m-%d %H:%M:%S') if api_key.created_at else None,
         'last_used_at': localtime(api_key.last_used_at).strftime('%Y-%m-%d %H:%M:%S') if api_key.last_used_at else None,
-        'last_error_message': api_key.last_error_message
+        'last_error_message': api_key.last_error_message,
+        'error_count': api_key.error_count,
+        'avg_latency': round(api_key.latency_total / api_key.latency_count, 2) if api_key.latency_count else None,
+        'rpm_limit': api_key.rpm_limit,
+        'tpm_limit': api_key.tpm_limit
     } for api_key in api_keys]})
 
+@require_use_api_permission
+def llm_cache_stats(request):
+    client_pool: ClientPool = global_env['gemini_client_pool']
+    stats = client_pool.get_cache_stats()
+    if stats is None:
+        return JsonResponse({'enabled': False})
+    return JsonResponse({'enabled': True, **stats})
+
+@require_use_api_permission
+def llm_lane_stats(request):
+    client_pool: ClientPool = global_env['gemini_client_pool']
+    return JsonResponse({**client_pool.get_lane_status(), 'hedging': client_pool.get_hedge_status()})
+
+@require_superuser
+def pipeline_workers(request):
+    document_pipeline: DocumentPipeline = global_env['document_pipeline']
+    return JsonResponse(document_pipeline.get_worker_status())
+
 @require_superuser
 def delete_api_key(request):
     json_data = json.loads(request.body)
@@ -229,8 +317,8 @@ def delete_api_key(request):
     candidates = ApiKey.objects.filter(key__startswith=first_12_digits)
     candidates.first().delete()
 
-    # refresh gemini client pool
-    global_env['gemini_client_pool'] = ClientPool()
+    # 增量刷新客户端池，进行中的请求不受影响
+    global_env['gemini_client_pool'].refresh_clients()
     return JsonResponse({'message': 'API key deleted successfully'})
 
 @require_upload_permission
@@ -245,21 +333,39 @@ def add_document(request):
     if not title or not file or not collection_id:
         return JsonResponse({'error': 'Missing title or file or collection_id'}, status=400)
 
-    # 保存到临时文件，不要删除！
-    with tempfile.NamedTemporaryFile(delete=False) as temp_file:
+    # 保存到持久化目录下的上传文件，不要删除！重启后流水线需要继续处理
+    upload_dir = settings.PERSIST_DIR / 'uploads'
+    upload_dir.mkdir(parents=True, exist_ok=True)
+    # 写入文件的同时计算内容哈希，用于识别重复上传
+    content_hash = hashlib.sha256()
+    with tempfile.NamedTemporaryFile(dir=upload_dir, delete=False) as temp_file:
         for chunk in file.chunks():
+            content_hash.update(chunk)
             temp_file.write(chunk)
         temp_file_path = temp_file.name
     
     document_pipeline: DocumentPipeline = global_env['document_pipeline']
     logger.debug(f"Adding document with title: {title} with file path: {temp_file_path}")
-    task_id = document_pipeline.add_task(title, temp_file_path, collection_id)
+    task_id = document_pipeline.add_task(title, temp_file_path, collection_id, content_hash.hexdigest())
     
     return JsonResponse({
         'message': '文档上传成功',
         'task_id': task_id
     })
 
+def remove_from_collection(document: Document, collection_id) -> bool:
+    """
+    在事务中调用：从集合中移除文档，没有集合引用时删除文档和文本段落，返回文档是否已被删除
+    相同内容的文档可能被多个集合共用，文件由调用方在事务提交后删除
+    """
+    document.collections.remove(*Collection.objects.filter(id=collection_id))
+    if document.collections.exists():
+        return False
+    document.english_sections.all().delete()
+    document.chinese_sections.all().delete()
+    document.delete()
+    return True
+
 @require_delete_permission
 def remove_document(request):
     if request.method != 'POST':
@@ -267,17 +373,61 @@ def remove_document(request):
     
     json_data = json.loads(request.body)
     document_id = json_data.get('document_id')
+    collection_id = json_data.get('collection_id')
     task_id = json_data.get('task_id')
 
     if not document_id and not task_id:
         return JsonResponse({'error': 'Missing document_id or task_id'}, status=400)
+    if document_id and not collection_id:
+        return JsonResponse({'error': 'Missing collection_id'}, status=400)
     
     if document_id:
-        Document.objects.get(id=document_id).delete()
+        with transaction.atomic():
+            document = Document.objects.filter(id=document_id).first()
+            if document is None:
+                return JsonResponse({'error': '文档不存在'}, status=404)
+            removed = remove_from_collection(document, collection_id)
+        if removed:
+            shutil.rmtree(document.linked_file_path, ignore_errors=True)
     if task_id:
-        Task.objects.get(id=task_id).delete()
+        with transaction.atomic():
+            task = Task.objects.filter(id=task_id).first()
+            if task is None:
+                return JsonResponse({'error': '任务不存在'}, status=404)
+            # 任务的文档同样只从集合中移除；仍被其他集合使用的文档依赖该任务，保留任务
+            removed_documents = []
+            in_use = False
+            for document in task.documents.all():
+                if remove_from_collection(document, collection_id or task.collection_id):
+                    removed_documents.append(document)
+                else:
+                    in_use = True
+            if not in_use:
+                task.delete()
+        for document in removed_documents:
+            shutil.rmtree(document.linked_file_path, ignore_errors=True)
+        if not in_use:
+            TaskCheckpoint(task_id).cleanup()
     return JsonResponse({'message': '文档删除成功'})
 
+@require_upload_permission
+def retry_document(request, task_id):
+    if request.method != 'POST':
+        return JsonResponse({'error': 'Method not allowed'}, status=405)
+
+    # 失败的任务重新排队，流水线会从检查点恢复，只处理缺失的页面
+    updated = Task.objects.filter(id=task_id, status=Task.Status.FAILED).update(
+        status=Task.Status.PENDING,
+        error_message=None,
+        attempts=0,
+        lease_owner=None,
+        lease_expires_at=None,
+        updated_at=timezone.now()
+    )
+    if not updated:
+        return JsonResponse({'error': '任务不存在或未失败'}, status=404)
+    return JsonResponse({'message': '任务已重新排队'})
+
 @require_view_permission
 def list_documents(request):
     if request.method != 'GET':
@@ -618,74 +768,97 @@ def get_collection(request, project_id, collection_id):
         return JsonResponse({'error': '获取集合详情失败'}, status=500)
 
 @require_use_api_permission
-def generate_mindmap(request):
+async def generate_mindmap(request):
     data = json.loads(request.body)
     document_id = data.get('docid')
     prompt = data.get('prompt')
     retry = data.get('retry', False)
 
-    mindmap = MindMap.objects.filter(document_id=document_id)
-    if mindmap.exists() and not retry:
-        return JsonResponse({'message': '思维导图已存在', 'mindmap': mindmap.first().mind_map_json})
+    mindmap = await MindMap.objects.filter(document_id=document_id).afirst()
+    if mindmap and not retry:
+        return JsonResponse({'message': '思维导图已存在', 'mindmap': mindmap.mind_map_json})
 
     system_prompt = "You are a helpful assistant that can generate mindmaps. You should use n-level markdown to generate the mindmap. All the items should be brief and concise."
     user_prompt = f"Generate a mindmap for the following text: {prompt}"
 
     client_pool: ClientPool = global_env['gemini_client_pool']
-    if not client_pool._get_clients():
+    if not await client_pool.aget_clients():
         return JsonResponse({'error': 'No GeminiClient available. Please check your API keys and permissions.'}, status=500)
-    response = client_pool.execute_with_retry("chat_with_text", f"{system_prompt}\n\n{user_prompt}")
+    # 重新生成时跳过响应缓存
+    response = await client_pool.aexecute_with_retry(
+        "chat_with_text", f"{system_prompt}\n\n{user_prompt}",
+        use_cache=not retry, timeout=settings.INTERACTIVE_LLM_TIMEOUT, lane=Lane.INTERACTIVE
+    )
+    if 'error' in response:
+        return llm_error_response(response)
 
     # 去掉markdown的代码块
     clean_response = response['text'].replace('```', '').replace('```markdown', '')
-    if retry:
-        mindmap = MindMap.objects.get(document_id=document_id)
+    if mindmap:
         mindmap.mind_map_json = clean_response
         mindmap.created_at = timezone.now()
-        mindmap.save()
+        await mindmap.asave()
     else:
-        MindMap.objects.create(title=f"MindMap for {document_id}", document_id=document_id, mind_map_json=clean_response)
+        await MindMap.objects.acreate(title=f"MindMap for {document_id}", document_id=document_id, mind_map_json=clean_response)
     return JsonResponse({'message': '思维导图生成成功', 'mindmap': clean_response})
 
 import base64
 from prepdocs.parse_page import DocsIngester
 import tempfile
 
+def strip_code_fence(text: str) -> str:
+    """去掉模型输出外层的 markdown 代码块"""
+    if text.startswith('```'):
+        return "\n".join(text.split('\n')[1:-1])
+    return text
+
+def save_upload(file, suffix: str) -> str:
+    file_path = tempfile.mktemp(suffix=suffix)
+    with open(file_path, 'wb') as f:
+        f.write(file.read())
+    return file_path
+
 @require_use_api_permission
-def parse_latex(request):
+async def parse_latex(request):
     prompt = "You are a helpful assistant that can convert all content in the image to prettified markdown text in natural reading order. You are allow to use list, table, equation, etc. You must use $..$ or $$..$$ to wrap the formulas. Do not output any other text. Please convert the following image to markdown text: "
     client_pool: ClientPool = global_env['gemini_client_pool']
-    if not client_pool._get_clients():
+    if not await client_pool.aget_clients():
         return JsonResponse({'error': 'No Client available. Please check your API keys and permissions.'}, status=500)
     
     file = request.FILES.get('file')
     file_type = request.POST.get('type')
     
     if file_type == 'application/pdf':
-        file_path = tempfile.mktemp(suffix=".pdf")
-        with open(file_path, 'wb') as f:
-            f.write(file.read())
-        ingester = DocsIngester()
-        section = ingester.process_document(file_path, "latex.pdf")
-        results = ""
-        for page in section.pages:
-            response = client_pool.execute_with_retry(
-                "chat_with_image", prompt, page.file_path, "path"
+        file_path = await asyncio.to_thread(save_upload, file, ".pdf")
+        # 公式需要视觉模型输出 LaTeX，不使用文本层
+        ingester = DocsIngester(use_text_layer=False)
+        section = await asyncio.to_thread(ingester.process_document, file_path, "latex.pdf")
+        # 各页并发解析，共用一个截止时间；限制同时进行的页数，多页 PDF 不会占满交互通道
+        deadline = time.monotonic() + settings.INTERACTIVE_LLM_TIMEOUT
+        semaphore = asyncio.Semaphore(settings.PARSE_LATEX_MAX_IN_FLIGHT)
+
+        async def parse_page(page):
+            async with semaphore:
+                return await client_pool.aexecute_with_retry(
+                    "chat_with_image", prompt, page.file_path, "path", deadline=deadline, lane=Lane.INTERACTIVE
                 )
-            latex = response['text']
-            if latex.startswith('```'):
-                latex = "\n".join(latex.split('\n')[1:-1])
-            results += f"{latex}\n\n"
+
+        responses = await asyncio.gather(*(parse_page(page) for page in section.pages))
+        results = ""
+        for response in responses:
+            if 'error' in response:
+                return llm_error_response(response)
+            results += f"{strip_code_fence(response['text'])}\n\n"
         return JsonResponse({'message': '公式解析成功', 'markdown': results})
     elif file_type in ['image/png', 'image/jpg', 'image/jpeg']:
         # 将图片转换为base64编码
         base64_file = base64.b64encode(file.read()).decode('utf-8')
-        response = client_pool.execute_with_retry(
-            "chat_with_image", prompt, base64_file, "base64"
+        response = await client_pool.aexecute_with_retry(
+            "chat_with_image", prompt, base64_file, "base64",
+            timeout=settings.INTERACTIVE_LLM_TIMEOUT, lane=Lane.INTERACTIVE
             )
-        latex = response['text']
-        if latex.startswith('```'):
-            latex = "\n".join(latex.split('\n')[1:-1])
-        return JsonResponse({'message': '公式解析成功', 'markdown': latex})
+        if 'error' in response:
+            return llm_error_response(response)
+        return JsonResponse({'message': '公式解析成功', 'markdown': strip_code_fence(response['text'])})
     else:
         return JsonResponse({'error': '不支持的文件类型'}, status=400)
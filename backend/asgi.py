@@ -14,3 +14,9 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'backend.settings')
 
 application = get_asgi_application()
+
+# 只有服务进程在本进程中处理文档，manage.py 的其他命令不会领取任务
+from django.conf import settings
+if settings.PIPELINE_IN_WEB:
+    from backend.setup_env import start_pipeline
+    start_pipeline()
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from prepdocs import translation_memory
+
+class Command(BaseCommand):
+    help = '按模型、提示词版本或目标语言清除翻译记忆中的译文'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--model', help='生成译文的模型')
+        parser.add_argument('--prompt-version', help='翻译提示词版本')
+        parser.add_argument('--language', help='目标语言，例如 "Simplified Chinese"')
+
+    def handle(self, *args, **options):
+        if not any(options[key] for key in ('model', 'prompt_version', 'language')):
+            raise CommandError('至少指定 --model、--prompt-version 或 --language 之一')
+        deleted = translation_memory.evict(
+            model=options['model'],
+            prompt_version=options['prompt_version'],
+            target_language=options['language']
+        )
+        self.stdout.write(f"已删除 {deleted} 条翻译记忆")
@@ -0,0 +1,38 @@
+import logging
+import signal
+import threading
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+logger = logging.getLogger(__name__)
+
+class Command(BaseCommand):
+    help = '运行文档处理流水线，从数据库的任务队列中领取并处理任务'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=settings.PIPELINE_MAX_WORKERS,
+            help='同时处理的文档数，默认为 PIPELINE_MAX_WORKERS'
+        )
+
+    def handle(self, *args, **options):
+        from backend.setup_env import start_pipeline
+
+        pipeline = start_pipeline(options['workers'])
+
+        stop_event = threading.Event()
+
+        def request_stop(signum, frame):
+            logger.info(f"收到信号 {signum}，等待正在处理的任务完成后退出")
+            stop_event.set()
+
+        signal.signal(signal.SIGTERM, request_stop)
+        signal.signal(signal.SIGINT, request_stop)
+
+        self.stdout.write(f"Pipeline worker {pipeline.worker_id} started with {pipeline.max_workers} workers")
+        stop_event.wait()
+        # 未处理完就被强制结束的任务，租约过期后由其他 worker 从检查点继续处理
+        pipeline.shutdown()
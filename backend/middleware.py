@@ -1,27 +1,57 @@
 import logging
-from threading import local
+
+from asgiref.local import Local
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
 
 logger = logging.getLogger(__name__)
-_thread_locals = local()
+# asgiref 的 Local 在线程和协程中都按请求隔离，sync_to_async 调用的线程也能读取
+_thread_locals = Local()
 
 def get_current_request():
     return getattr(_thread_locals, 'request', None)
 
-class RequestMiddleware:
+class AsyncCapableMiddleware:
+    """
+    同时支持同步和异步调用链的中间件基类，子类实现 before 和 after
+    中间件全部支持异步时，ASGI 下的异步视图才不需要为每个请求占用一个线程
+    """
+    sync_capable = True
+    async_capable = True
+
     def __init__(self, get_response):
         self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def before(self, request):
+        pass
+
+    def after(self, request, response):
+        pass
 
     def __call__(self, request):
-        _thread_locals.request = request
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        self.before(request)
         response = self.get_response(request)
-        del _thread_locals.request
+        self.after(request, response)
         return response
 
-class IPAddressMiddleware:
-    def __init__(self, get_response):
-        self.get_response = get_response
+    async def __acall__(self, request):
+        self.before(request)
+        response = await self.get_response(request)
+        self.after(request, response)
+        return response
 
-    def __call__(self, request):
+class RequestMiddleware(AsyncCapableMiddleware):
+    def before(self, request):
+        _thread_locals.request = request
+
+    def after(self, request, response):
+        del _thread_locals.request
+
+class IPAddressMiddleware(AsyncCapableMiddleware):
+    def before(self, request):
         # 获取真实IP地址
         x_forwarded_for = request.META.get('HTTP_X_FORWARDED_FOR')
         if x_forwarded_for:
@@ -29,21 +59,12 @@ class IPAddressMiddleware:
         else:
             ip = request.META.get('REMOTE_ADDR')
         request.client_ip = ip
-        return self.get_response(request)
 
-class RequestLoggingMiddleware:
-    def __init__(self, get_response):
-        self.get_response = get_response
-
-    def __call__(self, request):        
-        response = self.get_response(request)
-        
+class RequestLoggingMiddleware(AsyncCapableMiddleware):
+    def after(self, request, response):
         logger.info(
             f"{request.method} {request.path} {response.status_code}",
             extra={
                 'status_code': response.status_code
             }
         )
-        
-        return response 
-    
\ No newline at end of file
@@ -13,6 +13,7 @@ https://docs.djangoproject.com/en/5.1/ref/settings/
 from pathlib import Path
 import logging
 from backend.middleware import get_current_request
+from django.core.exceptions import SynchronousOnlyOperation
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -77,6 +78,8 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = 'backend.wsgi.application'
+# 生产环境使用 ASGI 服务器（uvicorn）运行，调用大模型的异步视图等待响应时不占用线程
+ASGI_APPLICATION = 'backend.asgi.application'
 
 
 # Database
@@ -122,8 +125,11 @@ class RequestBasicInformation(logging.Filter):
             else:
                 ip = request.META.get("REMOTE_ADDR")
 
-            # 收集用户upn
-            user_claims = request.session.get("auth_claims", None)
+            # 收集用户upn；异步视图中 session 尚未加载时不能同步查询数据库，跳过
+            try:
+                user_claims = request.session.get("auth_claims", None)
+            except SynchronousOnlyOperation:
+                user_claims = None
             if user_claims:
                 upn = user_claims["oid"]
 
@@ -193,6 +199,54 @@ LOGGING = {
 
 PERSIST_DIR = BASE_DIR / 'persist'
 
+# PDF 渲染进程数，默认使用全部 CPU 核心
+RENDER_PROCESSES = int(os.getenv('RENDER_PROCESSES', 0)) or os.cpu_count()
+
+# 批量文本提取：一次视觉请求最多包含的页数，以及图片 token 预算，页数为 1 时逐页请求
+OCR_BATCH_PAGES = int(os.getenv('OCR_BATCH_PAGES', 4))
+OCR_BATCH_MAX_TOKENS = int(os.getenv('OCR_BATCH_MAX_TOKENS', 16000))
+
+# 每个翻译请求的原文 token 预算，小页面合并到同一个请求，超出预算的页面按段落拆分
+TRANSLATE_CHUNK_TOKENS = int(os.getenv('TRANSLATE_CHUNK_TOKENS', 3000))
+
+# 异步大模型请求：单个事件循环中同时进行的请求数，以及共享 HTTP 连接池的大小
+LLM_MAX_IN_FLIGHT = int(os.getenv('LLM_MAX_IN_FLIGHT', 256))
+LLM_HTTP_MAX_CONNECTIONS = int(os.getenv('LLM_HTTP_MAX_CONNECTIONS', 256))
+LLM_HTTP_MAX_KEEPALIVE = int(os.getenv('LLM_HTTP_MAX_KEEPALIVE', 64))
+LLM_HTTP_TIMEOUT = float(os.getenv('LLM_HTTP_TIMEOUT', 300))  # 单个请求的超时（秒）
+# 交互接口（对话、思维导图、公式解析）一次调用的总耗时上限（秒），包括排队、重试和退避
+INTERACTIVE_LLM_TIMEOUT = float(os.getenv('INTERACTIVE_LLM_TIMEOUT', 60))
+# 公式解析一个 PDF 时同时解析的页数，避免单个请求占满交互通道
+PARSE_LATEX_MAX_IN_FLIGHT = int(os.getenv('PARSE_LATEX_MAX_IN_FLIGHT', 2))
+# 为交互请求预留的并发名额比例，批量解析和翻译不能占用
+LLM_INTERACTIVE_RESERVED = float(os.getenv('LLM_INTERACTIVE_RESERVED', 0.25))
+# 对冲请求：异步请求超过近期延迟的该分位数仍未返回时，在另一个密钥上重复发送，0 表示不启用
+LLM_HEDGE_PERCENTILE = float(os.getenv('LLM_HEDGE_PERCENTILE', 0))
+LLM_HEDGE_MAX_RATIO = float(os.getenv('LLM_HEDGE_MAX_RATIO', 0.05))  # 对冲请求数占请求总数的比例上限
+LLM_HEDGE_MIN_DELAY = float(os.getenv('LLM_HEDGE_MIN_DELAY', 1.0))  # 发送对冲请求前的最短等待时间（秒）
+# 每个 API 密钥的并发上限从 LLM_KEY_INITIAL_CONCURRENCY 开始按延迟和错误率自适应调整，不超过 LLM_KEY_MAX_CONCURRENCY
+LLM_KEY_INITIAL_CONCURRENCY = int(os.getenv('LLM_KEY_INITIAL_CONCURRENCY', 2))
+LLM_KEY_MAX_CONCURRENCY = int(os.getenv('LLM_KEY_MAX_CONCURRENCY', 32))
+# API 密钥使用记录（调用次数、延迟、错误）批量写回数据库的间隔（秒）
+API_KEY_USAGE_FLUSH_INTERVAL = float(os.getenv('API_KEY_USAGE_FLUSH_INTERVAL', 5))
+
+# 文档处理流水线：每个进程同时处理的文档数；PIPELINE_IN_WEB 为 1 时 Web 服务进程（ASGI/WSGI）同时处理任务，
+# 为 0 时 Web 进程只添加任务，由独立的 worker 进程（python manage.py pipeline_worker）领取处理。
+# migrate 等其他管理命令始终不处理任务
+PIPELINE_MAX_WORKERS = int(os.getenv('PIPELINE_MAX_WORKERS', 3))
+PIPELINE_IN_WEB = os.getenv('PIPELINE_IN_WEB', '1') == '1'
+
+# 大模型响应缓存
+LLM_CACHE_ENABLED = os.getenv('LLM_CACHE_ENABLED', '1') == '1'
+LLM_CACHE_PATH = PERSIST_DIR / 'llm_cache.sqlite3'
+LLM_CACHE_MAX_BYTES = int(os.getenv('LLM_CACHE_MAX_BYTES', 512 * 1024 * 1024))  # 默认 512MB
+
+# LibreOffice 常驻转换进程池
+LIBREOFFICE_POOL_SIZE = int(os.getenv('LIBREOFFICE_POOL_SIZE', 2))  # 常驻进程数
+LIBREOFFICE_MAX_JOBS = int(os.getenv('LIBREOFFICE_MAX_JOBS', 50))  # 每个进程转换多少个文档后重启
+LIBREOFFICE_PYTHON = os.getenv('LIBREOFFICE_PYTHON', '/usr/bin/python3')  # 带 uno 模块的 Python 解释器
+LIBREOFFICE_TIMEOUT = int(os.getenv('LIBREOFFICE_TIMEOUT', 300))  # 单个文档的转换超时（秒）
+
 # Internationalization
 # https://docs.djangoproject.com/en/5.1/topics/i18n/
 
@@ -8,7 +8,24 @@ global_env = settings.GLOBAL_ENV
 def client_setup():
     print("Setting up Gemini clients...")
     # 初始化客户端池
-    global_env['gemini_client_pool'] = ClientPool()
+    global_env['gemini_client_pool'] = ClientPool(
+        max_concurrent_requests=settings.LLM_KEY_INITIAL_CONCURRENCY,
+        max_concurrency=settings.LLM_KEY_MAX_CONCURRENCY,
+        interactive_reserved=settings.LLM_INTERACTIVE_RESERVED,
+        hedge_percentile=settings.LLM_HEDGE_PERCENTILE or None,
+        hedge_max_ratio=settings.LLM_HEDGE_MAX_RATIO,
+        hedge_min_delay=settings.LLM_HEDGE_MIN_DELAY
+    )
     
     print("Setting up Document Pipeline...")
-    global_env['document_pipeline'] = DocumentPipeline(max_workers=3)
+    # 这里只创建流水线用于添加任务，由 Web 服务或 pipeline_worker 命令调用 start_pipeline 开始处理
+    global_env['document_pipeline'] = DocumentPipeline(max_workers=settings.PIPELINE_MAX_WORKERS)
+
+def start_pipeline(max_workers=None):
+    """
+    开始领取和处理任务，只在服务进程和 pipeline_worker 命令中调用
+    :param max_workers: 同时处理的文档数，默认为 settings.PIPELINE_MAX_WORKERS
+    """
+    pipeline: DocumentPipeline = global_env['document_pipeline']
+    pipeline.start(max_workers)
+    return pipeline
@@ -18,3 +18,9 @@ from dotenv import load_dotenv
 load_dotenv(os.path.join(os.path.dirname(__file__), '.env'))
 
 application = get_wsgi_application()
+
+# 只有服务进程在本进程中处理文档，manage.py 的其他命令不会领取任务
+from django.conf import settings
+if settings.PIPELINE_IN_WEB:
+    from backend.setup_env import start_pipeline
+    start_pipeline()
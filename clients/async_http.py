@@ -0,0 +1,61 @@
+# 异步 HTTP 连接池
+# 同一个事件循环中的所有异步客户端共用一个 httpx.AsyncClient，
+# 复用长连接，避免每个请求重新建立 TLS 连接。httpx.AsyncClient 绑定创建它的事件循环，
+# 因此按事件循环分别创建。
+# 同步代码（流水线的各个阶段）通过 run_async 在进程共用的后台事件循环中执行协程，
+# 所有文档的请求共用该事件循环的连接池，不会每次调用都新建事件循环和连接。
+
+import asyncio
+import logging
+import threading
+import weakref
+from typing import Optional
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, httpx.AsyncClient]" = weakref.WeakKeyDictionary()
+
+def get_async_http_client() -> httpx.AsyncClient:
+    """获取当前事件循环的共享连接池，连接数由 settings.LLM_HTTP_MAX_CONNECTIONS 配置"""
+    loop = asyncio.get_running_loop()
+    client = _clients.get(loop)
+    if client is None or client.is_closed:
+        from django.conf import settings
+        client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=settings.LLM_HTTP_MAX_CONNECTIONS,
+                max_keepalive_connections=settings.LLM_HTTP_MAX_KEEPALIVE
+            ),
+            timeout=httpx.Timeout(settings.LLM_HTTP_TIMEOUT, connect=10)
+        )
+        _clients[loop] = client
+        logger.debug(f"Async HTTP client created for loop {id(loop)}")
+    return client
+
+_loop: Optional[asyncio.AbstractEventLoop] = None
+_loop_thread: Optional[threading.Thread] = None
+_loop_lock = threading.Lock()
+
+def _get_background_loop() -> asyncio.AbstractEventLoop:
+    """获取进程共用的后台事件循环，首次调用时在守护线程中启动"""
+    global _loop, _loop_thread
+    with _loop_lock:
+        if _loop is None or not _loop_thread.is_alive():
+            _loop = asyncio.new_event_loop()
+            _loop_thread = threading.Thread(target=_loop.run_forever, name='async-http-loop', daemon=True)
+            _loop_thread.start()
+            logger.debug(f"Background event loop started in thread {_loop_thread.name}")
+        return _loop
+
+def run_async(main):
+    """
+    在进程共用的后台事件循环中运行协程，阻塞当前线程直到返回结果
+    多个线程可以同时调用，协程在同一个事件循环中并发执行并复用连接池；不能在该事件循环中调用
+    """
+    loop = _get_background_loop()
+    if threading.current_thread() is _loop_thread:
+        main.close()
+        raise RuntimeError("run_async 不能在后台事件循环中调用，请直接 await")
+    return asyncio.run_coroutine_threadsafe(main, loop).result()
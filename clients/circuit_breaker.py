@@ -0,0 +1,149 @@
+# API 密钥熔断与健康度
+# 按错误类型处理失败：认证失败的密钥长时间熔断，配额耗尽的密钥按冷却时间熔断，
+# 连续的临时错误达到阈值后熔断；冷却结束后进入半开状态，只放行一个探测请求，
+# 探测成功后恢复，失败则以加倍的冷却时间重新熔断。
+# 健康度是最近请求成功率的指数加权平均，用于客户端选择的权重。
+
+import re
+import time
+from typing import Optional
+
+class ErrorClass:
+    AUTH = 'auth'            # 密钥无效、过期或没有权限，或密钥对应的服务地址、模型不存在
+    QUOTA = 'quota'          # 配额耗尽或请求过快
+    REQUEST = 'request'      # 请求内容本身有误（参数、图片、请求过大），换密钥重试也不会成功
+    TRANSIENT = 'transient'  # 网络错误、超时、服务端错误等临时错误
+
+AUTH_KEYWORDS = ('api key', 'api_key', 'permission_denied', 'permission denied', 'unauthenticated', 'unauthorized')
+QUOTA_KEYWORDS = ('resource_exhausted', 'resource exhausted', 'quota', 'rate limit', 'too many requests')
+REQUEST_KEYWORDS = ('invalid_argument', '不支持的图片', '图片文件打开错误', '图片解析错误', 'base64')
+
+# 状态码出现在错误信息开头，或前缀之后，例如 "429 ..."、"处理请求时发生错误: 429 ..."、"Error code: 429 - ..."
+STATUS_CODE_RE = re.compile(r'(?:^|:)\s*([45]\d\d)\b')
+
+def classify_error(error: str) -> str:
+    """
+    根据错误信息中的 HTTP 状态码和关键字判断错误类型
+    404（base_url 错误或模型不存在）和涉及 API 密钥的 400 只与当前密钥有关，按认证失败熔断并换密钥重试；
+    只有请求内容本身的错误（参数、图片或 413）才不换密钥，没有关键字的 400 按临时错误处理
+    """
+    message = str(error).lower()
+    match = STATUS_CODE_RE.search(message)
+    status_code = int(match.group(1)) if match else None
+    if status_code in (401, 403, 404):
+        return ErrorClass.AUTH
+    if status_code == 429:
+        return ErrorClass.QUOTA
+    if status_code == 413:
+        return ErrorClass.REQUEST
+    # 配额错误的信息中也可能提到 API 密钥，先判断配额
+    if any(keyword in message for keyword in QUOTA_KEYWORDS):
+        return ErrorClass.QUOTA
+    if any(keyword in message for keyword in AUTH_KEYWORDS):
+        return ErrorClass.AUTH
+    if any(keyword in message for keyword in REQUEST_KEYWORDS):
+        return ErrorClass.REQUEST
+    return ErrorClass.TRANSIENT
+
+class CircuitBreaker:
+    """
+    单个 API 密钥的熔断器
+    不是线程安全的，由 ClientPool 在持有 pool_lock 时调用
+    """
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self,
+                 failure_threshold: int = 5,
+                 transient_cooldown: float = 30,
+                 quota_cooldown: float = 60,
+                 auth_cooldown: float = 3600,
+                 max_cooldown: float = 1800,
+                 health_decay: float = 0.8):
+        """
+        :param failure_threshold: 连续多少次临时错误后熔断
+        :param transient_cooldown: 临时错误熔断的初始冷却时间（秒）
+        :param quota_cooldown: 配额耗尽熔断的初始冷却时间（秒）
+        :param auth_cooldown: 认证失败熔断的冷却时间（秒）
+        :param max_cooldown: 连续熔断时冷却时间加倍的上限（秒）
+        :param health_decay: 健康度的衰减系数，越大越看重历史
+        """
+        self.failure_threshold = failure_threshold
+        self.transient_cooldown = transient_cooldown
+        self.quota_cooldown = quota_cooldown
+        self.auth_cooldown = auth_cooldown
+        self.max_cooldown = max_cooldown
+        self.health_decay = health_decay
+
+        self.state = self.CLOSED
+        self.consecutive_failures = 0
+        self.open_count = 0               # 恢复前连续熔断的次数，用于加倍冷却时间
+        self.open_until = 0.0
+        self.probe_in_flight = False
+        self.last_error_class: Optional[str] = None
+        self.health = 1.0
+
+    def _open(self, cooldown: float):
+        self.open_count += 1
+        cooldown = min(cooldown * 2 ** (self.open_count - 1), max(cooldown, self.max_cooldown))
+        self.state = self.OPEN
+        self.open_until = time.monotonic() + cooldown
+        self.probe_in_flight = False
+
+    def available(self) -> bool:
+        """当前是否可以向该密钥发送请求，不改变状态"""
+        if self.state == self.CLOSED:
+            return True
+        if self.state == self.OPEN:
+            return time.monotonic() >= self.open_until
+        return not self.probe_in_flight
+
+    def retry_after(self) -> float:
+        """距离可以再次发送请求的秒数"""
+        if self.state == self.OPEN:
+            return max(self.open_until - time.monotonic(), 0)
+        return 0
+
+    def on_selected(self):
+        """客户端被选中时调用：冷却结束的熔断器进入半开状态，本次请求作为探测请求"""
+        if self.state == self.OPEN and time.monotonic() >= self.open_until:
+            self.state = self.HALF_OPEN
+        if self.state == self.HALF_OPEN:
+            self.probe_in_flight = True
+
+    def on_released(self):
+        """被选中的请求没有实际发送（例如命中缓存）时调用，释放探测名额"""
+        self.probe_in_flight = False
+
+    def record_success(self):
+        self.state = self.CLOSED
+        self.consecutive_failures = 0
+        self.open_count = 0
+        self.probe_in_flight = False
+        self.health = self.health * self.health_decay + (1 - self.health_decay)
+
+    def record_failure(self, error_class: str):
+        self.last_error_class = error_class
+        if error_class == ErrorClass.REQUEST:
+            # 请求本身的错误与密钥无关
+            if self.state == self.HALF_OPEN:
+                self.probe_in_flight = False
+            return
+        self.health *= self.health_decay
+        self.consecutive_failures += 1
+        if error_class == ErrorClass.AUTH:
+            self._open(self.auth_cooldown)
+        elif error_class == ErrorClass.QUOTA:
+            self._open(self.quota_cooldown)
+        elif self.state == self.HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+            self._open(self.transient_cooldown)
+
+    def status(self) -> dict:
+        return {
+            'circuit_state': self.state,
+            'circuit_retry_after': round(self.retry_after(), 1),
+            'consecutive_failures': self.consecutive_failures,
+            'last_error_class': self.last_error_class,
+            'health': round(self.health, 3),
+        }
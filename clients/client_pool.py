@@ -1,24 +1,42 @@
 import random
 import time
-from typing import List, Optional, Any, Dict, Callable
-from threading import Lock
+from typing import List, Optional, Any, Dict, Callable, Iterator, AsyncIterator
+from collections import deque
+from threading import Event, Lock
 import logging
-from concurrent.futures import ThreadPoolExecutor
 from api.models import ApiKey
 from clients.gemini_client import GeminiClient
 from clients.openai_client import OpenAIClient
+from clients.response_cache import get_response_cache
+from clients.rate_limiter import RateLimiter, estimate_request_tokens
+from clients.circuit_breaker import CircuitBreaker, ErrorClass, classify_error
+from clients.qos import Lane, LaneStats, reserved_slots
+from clients.hedging import LatencyTracker, HedgeBudget
+from clients.concurrency import AIMDConcurrency
+from clients.usage_recorder import get_usage_recorder
 import asyncio
+from asgiref.sync import sync_to_async
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# 等待并发名额的请求由名额释放或熔断恢复唤醒；该时间只是防止遗漏唤醒的兜底等待时间（秒）
+SLOT_WAIT_TIMEOUT = 1.0
+# 健康度的最小选择权重，熔断恢复后的密钥仍有机会被选中
+MIN_HEALTH_WEIGHT = 0.05
+# 单次请求因截止时间到达而中断时的错误类型
+TIMED_OUT = 'timed_out'
+
 class ClientStatus:
-    def __init__(self):
+    def __init__(self, initial_concurrency: int = 2, max_concurrency: int = 32):
         self.active_requests = 0  # 当前活跃请求数
         self.total_requests = 0   # 总请求数
         self.failed_requests = 0  # 失败请求数
         self.last_error = None    # 最后一次错误
         self.last_used = 0        # 最后使用时间
+        self.rate_limiter = RateLimiter()  # RPM/TPM 配额
+        self.breaker = CircuitBreaker()    # 熔断器与健康度
+        self.concurrency = AIMDConcurrency(initial_concurrency, max_limit=max_concurrency)  # 自适应并发上限
         self.lock = Lock()        # 线程锁
 
     def increment_active(self):
@@ -36,183 +54,1024 @@ class ClientStatus:
             self.failed_requests += 1
             self.last_error = error
 
+class SlotWaiter:
+    """
+    排队等待并发名额的请求
+    同步请求阻塞在 threading.Event 上，异步请求等待所在事件循环中的 Future，可以从任意线程唤醒
+    """
+    def __init__(self, lane: str, loop: Optional[asyncio.AbstractEventLoop] = None):
+        self.lane = lane
+        self.loop = loop
+        self.event = Event() if loop is None else None
+        self.future = loop.create_future() if loop is not None else None
+
+    def wake(self):
+        if self.loop is None:
+            self.event.set()
+        else:
+            self.loop.call_soon_threadsafe(self._resolve)
+
+    def _resolve(self):
+        if not self.future.done():
+            self.future.set_result(None)
+
 class ClientPool:
     def __init__(self, 
                  clients: List[GeminiClient] = None,
-                 max_retries: int = 9999999,
-                 retry_delay: float = 2.0,
-                 max_concurrent_requests: int = 2):
+                 max_retries: int = 6,
+                 retry_delay: float = 1.0,
+                 max_retry_delay: float = 30.0,
+                 max_concurrent_requests: int = 2,
+                 max_concurrency: int = 32,
+                 max_circuit_wait: float = 60.0,
+                 interactive_reserved: float = 0.25,
+                 hedge_percentile: Optional[float] = None,
+                 hedge_max_ratio: float = 0.05,
+                 hedge_min_delay: float = 1.0):
         """
         初始化客户端池
         :param clients: 客户端列表
-        :param max_retries: 最大重试次数
-        :param retry_delay: 重试延迟（秒）
-        :param max_concurrent_requests: 每个客户端的最大并发请求数
+        :param max_retries: 每个请求的最大尝试次数
+        :param retry_delay: 重试延迟的初始值（秒），每次失败后加倍
+        :param max_retry_delay: 重试延迟的上限（秒）
+        :param max_concurrent_requests: 每个客户端的初始并发上限，之后按延迟和错误率自适应调整
+        :param max_concurrency: 每个客户端自适应并发上限的最大值
+        :param max_circuit_wait: 所有密钥都已熔断时最多等待多久（秒），超过后直接返回错误
+        :param interactive_reserved: 为交互通道预留的并发名额比例，批量通道不能占用
+        :param hedge_percentile: 异步请求超过近期延迟的该分位数（例如 95）仍未返回时发送对冲请求，None 表示不对冲
+        :param hedge_max_ratio: 对冲请求数占普通请求数的比例上限，限制额外的开销
+        :param hedge_min_delay: 发送对冲请求前的最短等待时间（秒）
         """
         self.clients = clients
         self.max_retries = max_retries
         self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
         self.max_concurrent_requests = max_concurrent_requests
+        self.max_concurrency = max_concurrency
+        self.max_circuit_wait = max_circuit_wait
+        self.interactive_reserved = interactive_reserved
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_delay = hedge_min_delay
         
         # 初始化客户端状态
         self.client_status = {
-            client: ClientStatus() for client in clients
+            client: self._new_status() for client in clients
         } if clients else {}
         
+        # 每个 API 密钥创建客户端时的 (base_url, api_type)，配置变更时重建客户端
+        self.client_configs = {}
+        
+        # 每个优先级通道的排队与等待统计
+        self.lanes = {lane: LaneStats() for lane in Lane.ALL}
+        
+        # 各操作的近期延迟与对冲请求的额度
+        self.latency_tracker = LatencyTracker()
+        self.hedge_budget = HedgeBudget(hedge_max_ratio)
+        
         # 用于同步的锁
         self.pool_lock = Lock()
+        self.refresh_lock = Lock()
         
-        # 线程池用于异步操作
-        self.thread_pool = ThreadPoolExecutor(max_workers=max_concurrent_requests)
+        # 排队等待名额的请求，名额释放时按通道优先级唤醒；每次唤醒递增 wake_generation，
+        # 请求在获取名额失败后、开始等待前如果发现已经有过唤醒，直接重试，避免遗漏
+        self.waiters = {lane: deque() for lane in Lane.ALL}
+        self.wake_generation = 0
         
         logger.info(f"ClientPool initialized with {len(clients) if clients else 0} clients")
 
+    async def aget_clients(self):
+        """_get_clients 的异步版本，首次调用时在线程中查询数据库"""
+        if self.clients is None:
+            await sync_to_async(self._get_clients)()
+        return self.clients
+
+    def _new_status(self) -> ClientStatus:
+        return ClientStatus(self.max_concurrent_requests, self.max_concurrency)
+
     def _get_clients(self):
         """
-        获取客户端列表
+        获取客户端列表，首次调用时从数据库加载
         """
         if self.clients is None:
-            self.clients = self.gather_clients()
-            # retry_delay 设置为客户端越少，重试延迟越大
-            self.retry_delay = 2.0 / len(self.clients) if len(self.clients) > 0 else 0
-            # 设置最大重试次数为客户端数量
-            self.max_retries = len(self.clients) * 9999999
-            self.client_status = {
-                client: ClientStatus() for client in self.clients
-            }
+            self.refresh_clients()
         return self.clients
 
     @staticmethod
-    def gather_clients():
-        logger.debug("Gathering clients from database")
-        # 从数据库中获取所有API密钥
-        api_keys = ApiKey.objects.all()
-        # 创建GeminiClient实例
-        clients = []
-        for api_key in api_keys:
-            if (api_key.api_type == 'gemini'):
-                clients.append(GeminiClient(api_key.key, api_key.base_url))
-                logger.debug("Gemini client added")
-            elif (api_key.api_type == 'openai'):
-                clients.append(OpenAIClient(api_key.key, api_key.base_url))
-                logger.debug("OpenAI client added")
-
-        logger.debug("*" * 25 + f"Found {len(clients)} clients" + "*" * 25)
-        logger.debug(f"Client API keys: {' '.join([client.api_key[-8:] for client in clients])}")
+    def _create_client(api_key: ApiKey) -> Optional[GeminiClient]:
+        if api_key.api_type == 'gemini':
+            logger.debug("Gemini client added")
+            return GeminiClient(api_key.key, api_key.base_url, api_key_model=api_key)
+        elif api_key.api_type == 'openai':
+            logger.debug("OpenAI client added")
+            return OpenAIClient(api_key.key, api_key.base_url, api_key_model=api_key)
+        return None
+
+    def refresh_clients(self):
+        """
+        增量刷新客户端：只为新增或配置变更的 API 密钥创建客户端，其余客户端及其状态保留；
+        已删除密钥的客户端不再被选中，正在进行的请求继续使用原客户端完成
+        """
+        logger.debug("Refreshing clients from database")
+        api_keys = list(ApiKey.objects.all())
+        with self.refresh_lock:
+            current = {client.api_key: client for client in (self.clients or [])}
+            clients = []
+            configs = {}
+            limits = {}
+            added = 0
+            for api_key in api_keys:
+                config = (api_key.base_url, api_key.api_type)
+                client = current.pop(api_key.key, None)
+                if client is None or self.client_configs.get(api_key.key) != config:
+                    client = self._create_client(api_key)
+                    if client is None:
+                        continue
+                    added += 1
+                else:
+                    client.api_key_model = api_key
+                clients.append(client)
+                configs[api_key.key] = config
+                limits[api_key.key] = (api_key.rpm_limit, api_key.tpm_limit)
+            # 已删除的密钥不再写回使用记录，避免重新插入已删除的数据库记录
+            for client in current.values():
+                client.api_key_model = None
+
+            with self.pool_lock:
+                client_status = {client: self.client_status.get(client) or self._new_status() for client in clients}
+                for client in clients:
+                    client_status[client].rate_limiter.update_limits(*limits[client.api_key])
+                # 已删除但仍有进行中请求的客户端保留状态，直到请求结束后的下一次刷新
+                for client in current.values():
+                    status = self.client_status.get(client)
+                    if status is not None and status.active_requests > 0:
+                        client_status.setdefault(client, status)
+                self.client_status = client_status
+                self.client_configs = configs
+                self.clients = clients
+                # 新增的密钥可以立即使用
+                self._notify_locked()
 
+        logger.info(f"ClientPool refreshed: {len(clients)} clients, {added} created, {len(current)} removed")
+        logger.debug(f"Client API keys: {' '.join([client.api_key[-8:] for client in clients])}")
         return clients
 
     def _select_client(self) -> Optional[GeminiClient]:
         """
         使用负载均衡算法选择最佳客户端
-        采用最小活跃连接数 + 随机权重的方式
+        跳过已熔断的客户端，按健康度和活跃请求数加权随机选择
         """
+        self._get_clients()
         with self.pool_lock:
-            # 过滤出可用的客户端（活跃请求数未达到最大值）
-            available_clients = [
-                client for client in self._get_clients()
-                if self.client_status[client].active_requests < self.max_concurrent_requests
-            ]
-            
-            if not available_clients:
+            return self._select_client_locked()
+
+    def _acquire_client(self,
+                        tokens: int = 0,
+                        lane: str = Lane.BATCH,
+                        queued_since: Optional[float] = None) -> Optional[tuple[GeminiClient, ClientStatus]]:
+        """
+        选择客户端并立即占用一个并发名额和相应的配额，避免并发的请求超额选中同一个客户端
+        :param tokens: 请求的估算 token 数
+        :param lane: 请求所属的优先级通道
+        :param queued_since: 开始排队的时间（time.monotonic()），没有排队时为 None
+        :return: (客户端, 客户端状态)，没有可用客户端或通道没有名额时返回 None
+        """
+        self._get_clients()
+        with self.pool_lock:
+            if not self._lane_admits(lane):
+                return None
+            client = self._select_client_locked(tokens)
+            if client is None:
                 return None
-            
-            # 按活跃请求数分组
-            clients_by_load = {}
-            for client in available_clients:
-                active_requests = self.client_status[client].active_requests
-                if active_requests not in clients_by_load:
-                    clients_by_load[active_requests] = []
-                clients_by_load[active_requests].append(client)
-            
-            # 选择活跃请求数最少的分组
-            min_load = min(clients_by_load.keys())
-            
-            # 在负载最小的客户端中随机选择一个
-            logger.debug("*" * 20 + "Client load distribution" + "*" * 20)
-            for load, clients in clients_by_load.items():
-                logger.debug(f"Load {load}: {len(clients)} clients")
-            logger.debug(f"Selected client with load {min_load}")
-            return random.choice(clients_by_load[min_load])
+            status = self.client_status[client]
+            status.increment_active()
+            status.rate_limiter.acquire(tokens)
+            status.breaker.on_selected()
+            wait_time = time.monotonic() - queued_since if queued_since is not None else 0.0
+            self.lanes[lane].on_acquired(wait_time, queued_since is not None)
+            if lane == Lane.INTERACTIVE and queued_since is not None:
+                self._on_interactive_dequeued_locked()
+            return client, status
+
+    def _lane_admits(self, lane: str) -> bool:
+        """
+        在持有 pool_lock 时判断通道能否占用新的并发名额：交互通道不受限制；
+        批量通道不能占用预留名额，且有交互请求在排队时让出名额
+        """
+        if lane == Lane.INTERACTIVE:
+            return True
+        if self.lanes[Lane.INTERACTIVE].waiting > 0:
+            return False
+        return self.lanes[Lane.BATCH].active < self._lane_capacity(Lane.BATCH)
+
+    def _lane_capacity(self, lane: str) -> int:
+        """通道最多可以同时占用的并发名额"""
+        total_slots = sum(self.client_status[client].concurrency.max_in_flight for client in self.clients or [])
+        if lane == Lane.INTERACTIVE:
+            return total_slots
+        return total_slots - reserved_slots(total_slots, self.interactive_reserved)
+
+    def _enqueue(self, lane: str) -> float:
+        """请求开始排队，返回开始排队的时间"""
+        with self.pool_lock:
+            self.lanes[lane].on_enqueued()
+        return time.monotonic()
+
+    def _abandon_queue(self, lane: str, queued_since: Optional[float]):
+        """排队中的请求放弃等待（超时、熔断或被取消），没有排队时不做处理"""
+        if queued_since is None:
+            return
+        with self.pool_lock:
+            self.lanes[lane].on_abandoned()
+            if lane == Lane.INTERACTIVE:
+                self._on_interactive_dequeued_locked()
+
+    def _on_interactive_dequeued_locked(self):
+        """没有交互请求排队后，批量请求不再需要让出名额，唤醒等待中的批量请求"""
+        if self.lanes[Lane.INTERACTIVE].waiting == 0 and self.waiters[Lane.BATCH]:
+            self._notify_locked(lanes=(Lane.BATCH,))
+
+    def _notify_locked(self, count: Optional[int] = None, lanes: tuple = (Lane.INTERACTIVE, Lane.BATCH)):
+        """
+        在持有 pool_lock 时唤醒排队的请求，交互通道优先
+        :param count: 最多唤醒的请求数，None 表示全部唤醒
+        """
+        self.wake_generation += 1
+        for lane in lanes:
+            waiters = self.waiters[lane]
+            while waiters and (count is None or count > 0):
+                waiters.popleft().wake()
+                if count is not None:
+                    count -= 1
+
+    def _register_waiter(self, tokens: int, lane: str, generation: int,
+                         loop: Optional[asyncio.AbstractEventLoop] = None) -> tuple[Optional[SlotWaiter], Optional[float]]:
+        """
+        获取名额失败后登记等待
+        :param generation: 获取名额前读取的 wake_generation
+        :return: (等待者, 最长等待时间)；期间已有唤醒时等待者为 None，应立即重试；
+                 所有客户端都已熔断且超过 max_circuit_wait 才会恢复时等待时间为 None
+        """
+        self._get_clients()
+        with self.pool_lock:
+            wait_time = self._wait_time_locked(tokens)
+            if wait_time is None:
+                return None, None
+            if generation != self.wake_generation:
+                return None, 0.0
+            waiter = SlotWaiter(lane, loop)
+            self.waiters[lane].append(waiter)
+            return waiter, wait_time
+
+    def _unregister_waiter(self, waiter: SlotWaiter):
+        """等待结束（被唤醒、超时或被取消）后移除等待者"""
+        with self.pool_lock:
+            try:
+                self.waiters[waiter.lane].remove(waiter)
+            except ValueError:
+                pass
+
+    def _wait_for_slot(self, tokens: int, lane: str, generation: int, remaining: Optional[float]) -> bool:
+        """
+        同步等待名额释放、配额恢复或熔断冷却结束
+        :return: 所有客户端长时间熔断时返回 False
+        """
+        waiter, wait_time = self._register_waiter(tokens, lane, generation)
+        if wait_time is None:
+            return False
+        if waiter is None:
+            return True
+        try:
+            waiter.event.wait(wait_time if remaining is None else max(min(wait_time, remaining), 0))
+        finally:
+            self._unregister_waiter(waiter)
+        return True
+
+    async def _await_slot(self, tokens: int, lane: str, generation: int, remaining: Optional[float]) -> bool:
+        """_wait_for_slot 的异步版本，由释放名额的线程通过事件循环唤醒"""
+        waiter, wait_time = self._register_waiter(tokens, lane, generation, asyncio.get_running_loop())
+        if wait_time is None:
+            return False
+        if waiter is None:
+            return True
+        try:
+            await asyncio.wait({waiter.future}, timeout=wait_time if remaining is None else max(min(wait_time, remaining), 0))
+        finally:
+            self._unregister_waiter(waiter)
+        return True
+
+    def _release(self, status: ClientStatus, lane: str):
+        """请求结束后释放并发名额"""
+        status.decrement_active()
+        with self.pool_lock:
+            self.lanes[lane].on_released()
+            self._notify_locked(1)
+
+    def _release_unused(self, status: ClientStatus, tokens: int, lane: str):
+        """请求没有实际发送时释放并发名额、退还配额和熔断器的探测名额"""
+        with self.pool_lock:
+            status.rate_limiter.refund(tokens)
+            status.breaker.on_released()
+        self._release(status, lane)
+
+    def _release_interrupted(self, status: ClientStatus, lane: str):
+        """请求因截止时间到达而中断时释放并发名额和探测名额，不计入熔断器，配额已消耗不退还"""
+        with self.pool_lock:
+            status.breaker.on_released()
+        self._release(status, lane)
+
+    def _record_success(self, client, status: ClientStatus, operation: str, latency: float):
+        """记录成功，在释放名额之后调用"""
+        if client.api_key_model:
+            get_usage_recorder().record_latency(client.api_key_model.pk, latency)
+        with self.pool_lock:
+            was_closed = status.breaker.state == CircuitBreaker.CLOSED
+            slots = status.concurrency.max_in_flight
+            status.breaker.record_success()
+            self.latency_tracker.record(operation, latency)
+            # 名额已释放，加上本次请求才是请求进行时的并发数
+            status.concurrency.on_success(operation, latency, status.active_requests + 1)
+            if not was_closed:
+                # 熔断恢复，该密钥的名额全部可用
+                self._notify_locked()
+            elif status.concurrency.max_in_flight > slots:
+                self._notify_locked(status.concurrency.max_in_flight - slots)
+
+    def _record_failure(self, status: ClientStatus, error: str) -> str:
+        """记录失败并更新熔断器，返回错误类型"""
+        error_class = classify_error(error)
+        status.record_failure(error)
+        with self.pool_lock:
+            state = status.breaker.state
+            status.breaker.record_failure(error_class)
+            if status.breaker.state != state:
+                # 熔断状态变化后，等待的请求按新的冷却时间重新计算等待时间
+                self._notify_locked()
+            if error_class == ErrorClass.QUOTA:
+                status.concurrency.on_quota_error()
+            elif error_class == ErrorClass.TRANSIENT:
+                status.concurrency.on_transient_error()
+        return error_class
+
+    def _retry_backoff(self, attempt: int) -> float:
+        """第 attempt 次失败后的等待时间：指数退避，带随机抖动，不超过 max_retry_delay"""
+        return min(self.retry_delay * 2 ** (attempt - 1), self.max_retry_delay) * random.uniform(0.5, 1.0)
+
+    def _wait_time_locked(self, tokens: int = 0) -> Optional[float]:
+        """
+        在持有 pool_lock 时计算没有可用客户端时的最长等待时间：最早恢复配额或结束熔断冷却的客户端所需的时间；
+        只是在等并发名额或熔断探测结果时，由名额释放或熔断状态变化唤醒，等待时间为兜底的 SLOT_WAIT_TIMEOUT
+        :return: 所有客户端都已熔断且超过 max_circuit_wait 才会恢复时返回 None
+        """
+        wait_times = []
+        all_open = True
+        # 是否有客户端只是并发已满或正在探测，这种情况由名额释放或探测结果唤醒
+        wakeup_expected = False
+        for client in self.clients:
+            status = self.client_status[client]
+            if status.breaker.available():
+                all_open = False
+                rate_wait = status.rate_limiter.wait_time(tokens)
+                if rate_wait > 0:
+                    wait_times.append(rate_wait)
+                else:
+                    wakeup_expected = True
+            elif status.breaker.state == CircuitBreaker.HALF_OPEN:
+                all_open = False
+                wakeup_expected = True
+            else:
+                wait_times.append(status.breaker.retry_after())
+        if wakeup_expected:
+            wait_times.append(SLOT_WAIT_TIMEOUT)
+        wait_time = min(wait_times, default=SLOT_WAIT_TIMEOUT)
+        if all_open and wait_time > self.max_circuit_wait:
+            return None
+        return wait_time
+
+    @staticmethod
+    def _make_deadline(timeout: Optional[float], deadline: Optional[float]) -> Optional[float]:
+        """将相对的 timeout 和绝对的 deadline（time.monotonic() 时间）合并为最早的截止时间"""
+        if timeout is not None:
+            timeout_deadline = time.monotonic() + timeout
+            deadline = timeout_deadline if deadline is None else min(deadline, timeout_deadline)
+        return deadline
+
+    @staticmethod
+    def _remaining(deadline: Optional[float]) -> Optional[float]:
+        """距离截止时间的剩余秒数，没有截止时间时返回 None"""
+        return None if deadline is None else deadline - time.monotonic()
+
+    @staticmethod
+    def _timeout_response(started: float, last_error: Optional[str]) -> Dict[str, Any]:
+        return {
+            'error': f"Request timed out after {time.monotonic() - started:.1f} seconds. Last error: {last_error}",
+            'timed_out': True
+        }
+
+    def _select_client_locked(self, tokens: int = 0, exclude: Optional[GeminiClient] = None) -> Optional[GeminiClient]:
+        """
+        在持有 pool_lock 时选择客户端，客户端列表与状态在锁内保持一致
+        :param exclude: 不选择的客户端，对冲请求使用与原请求不同的密钥
+        """
+        # 过滤出可用的客户端（未熔断，活跃请求数未达到最大值，且 RPM/TPM 配额充足）
+        available_clients = [
+            client for client in self.clients
+            if client is not exclude
+            and self.client_status[client].breaker.available()
+            and self.client_status[client].active_requests < self.client_status[client].concurrency.max_in_flight
+            and self.client_status[client].rate_limiter.wait_time(tokens) == 0
+        ]
+        
+        if not available_clients:
+            return None
+        
+        # 权重 = 健康度 / (1 + 活跃请求数)，健康且空闲的客户端更容易被选中
+        weights = [
+            max(self.client_status[client].breaker.health, MIN_HEALTH_WEIGHT)
+            / (1 + self.client_status[client].active_requests)
+            for client in available_clients
+        ]
+        client = random.choices(available_clients, weights=weights)[0]
+        logger.debug(f"Selected client {client.api_key[-8:]} from {len(available_clients)} available clients")
+        return client
 
     def execute_with_retry(self,
                           operation: str,
                           *args,
+                          use_cache: bool = True,
+                          timeout: Optional[float] = None,
+                          deadline: Optional[float] = None,
+                          lane: str = Lane.BATCH,
                           **kwargs) -> Dict[str, Any]:
         """
         执行操作，包含重试逻辑
         :param operation: 要执行的操作函数
-        :return: 操作结果
+        :param use_cache: 是否使用响应缓存，相同模型、相同输入的成功结果直接从缓存返回
+        :param timeout: 整个调用（包括等待、重试和退避）的最长耗时（秒），None 表示不限制
+        :param deadline: 绝对截止时间（time.monotonic() 时间），多次调用共用同一个截止时间时使用
+        :param lane: 优先级通道，用户正在等待结果的请求使用 Lane.INTERACTIVE
+        :return: 操作结果；超过截止时间时返回包含 'error' 和 'timed_out' 的字典
         """
+        started = time.monotonic()
+        deadline = self._make_deadline(timeout, deadline)
         last_error = None
+        response_cache = get_response_cache() if use_cache else None
+        arguments_hash = response_cache.hash_arguments(args, kwargs) if response_cache else None
+        checked_models = set()
         
-        for attempt in range(self.max_retries):
-            self.clients = self.gather_clients()
-            client = self._select_client()
-
-            time.sleep(self.retry_delay * attempt)
-            
-            if client is None:
+        tokens = estimate_request_tokens(operation, args, kwargs)
+        if not self._get_clients():
+            return {'error': 'No Client available. Please check your API keys.'}
+        
+        attempt = 0
+        queued_since = None
+        while attempt < self.max_retries:
+            remaining = self._remaining(deadline)
+            if remaining is not None and remaining <= 0:
+                self._abandon_queue(lane, queued_since)
+                return self._timeout_response(started, last_error)
+            generation = self.wake_generation
+            acquired = self._acquire_client(tokens, lane, queued_since)
+            if acquired is None:
+                if queued_since is None:
+                    queued_since = self._enqueue(lane)
+                # 没有空闲且配额充足的客户端时等待，不消耗重试次数
+                if not self._wait_for_slot(tokens, lane, generation, remaining):
+                    self._abandon_queue(lane, queued_since)
+                    return {'error': f"All API keys are unavailable (circuit open). Last error: {last_error}"}
                 continue
-                
+            client, status = acquired
+            queued_since = None
+
             try:
-                # 更新客户端状态
-                self.client_status[client].increment_active()
+                cache_key, cached = self._cached_response(response_cache, operation, arguments_hash, client, checked_models)
+                if cached is not None:
+                    self._release_unused(status, tokens, lane)
+                    return cached
                 
                 # 获取客户端对应的方法
                 actual_method = getattr(client, operation)
                 
-                # 执行操作
-                result = actual_method(*args, **kwargs)
-                
-                # 如果成功，重置错误计数
-                self.client_status[client].decrement_active()
+                # 执行操作，有截止时间时将剩余时间作为本次请求的超时时间
+                call_started = time.monotonic()
+                if remaining is None:
+                    result = actual_method(*args, **kwargs)
+                else:
+                    result = actual_method(*args, timeout=remaining, **kwargs)
                 
                 # 检查结果中是否包含错误
                 if isinstance(result, dict) and 'error' in result:
                     raise Exception(result['error'])
-                logger.debug(f"Operation succeeded on attempt {attempt + 1} at client {client.api_key[-8:]}")
-                return result
-                
             except Exception as e:
                 last_error = str(e)
-                logger.debug(f"Operation failed on attempt {attempt + 1}: {last_error}")
+                if deadline is not None and time.monotonic() >= deadline:
+                    # 截止时间已到，请求被中断，不是密钥的问题
+                    self._release_interrupted(status, lane)
+                    return self._timeout_response(started, last_error)
+                self._release(status, lane)
                 
-                # 记录失败并更新客户端状态
-                self.client_status[client].record_failure(last_error)
-                self.client_status[client].decrement_active()
+                # 记录失败并更新熔断器
+                error_class = self._record_failure(status, last_error)
+                logger.debug(f"Operation failed on attempt {attempt + 1} ({error_class}): {last_error}")
+                if error_class == ErrorClass.REQUEST:
+                    # 请求本身有误，换客户端重试也不会成功
+                    break
                 
                 # 如果还有重试机会，等待后继续
-                if attempt < self.max_retries - 1:
-                    time.sleep(self.retry_delay ** (attempt + 1))
-                    continue
-                    
-                break
+                attempt += 1
+                if attempt < self.max_retries:
+                    backoff = self._retry_backoff(attempt)
+                    remaining = self._remaining(deadline)
+                    time.sleep(backoff if remaining is None else max(min(backoff, remaining), 0))
+                continue
+
+            self._release(status, lane)
+            self._record_success(client, status, operation, time.monotonic() - call_started)
+            logger.debug(f"Operation succeeded on attempt {attempt + 1} at client {client.api_key[-8:]}")
+            if isinstance(result, dict):
+                # 附带实际使用的模型，调用方可以据此区分结果（例如翻译记忆）
+                result.setdefault('model', client.get_model_name(operation))
+            if cache_key:
+                response_cache.set(cache_key, result)
+            return result
         
         # 所有重试都失败
         return {
             'error': f"All retry attempts failed. Last error: {last_error}"
         }
 
+    def stream_with_retry(self,
+                          operation: str,
+                          *args,
+                          timeout: Optional[float] = None,
+                          deadline: Optional[float] = None,
+                          lane: str = Lane.BATCH,
+                          **kwargs) -> Iterator[Dict[str, Any]]:
+        """
+        execute_with_retry 的流式版本，调用客户端的 stream_<operation> 方法，逐段返回 {'text': 片段}；
+        返回第一个片段之前失败时换客户端重试，之后失败时已返回的内容无法撤回，返回 {'error': ...} 后结束。
+        不使用响应缓存；调用方提前关闭生成器时释放客户端名额
+        :param operation: 同步操作名，例如 "chat_with_text"
+        :param timeout: 开始返回内容之前（包括等待和重试）的最长耗时（秒），同时作为读取每个片段的超时时间
+        :param deadline: 绝对截止时间（time.monotonic() 时间）
+        :param lane: 优先级通道
+        """
+        started = time.monotonic()
+        deadline = self._make_deadline(timeout, deadline)
+        last_error = None
+        tokens = estimate_request_tokens(operation, args, kwargs)
+        if not self._get_clients():
+            yield {'error': 'No Client available. Please check your API keys.'}
+            return
+
+        attempt = 0
+        queued_since = None
+        while attempt < self.max_retries:
+            remaining = self._remaining(deadline)
+            if remaining is not None and remaining <= 0:
+                self._abandon_queue(lane, queued_since)
+                yield self._timeout_response(started, last_error)
+                return
+            generation = self.wake_generation
+            acquired = self._acquire_client(tokens, lane, queued_since)
+            if acquired is None:
+                if queued_since is None:
+                    queued_since = self._enqueue(lane)
+                if not self._wait_for_slot(tokens, lane, generation, remaining):
+                    self._abandon_queue(lane, queued_since)
+                    yield {'error': f"All API keys are unavailable (circuit open). Last error: {last_error}"}
+                    return
+                continue
+            client, status = acquired
+            queued_since = None
+
+            call_started = time.monotonic()
+            received = False
+            stream = None
+            try:
+                method = getattr(client, f"stream_{operation}")
+                if remaining is None:
+                    stream = method(*args, **kwargs)
+                else:
+                    stream = method(*args, timeout=remaining, **kwargs)
+                for text in stream:
+                    received = True
+                    yield {'text': text}
+            except GeneratorExit:
+                # 调用方提前结束（例如浏览器断开连接），关闭进行中的请求
+                if stream is not None:
+                    stream.close()
+                self._release_interrupted(status, lane)
+                raise
+            except Exception as e:
+                last_error = str(e)
+                if not received and deadline is not None and time.monotonic() >= deadline:
+                    self._release_interrupted(status, lane)
+                    yield self._timeout_response(started, last_error)
+                    return
+                self._release(status, lane)
+                error_class = self._record_failure(status, last_error)
+                logger.debug(f"Stream failed on attempt {attempt + 1} ({error_class}): {last_error}")
+                if received:
+                    yield {'error': f"Stream interrupted: {last_error}"}
+                    return
+                if error_class == ErrorClass.REQUEST:
+                    break
+
+                attempt += 1
+                if attempt < self.max_retries:
+                    backoff = self._retry_backoff(attempt)
+                    remaining = self._remaining(deadline)
+                    time.sleep(backoff if remaining is None else max(min(backoff, remaining), 0))
+                continue
+
+            self._release(status, lane)
+            # 流式请求的耗时包括生成全部内容的时间，与普通请求分开统计
+            self._record_success(client, status, f"stream_{operation}", time.monotonic() - call_started)
+            logger.debug(f"Stream succeeded on attempt {attempt + 1} at client {client.api_key[-8:]}")
+            return
+
+        # 所有重试都失败
+        yield {
+            'error': f"All retry attempts failed. Last error: {last_error}"
+        }
+
+    async def astream_with_retry(self,
+                                 operation: str,
+                                 *args,
+                                 timeout: Optional[float] = None,
+                                 deadline: Optional[float] = None,
+                                 lane: str = Lane.BATCH,
+                                 **kwargs) -> AsyncIterator[Dict[str, Any]]:
+        """
+        stream_with_retry 的异步版本，调用客户端的 astream_<operation> 方法，重试规则相同；
+        调用方取消或提前关闭生成器时关闭进行中的请求并释放客户端名额
+        :param operation: 同步操作名，例如 "chat_with_text"
+        :param timeout: 开始返回内容之前（包括等待和重试）的最长耗时（秒）
+        :param deadline: 绝对截止时间（time.monotonic() 时间）
+        :param lane: 优先级通道
+        """
+        started = time.monotonic()
+        deadline = self._make_deadline(timeout, deadline)
+        last_error = None
+        if not await self.aget_clients():
+            yield {'error': 'No Client available. Please check your API keys.'}
+            return
+
+        tokens = await asyncio.to_thread(estimate_request_tokens, operation, args, kwargs)
+
+        attempt = 0
+        queued_since = None
+        while attempt < self.max_retries:
+            remaining = self._remaining(deadline)
+            if remaining is not None and remaining <= 0:
+                self._abandon_queue(lane, queued_since)
+                yield self._timeout_response(started, last_error)
+                return
+            generation = self.wake_generation
+            acquired = self._acquire_client(tokens, lane, queued_since)
+            if acquired is None:
+                if queued_since is None:
+                    queued_since = self._enqueue(lane)
+                try:
+                    available = await self._await_slot(tokens, lane, generation, remaining)
+                except asyncio.CancelledError:
+                    self._abandon_queue(lane, queued_since)
+                    raise
+                if not available:
+                    self._abandon_queue(lane, queued_since)
+                    yield {'error': f"All API keys are unavailable (circuit open). Last error: {last_error}"}
+                    return
+                continue
+            client, status = acquired
+            queued_since = None
+
+            call_started = time.monotonic()
+            received = False
+            stream = None
+            try:
+                method = getattr(client, f"astream_{operation}")
+                if remaining is None:
+                    stream = method(*args, **kwargs)
+                else:
+                    stream = method(*args, timeout=remaining, **kwargs)
+                async for text in stream:
+                    received = True
+                    yield {'text': text}
+            except (GeneratorExit, asyncio.CancelledError):
+                # 调用方取消或提前结束（例如浏览器断开连接），关闭进行中的请求
+                if stream is not None:
+                    await stream.aclose()
+                self._release_interrupted(status, lane)
+                raise
+            except Exception as e:
+                last_error = str(e)
+                if not received and deadline is not None and time.monotonic() >= deadline:
+                    self._release_interrupted(status, lane)
+                    yield self._timeout_response(started, last_error)
+                    return
+                self._release(status, lane)
+                error_class = self._record_failure(status, last_error)
+                logger.debug(f"Async stream failed on attempt {attempt + 1} ({error_class}): {last_error}")
+                if received:
+                    yield {'error': f"Stream interrupted: {last_error}"}
+                    return
+                if error_class == ErrorClass.REQUEST:
+                    break
+
+                attempt += 1
+                if attempt < self.max_retries:
+                    backoff = self._retry_backoff(attempt)
+                    remaining = self._remaining(deadline)
+                    await asyncio.sleep(backoff if remaining is None else max(min(backoff, remaining), 0))
+                continue
+
+            self._release(status, lane)
+            # 流式请求的耗时包括生成全部内容的时间，与普通请求分开统计
+            self._record_success(client, status, f"stream_{operation}", time.monotonic() - call_started)
+            logger.debug(f"Async stream succeeded on attempt {attempt + 1} at client {client.api_key[-8:]}")
+            return
+
+        # 所有重试都失败
+        yield {
+            'error': f"All retry attempts failed. Last error: {last_error}"
+        }
+
+    @staticmethod
+    def _cached_response(response_cache, operation: str, arguments_hash: str, client, checked_models: set):
+        """
+        返回 (缓存键, 缓存的响应)，未启用缓存时均为 None；
+        同一模型只查询一次缓存，重试时不重复计入未命中
+        """
+        if not response_cache:
+            return None, None
+        model_name = client.get_model_name(operation)
+        cache_key = response_cache.make_key(operation, model_name, arguments_hash)
+        if model_name in checked_models:
+            return cache_key, None
+        checked_models.add(model_name)
+        cached = response_cache.get(cache_key)
+        if cached is not None:
+            logger.debug(f"Operation {operation} served from response cache")
+        return cache_key, cached
+
+    async def aexecute_with_retry(self,
+                                  operation: str,
+                                  *args,
+                                  use_cache: bool = True,
+                                  timeout: Optional[float] = None,
+                                  deadline: Optional[float] = None,
+                                  lane: str = Lane.BATCH,
+                                  **kwargs) -> Dict[str, Any]:
+        """
+        execute_with_retry 的异步版本，调用客户端的 a<operation> 方法，
+        与同步版本共用客户端状态、负载均衡和响应缓存（缓存键使用同步操作名）
+        没有空闲且配额充足的客户端时只等待，不消耗重试次数
+        :param operation: 同步操作名，例如 "chat_with_text"
+        :param use_cache: 是否使用响应缓存
+        :param timeout: 整个调用的最长耗时（秒），到达截止时间时取消进行中的请求
+        :param deadline: 绝对截止时间（time.monotonic() 时间）
+        :param lane: 优先级通道
+        :return: 操作结果
+        """
+        started = time.monotonic()
+        deadline = self._make_deadline(timeout, deadline)
+        last_error = None
+        response_cache = get_response_cache() if use_cache else None
+        arguments_hash = await asyncio.to_thread(response_cache.hash_arguments, args, kwargs) if response_cache else None
+        checked_models = set()
+        if not await self.aget_clients():
+            return {'error': 'No Client available. Please check your API keys.'}
+        tokens = await asyncio.to_thread(estimate_request_tokens, operation, args, kwargs)
+
+        attempt = 0
+        queued_since = None
+        while attempt < self.max_retries:
+            remaining = self._remaining(deadline)
+            if remaining is not None and remaining <= 0:
+                self._abandon_queue(lane, queued_since)
+                return self._timeout_response(started, last_error)
+            generation = self.wake_generation
+            acquired = self._acquire_client(tokens, lane, queued_since)
+            if acquired is None:
+                if queued_since is None:
+                    queued_since = self._enqueue(lane)
+                try:
+                    available = await self._await_slot(tokens, lane, generation, remaining)
+                except asyncio.CancelledError:
+                    self._abandon_queue(lane, queued_since)
+                    raise
+                if not available:
+                    self._abandon_queue(lane, queued_since)
+                    return {'error': f"All API keys are unavailable (circuit open). Last error: {last_error}"}
+                continue
+            client, status = acquired
+            queued_since = None
+
+            try:
+                cache_key, cached = await asyncio.to_thread(
+                    self._cached_response, response_cache, operation, arguments_hash, client, checked_models
+                )
+            except BaseException:
+                self._release_unused(status, tokens, lane)
+                raise
+            if cached is not None:
+                self._release_unused(status, tokens, lane)
+                return cached
+
+            result, error, error_class = await self._ahedged_attempt(
+                client, status, operation, args, kwargs, tokens, lane, deadline
+            )
+            if error is not None:
+                last_error = error
+                if error_class == TIMED_OUT:
+                    return self._timeout_response(started, last_error)
+                logger.debug(f"Async operation failed on attempt {attempt + 1} ({error_class}): {last_error}")
+                if error_class == ErrorClass.REQUEST:
+                    break
+
+                attempt += 1
+                if attempt < self.max_retries:
+                    backoff = self._retry_backoff(attempt)
+                    remaining = self._remaining(deadline)
+                    await asyncio.sleep(backoff if remaining is None else max(min(backoff, remaining), 0))
+                continue
+
+            logger.debug(f"Async operation succeeded on attempt {attempt + 1}")
+            if cache_key:
+                await asyncio.to_thread(response_cache.set, cache_key, result)
+            return result
+
+        # 所有重试都失败
+        return {
+            'error': f"All retry attempts failed. Last error: {last_error}"
+        }
+
+    async def _aattempt(self, client, status: ClientStatus, operation: str, args, kwargs,
+                        lane: str, deadline: Optional[float]) -> tuple[Optional[dict], Optional[str], Optional[str]]:
+        """
+        在已占用名额的客户端上执行一次异步请求，记录结果并释放名额
+        :return: (结果, 错误信息, 错误类型)；成功时错误信息为 None，截止时间到达时错误类型为 TIMED_OUT
+        """
+        remaining = self._remaining(deadline)
+        method = getattr(client, f"a{operation}")
+        started = time.monotonic()
+        try:
+            if remaining is None:
+                result = await method(*args, **kwargs)
+            else:
+                # 截止时间到达时取消进行中的请求，连接归还连接池
+                result = await asyncio.wait_for(method(*args, timeout=remaining, **kwargs), remaining)
+            if isinstance(result, dict) and 'error' in result:
+                raise Exception(result['error'])
+        except asyncio.CancelledError:
+            # 调用方取消或对冲请求落败时释放名额后继续传播
+            self._release_interrupted(status, lane)
+            raise
+        except Exception as e:
+            error = str(e) or type(e).__name__
+            if deadline is not None and time.monotonic() >= deadline:
+                self._release_interrupted(status, lane)
+                return None, error, TIMED_OUT
+            self._release(status, lane)
+            return None, error, self._record_failure(status, error)
+
+        self._release(status, lane)
+        self._record_success(client, status, operation, time.monotonic() - started)
+        logger.debug(f"Async operation {operation} succeeded at client {client.api_key[-8:]}")
+        if isinstance(result, dict):
+            result.setdefault('model', client.get_model_name(operation))
+        return result, None, None
+
+    async def _ahedged_attempt(self, client, status: ClientStatus, operation: str, args, kwargs,
+                               tokens: int, lane: str, deadline: Optional[float]):
+        """
+        执行一次请求，启用对冲时，超过近期延迟分位数仍未返回则在另一个密钥上发送相同的请求，
+        采用先成功返回的结果并取消另一个请求；返回值与 _aattempt 相同
+        """
+        with self.pool_lock:
+            self.hedge_budget.on_request()
+        hedge_delay = self._hedge_delay(operation)
+        if hedge_delay is None:
+            return await self._aattempt(client, status, operation, args, kwargs, lane, deadline)
+
+        primary = asyncio.ensure_future(self._aattempt(client, status, operation, args, kwargs, lane, deadline))
+        legs = [primary]
+        try:
+            done, _ = await asyncio.wait(legs, timeout=hedge_delay)
+            if not done:
+                hedge = self._acquire_hedge(tokens, lane, client)
+                if hedge is not None:
+                    hedge_client, hedge_status = hedge
+                    logger.debug(f"Hedging {operation} on client {hedge_client.api_key[-8:]} after {hedge_delay:.1f}s")
+                    legs.append(asyncio.ensure_future(
+                        self._aattempt(hedge_client, hedge_status, operation, args, kwargs, lane, deadline)
+                    ))
+
+            outcome = None
+            pending = set(legs)
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for leg in done:
+                    outcome = leg.result()
+                    result, error, error_class = outcome
+                    if error is None:
+                        if leg is not primary:
+                            with self.pool_lock:
+                                self.hedge_budget.on_hedge_won()
+                        return outcome
+                    if error_class in (ErrorClass.REQUEST, TIMED_OUT):
+                        # 另一个请求也不会成功
+                        return outcome
+            return outcome
+        finally:
+            for leg in legs:
+                if not leg.done():
+                    leg.cancel()
+
+    def _hedge_delay(self, operation: str) -> Optional[float]:
+        """发送对冲请求前的等待时间，未启用对冲或延迟样本不足时返回 None"""
+        if not self.hedge_percentile:
+            return None
+        with self.pool_lock:
+            latency = self.latency_tracker.percentile(operation, self.hedge_percentile)
+        if latency is None:
+            return None
+        return max(latency, self.hedge_min_delay)
+
+    def _acquire_hedge(self, tokens: int, lane: str, exclude) -> Optional[tuple[GeminiClient, ClientStatus]]:
+        """为对冲请求占用另一个客户端，对冲额度不足或没有空闲客户端时返回 None，不排队等待"""
+        with self.pool_lock:
+            if self.hedge_budget.credits < 1 or not self._lane_admits(lane):
+                return None
+            client = self._select_client_locked(tokens, exclude=exclude)
+            if client is None or not self.hedge_budget.try_spend():
+                return None
+            status = self.client_status[client]
+            status.increment_active()
+            status.rate_limiter.acquire(tokens)
+            status.breaker.on_selected()
+            self.lanes[lane].on_acquired(0.0, False)
+            return client, status
+
+    def get_model_names(self, operation: str) -> List[str]:
+        """
+        当前各客户端执行某个操作使用的模型，按客户端顺序去重
+        """
+        return list(dict.fromkeys(client.get_model_name(operation) for client in self._get_clients() or []))
+
     def get_pool_status(self) -> Dict[str, Dict]:
         """
         获取客户端池状态
         """
         status = {}
-        for client in self._get_clients():
-            client_stat = self.client_status[client]
+        self._get_clients()
+        with self.pool_lock:
+            clients = [
+                (client, self.client_status[client], self.client_status[client].breaker.status(),
+                 self.client_status[client].concurrency.status())
+                for client in self.clients
+            ]
+        for client, client_stat, breaker_status, concurrency_status in clients:
             status[id(client)] = {
                 'active_requests': client_stat.active_requests,
                 'total_requests': client_stat.total_requests,
                 'failed_requests': client_stat.failed_requests,
                 'last_error': str(client_stat.last_error) if client_stat.last_error else None,
-                'last_used': client_stat.last_used
+                'last_used': client_stat.last_used,
+                **client_stat.rate_limiter.status(),
+                **breaker_status,
+                **concurrency_status
             }
         return status
 
-    def shutdown(self):
+    def get_lane_status(self) -> Dict[str, Dict]:
+        """
+        获取各优先级通道的排队深度、等待时间和可占用的并发名额
+        """
+        self._get_clients()
+        with self.pool_lock:
+            return {
+                lane: {**stats.status(), 'capacity': self._lane_capacity(lane)}
+                for lane, stats in self.lanes.items()
+            }
+
+    def get_hedge_status(self) -> Dict[str, Any]:
+        """
+        获取对冲请求的统计，以及各操作当前的对冲等待时间
+        """
+        with self.pool_lock:
+            status = self.hedge_budget.status()
+            operations = list(self.latency_tracker.samples)
+        return {
+            'enabled': bool(self.hedge_percentile),
+            'percentile': self.hedge_percentile,
+            **status,
+            'hedge_delays': {operation: self._hedge_delay(operation) for operation in operations},
+        }
+
+    def get_cache_stats(self) -> Optional[Dict[str, Any]]:
         """
-        关闭客户端池
+        获取响应缓存的命中统计，缓存未启用时返回 None
         """
-        self.thread_pool.shutdown(wait=True)
-        logger.info("ClientPool shutdown complete")
\ No newline at end of file
+        response_cache = get_response_cache()
+        return response_cache.stats() if response_cache else None
@@ -0,0 +1,101 @@
+# API 密钥的自适应并发
+# 每个密钥的并发上限按 AIMD 调整：延迟和错误率正常且并发名额被用满时缓慢增加（每个成功请求增加 1/limit，
+# 约等于每轮请求增加 1），遇到 429 或延迟明显升高时按比例减少，并发上限因此贴近密钥背后服务商或代理的实际承载能力。
+
+import time
+
+class LatencyBaseline:
+    """单个操作的延迟基线：长期 EWMA 作为基线，短期 EWMA 反映近期延迟"""
+    def __init__(self):
+        self.samples = 0
+        self.long = 0.0
+        self.short = 0.0
+
+    def record(self, latency: float, long_alpha: float, short_alpha: float):
+        if self.samples == 0:
+            self.long = self.short = latency
+        else:
+            self.long += long_alpha * (latency - self.long)
+            self.short += short_alpha * (latency - self.short)
+        self.samples += 1
+
+class AIMDConcurrency:
+    """
+    单个 API 密钥的并发上限
+    不是线程安全的，由 ClientPool 在持有 pool_lock 时调用
+    """
+    def __init__(self,
+                 initial_limit: float = 2,
+                 min_limit: float = 1,
+                 max_limit: float = 32,
+                 quota_backoff: float = 0.5,
+                 error_backoff: float = 0.8,
+                 latency_backoff: float = 0.9,
+                 latency_tolerance: float = 2.0,
+                 min_samples: int = 10):
+        """
+        :param initial_limit: 初始并发上限
+        :param min_limit: 并发上限的下限
+        :param max_limit: 并发上限的上限
+        :param quota_backoff: 遇到 429 等配额错误时的缩减比例
+        :param error_backoff: 遇到临时错误时的缩减比例
+        :param latency_backoff: 延迟升高时的缩减比例
+        :param latency_tolerance: 近期延迟超过基线的多少倍视为延迟升高
+        :param min_samples: 某个操作的样本数达到该值后才判断延迟是否升高
+        """
+        self.limit = float(min(max(initial_limit, min_limit), max_limit))
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.quota_backoff = quota_backoff
+        self.error_backoff = error_backoff
+        self.latency_backoff = latency_backoff
+        self.latency_tolerance = latency_tolerance
+        self.min_samples = min_samples
+        self.baselines: dict[str, LatencyBaseline] = {}
+        self.last_decrease = 0.0
+
+    @property
+    def max_in_flight(self) -> int:
+        """当前允许的并发请求数"""
+        return max(int(self.limit), 1)
+
+    def _window(self) -> float:
+        """一轮请求的大致时长：各操作延迟基线的最大值，没有样本时为 1 秒"""
+        return max((baseline.long for baseline in self.baselines.values()), default=1.0)
+
+    def _decrease(self, ratio: float):
+        """按比例缩减；一轮请求内只缩减一次，同时返回的多个 429 或慢响应只算一次"""
+        now = time.monotonic()
+        if now - self.last_decrease < self._window():
+            return
+        self.limit = max(self.limit * ratio, self.min_limit)
+        self.last_decrease = now
+
+    def on_success(self, operation: str, latency: float, in_flight: int):
+        """
+        :param latency: 本次请求的耗时（秒）
+        :param in_flight: 本次请求进行时该密钥的并发请求数
+        """
+        baseline = self.baselines.setdefault(operation, LatencyBaseline())
+        baseline.record(latency, long_alpha=0.05, short_alpha=0.3)
+        if baseline.samples >= self.min_samples and baseline.short > baseline.long * self.latency_tolerance:
+            self._decrease(self.latency_backoff)
+            return
+        # 只有并发名额被用满时才增加上限，避免空闲的密钥上限无限增长
+        if in_flight >= self.max_in_flight:
+            self.limit = min(self.limit + 1 / self.limit, self.max_limit)
+
+    def on_quota_error(self):
+        self._decrease(self.quota_backoff)
+
+    def on_transient_error(self):
+        self._decrease(self.error_backoff)
+
+    def status(self) -> dict:
+        latency_baselines = {
+            operation: round(baseline.long, 3) for operation, baseline in self.baselines.items()
+        }
+        return {
+            'concurrency_limit': round(self.limit, 2),
+            'latency_baselines': latency_baselines,
+        }
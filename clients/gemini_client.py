@@ -1,24 +1,31 @@
+import asyncio
 import base64
 import io
+import json
 import os
 
 from PIL import Image
 from google import generativeai as genai
 from google.ai import generativelanguage as glm
-from typing import Literal
+from typing import AsyncIterator, Iterator, Literal, Optional
+
+import httpx
 from api.models import ApiKey
-from django.utils import timezone
+from clients.usage_recorder import get_usage_recorder
+from clients.async_http import get_async_http_client
+
+GEMINI_DEFAULT_ENDPOINT = 'generativelanguage.googleapis.com'
 
 
 class GeminiClient:
-    def __init__(self, api_key=None, base_url=None):
+    def __init__(self, api_key=None, base_url=None, api_key_model: ApiKey = None):
+        """
+        :param api_key_model: 对应的 ApiKey 记录，调用方已查询过时传入，避免重复查询
+        """
         # 初始化Gemini API配置
         self.api_key = api_key if api_key else os.getenv('GEMINI_API_KEY')
         self.base_url = base_url if base_url else os.getenv('GEMINI_API_BASE')
-        try:
-            self.api_key_model = ApiKey.objects.get(key=self.api_key)
-        except ApiKey.DoesNotExist:
-            self.api_key_model = None
+        self.api_key_model = api_key_model if api_key_model else self._get_api_key_model(self.api_key)
 
         # 创建模型配置
         client = glm.GenerativeServiceClient(
@@ -34,17 +41,29 @@ class GeminiClient:
         self.vision_model = genai.GenerativeModel('gemini-1.5-flash-latest')
         self.vision_model._client = client
 
-    def chat_with_text(self, message) -> dict:
+    @staticmethod
+    def _get_api_key_model(api_key):
+        try:
+            return ApiKey.objects.get(key=api_key)
+        except ApiKey.DoesNotExist:
+            return None
+
+    @staticmethod
+    def _request_options(timeout: Optional[float]) -> Optional[dict]:
+        return {'timeout': timeout} if timeout else None
+
+    def chat_with_text(self, message, timeout: Optional[float] = None) -> dict:
         """
         纯文本对话功能
         :param message: 用户输入的文本消息
         :param chat_history: 可选的聊天历史记录
+        :param timeout: 请求超时时间（秒），None 表示使用默认值
         :return: 模型的回复
         """
         try:
             chat = self.text_model.start_chat()
 
-            response = chat.send_message(message)
+            response = chat.send_message(message, request_options=self._request_options(timeout))
             self.update_api_key_usage()
             return {
                 'text': response.text,
@@ -55,57 +74,72 @@ class GeminiClient:
                 'error': str(e)
             }
 
-    def chat_with_image(self, message, image_data, image_type: Literal["base64", "path"]="base64"):
+    @staticmethod
+    def _load_image(image_data, image_type: Literal["base64", "path"]="base64") -> tuple[Image.Image, bytes]:
+        """
+        加载并校验图片
+        :return: (图片, 图片文件的原始字节)
+        :raises ValueError: 图片数据或格式无效
+        """
+        if image_type == "base64":
+            # 处理可能的 base64 前缀
+            if ',' in image_data:
+                prefix, image_data = image_data.split(',', 1)
+                if not any(valid_prefix in prefix.lower() for valid_prefix in ['image/jpeg', 'image/png', 'image/gif']):
+                    raise ValueError('不支持的图片格式，请使用 JPEG、PNG 或 GIF 格式')
+
+            # 添加必要的填充
+            padding = 4 - (len(image_data) % 4) if len(image_data) % 4 != 0 else 0
+            image_data += '=' * padding
+
+            try:
+                image_bytes = base64.b64decode(image_data)
+            except Exception as e:
+                raise ValueError(f'Base64解码错误: {str(e)}')
+            if len(image_bytes) == 0:
+                raise ValueError('Base64解码后的数据为空')
+
+            try:
+                image = Image.open(io.BytesIO(image_bytes))
+                # 确保图片被完全加载
+                image.load()
+            except Exception as e:
+                raise ValueError(f'图片解析错误: {str(e)}，请确保提供了有效的图片数据')
+        elif image_type == "path":  # path
+            try:
+                with open(image_data, 'rb') as f:
+                    image_bytes = f.read()
+                image = Image.open(io.BytesIO(image_bytes))
+                # 确保图片被完全加载
+                image.load()
+            except Exception as e:
+                raise ValueError(f'图片文件打开错误: {str(e)}')
+        else:
+            raise ValueError(f'不支持的图片类型: {image_type}，请使用 base64 或 path 类型')
+        # 验证图片格式
+        if image.format not in ['JPEG', 'PNG', 'GIF']:
+            raise ValueError(f'不支持的图片格式: {image.format}，请使用 JPEG、PNG 或 GIF 格式')
+        return image, image_bytes
+
+    def chat_with_image(self, message, image_data, image_type: Literal["base64", "path"]="base64",
+                        timeout: Optional[float] = None):
         """
         图片+文本对话功能
         :param message: 用户输入的文本消息
         :param image_data: 图片数据（base64字符串或图片路径）
         :param image_type: 图片数据类型（"base64"或"path"）
+        :param timeout: 请求超时时间（秒），None 表示使用默认值
         :return: 模型的回复
         """
         try:
-            # 处理图片数据
-            if image_type == "base64":
-                # 处理可能的 base64 前缀
-                if ',' in image_data:
-                    prefix, image_data = image_data.split(',', 1)
-                    if not any(valid_prefix in prefix.lower() for valid_prefix in ['image/jpeg', 'image/png', 'image/gif']):
-                        return {'error': '不支持的图片格式，请使用 JPEG、PNG 或 GIF 格式'}
-                
-                # 添加必要的填充
-                padding = 4 - (len(image_data) % 4) if len(image_data) % 4 != 0 else 0
-                image_data += '=' * padding
-
-                try:
-                    image_bytes = base64.b64decode(image_data)
-                    if len(image_bytes) == 0:
-                        return {'error': 'Base64解码后的数据为空'}
-                except Exception as e:
-                    return {'error': f'Base64解码错误: {str(e)}'}
-
-                try:
-                    image = Image.open(io.BytesIO(image_bytes))
-                    # 验证图片格式
-                    if image.format not in ['JPEG', 'PNG', 'GIF']:
-                        return {'error': f'不支持的图片格式: {image.format}，请使用 JPEG、PNG 或 GIF 格式'}
-                    # 确保图片被完全加载
-                    image.load()
-                except Exception as e:
-                    return {'error': f'图片解析错误: {str(e)}，请确保提供了有效的图片数据'}
-            elif image_type == "path":  # path
-                try:
-                    image = Image.open(image_data)
-                    if image.format not in ['JPEG', 'PNG', 'GIF']:
-                        return {'error': f'不支持的图片格式: {image.format}，请使用 JPEG、PNG 或 GIF 格式'}
-                    # 确保图片被完全加载
-                    image.load()
-                except Exception as e:
-                    return {'error': f'图片文件打开错误: {str(e)}'}
-            else:
-                return {'error': f'不支持的图片类型: {image_type}，请使用 base64 或 path 类型'}
-
+            image, _ = self._load_image(image_data, image_type)
+        except ValueError as e:
+            return {'error': str(e)}
+        try:
             # 发送图片和文本到模型
-            response = self.vision_model.generate_content([message, image])
+            response = self.vision_model.generate_content(
+                [message, image], request_options=self._request_options(timeout)
+            )
             self.update_api_key_usage()
             return {
                 'text': response.text
@@ -116,18 +150,223 @@ class GeminiClient:
                 'error': f'处理请求时发生错误: {str(e)}'
             }
 
+    def chat_with_images(self, message, image_paths: list[str], timeout: Optional[float] = None) -> dict:
+        """
+        多张图片+文本对话功能，图片按列表顺序发送
+        :param message: 用户输入的文本消息
+        :param image_paths: 图片路径列表
+        :param timeout: 请求超时时间（秒），None 表示使用默认值
+        :return: 模型的回复
+        """
+        try:
+            images = [self._load_image(image_path, 'path')[0] for image_path in image_paths]
+        except ValueError as e:
+            return {'error': str(e)}
+        try:
+            response = self.vision_model.generate_content(
+                [message, *images], request_options=self._request_options(timeout)
+            )
+            self.update_api_key_usage()
+            return {
+                'text': response.text
+            }
+        except Exception as e:
+            self.update_api_key_error(str(e))
+            return {
+                'error': f'处理请求时发生错误: {str(e)}'
+            }
+
+    # 流式接口：逐段返回生成的文本，失败时抛出异常，由调用方决定是否重试
+    @staticmethod
+    def _chunk_text(chunk) -> str:
+        try:
+            return chunk.text
+        except ValueError:
+            # 不含文本的片段（例如只有结束原因）
+            return ''
+
+    def stream_chat_with_text(self, message, timeout: Optional[float] = None) -> Iterator[str]:
+        """chat_with_text 的流式版本"""
+        try:
+            chat = self.text_model.start_chat()
+            response = chat.send_message(message, stream=True, request_options=self._request_options(timeout))
+            for chunk in response:
+                text = self._chunk_text(chunk)
+                if text:
+                    yield text
+            self.update_api_key_usage()
+        except Exception as e:
+            self.update_api_key_error(str(e))
+            raise
+
+    def stream_chat_with_image(self, message, image_data, image_type: Literal["base64", "path"]="base64",
+                               timeout: Optional[float] = None) -> Iterator[str]:
+        """chat_with_image 的流式版本"""
+        image, _ = self._load_image(image_data, image_type)
+        try:
+            response = self.vision_model.generate_content(
+                [message, image], stream=True, request_options=self._request_options(timeout)
+            )
+            for chunk in response:
+                text = self._chunk_text(chunk)
+                if text:
+                    yield text
+            self.update_api_key_usage()
+        except Exception as e:
+            self.update_api_key_error(str(e))
+            raise
+
+    # 异步接口：通过 REST API 直接请求，所有客户端共用事件循环内的 HTTP 连接池
+    @staticmethod
+    def _image_part(image: Image.Image, image_bytes: bytes) -> dict:
+        return {
+            'inline_data': {
+                'mime_type': Image.MIME[image.format],
+                'data': base64.b64encode(image_bytes).decode()
+            }
+        }
+
+    def _rest_url(self, model, method: str) -> str:
+        endpoint = (self.base_url or GEMINI_DEFAULT_ENDPOINT).rstrip('/')
+        if not endpoint.startswith(('http://', 'https://')):
+            endpoint = f'https://{endpoint}'
+        return f"{endpoint}/v1beta/{model.model_name}:{method}"
+
+    @staticmethod
+    def _candidate_text(data: dict) -> str:
+        candidates = data.get('candidates') or []
+        if not candidates:
+            return ''
+        return ''.join(part.get('text', '') for part in candidates[0].get('content', {}).get('parts', []))
+
+    async def _agenerate_content(self, model, parts: list[dict], timeout: Optional[float] = None) -> str:
+        response = await get_async_http_client().post(
+            self._rest_url(model, 'generateContent'),
+            headers={'x-goog-api-key': self.api_key},
+            json={'contents': [{'role': 'user', 'parts': parts}]},
+            timeout=timeout if timeout else httpx.USE_CLIENT_DEFAULT
+        )
+        if response.status_code >= 400:
+            raise RuntimeError(f"{response.status_code} {response.reason_phrase}: {response.text}")
+        data = response.json()
+        if not data.get('candidates'):
+            raise RuntimeError(f"模型没有返回结果: {data.get('promptFeedback')}")
+        return self._candidate_text(data)
+
+    async def _astream_content(self, model, parts: list[dict], timeout: Optional[float] = None) -> AsyncIterator[str]:
+        """以 SSE 方式请求 streamGenerateContent，逐段返回文本"""
+        async with get_async_http_client().stream(
+            'POST',
+            self._rest_url(model, 'streamGenerateContent'),
+            params={'alt': 'sse'},
+            headers={'x-goog-api-key': self.api_key},
+            json={'contents': [{'role': 'user', 'parts': parts}]},
+            timeout=timeout if timeout else httpx.USE_CLIENT_DEFAULT
+        ) as response:
+            if response.status_code >= 400:
+                body = (await response.aread()).decode(errors='replace')
+                raise RuntimeError(f"{response.status_code} {response.reason_phrase}: {body}")
+            async for line in response.aiter_lines():
+                if not line.startswith('data:'):
+                    continue
+                text = self._candidate_text(json.loads(line[5:]))
+                if text:
+                    yield text
+
+    async def astream_chat_with_text(self, message, timeout: Optional[float] = None) -> AsyncIterator[str]:
+        """stream_chat_with_text 的异步版本"""
+        try:
+            async for text in self._astream_content(self.text_model, [{'text': message}], timeout):
+                yield text
+            self.update_api_key_usage()
+        except Exception as e:
+            self.update_api_key_error(str(e))
+            raise
+
+    async def astream_chat_with_image(self, message, image_data, image_type: Literal["base64", "path"]="base64",
+                                      timeout: Optional[float] = None) -> AsyncIterator[str]:
+        """stream_chat_with_image 的异步版本"""
+        image, image_bytes = await asyncio.to_thread(self._load_image, image_data, image_type)
+        try:
+            async for text in self._astream_content(
+                self.vision_model, [{'text': message}, self._image_part(image, image_bytes)], timeout
+            ):
+                yield text
+            self.update_api_key_usage()
+        except Exception as e:
+            self.update_api_key_error(str(e))
+            raise
+
+    async def achat_with_text(self, message, timeout: Optional[float] = None) -> dict:
+        """chat_with_text 的异步版本"""
+        try:
+            text = await self._agenerate_content(self.text_model, [{'text': message}], timeout)
+            self.update_api_key_usage()
+            return {
+                'text': text,
+            }
+        except Exception as e:
+            self.update_api_key_error(str(e))
+            return {
+                'error': str(e)
+            }
+
+    async def achat_with_image(self, message, image_data, image_type: Literal["base64", "path"]="base64",
+                               timeout: Optional[float] = None):
+        """chat_with_image 的异步版本"""
+        try:
+            image, image_bytes = await asyncio.to_thread(self._load_image, image_data, image_type)
+        except ValueError as e:
+            return {'error': str(e)}
+        try:
+            text = await self._agenerate_content(
+                self.vision_model, [{'text': message}, self._image_part(image, image_bytes)], timeout
+            )
+            self.update_api_key_usage()
+            return {
+                'text': text
+            }
+        except Exception as e:
+            self.update_api_key_error(str(e))
+            return {
+                'error': f'处理请求时发生错误: {str(e)}'
+            }
+
+    async def achat_with_images(self, message, image_paths: list[str], timeout: Optional[float] = None) -> dict:
+        """chat_with_images 的异步版本"""
+        try:
+            images = [await asyncio.to_thread(self._load_image, image_path, 'path') for image_path in image_paths]
+        except ValueError as e:
+            return {'error': str(e)}
+        try:
+            text = await self._agenerate_content(
+                self.vision_model, [{'text': message}, *(self._image_part(*image) for image in images)], timeout
+            )
+            self.update_api_key_usage()
+            return {
+                'text': text
+            }
+        except Exception as e:
+            self.update_api_key_error(str(e))
+            return {
+                'error': f'处理请求时发生错误: {str(e)}'
+            }
+
+    def get_model_name(self, operation: str) -> str:
+        """返回某个操作实际使用的模型名称，用于区分缓存"""
+        model = self.vision_model if operation in ('chat_with_image', 'chat_with_images') else self.text_model
+        return getattr(model, 'model_name', model)
+
+    # 使用记录只在内存中累加，由 UsageRecorder 定期批量写回数据库，异步接口中也可以直接调用
     def update_api_key_usage(self):
         if not self.api_key_model:
             return
-        self.api_key_model.counter += 1
-        self.api_key_model.last_used_at = timezone.now()
-        self.api_key_model.save()
+        get_usage_recorder().record_success(self.api_key_model.pk)
 
     def update_api_key_error(self, error_message):
         if not self.api_key_model:
             return
-        self.api_key_model.last_error_message = error_message
-        self.api_key_model.save()
+        get_usage_recorder().record_error(self.api_key_model.pk, error_message)
 
     def __hash__(self):
         # 只使用 api_key 计算哈希值
@@ -0,0 +1,66 @@
+# 对冲请求
+# 请求超过近期延迟的某个分位数仍未返回时，在另一个密钥上发送相同的请求，采用先返回的结果。
+# 额外请求的数量由 HedgeBudget 限制：每个普通请求积累 max_ratio 个额度，每个对冲请求消耗 1 个。
+
+import math
+from collections import defaultdict, deque
+from typing import Optional
+
+class LatencyTracker:
+    """
+    按操作记录最近成功请求的延迟
+    不是线程安全的，由 ClientPool 在持有 pool_lock 时调用
+    """
+    def __init__(self, window: int = 200, min_samples: int = 20):
+        """
+        :param window: 每个操作保留的最近样本数
+        :param min_samples: 样本数少于该值时不计算分位数
+        """
+        self.min_samples = min_samples
+        self.samples = defaultdict(lambda: deque(maxlen=window))
+
+    def record(self, operation: str, latency: float):
+        self.samples[operation].append(latency)
+
+    def percentile(self, operation: str, percentile: float) -> Optional[float]:
+        samples = self.samples.get(operation)
+        if not samples or len(samples) < self.min_samples:
+            return None
+        latencies = sorted(samples)
+        return latencies[min(len(latencies) - 1, math.ceil(percentile / 100 * len(latencies)) - 1)]
+
+class HedgeBudget:
+    """
+    对冲请求的额度，额外请求数不超过普通请求数的 max_ratio 倍，额度最多积累 max_burst 个
+    不是线程安全的，由 ClientPool 在持有 pool_lock 时调用
+    """
+    def __init__(self, max_ratio: float = 0.05, max_burst: float = 10):
+        self.max_ratio = max_ratio
+        self.max_burst = max_burst
+        self.credits = 0.0
+        self.requests = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+
+    def on_request(self):
+        self.requests += 1
+        self.credits = min(self.credits + self.max_ratio, self.max_burst)
+
+    def try_spend(self) -> bool:
+        if self.credits < 1:
+            return False
+        self.credits -= 1
+        self.hedges += 1
+        return True
+
+    def on_hedge_won(self):
+        self.hedge_wins += 1
+
+    def status(self) -> dict:
+        return {
+            'requests': self.requests,
+            'hedges': self.hedges,
+            'hedge_wins': self.hedge_wins,
+            'hedge_ratio': round(self.hedges / self.requests, 4) if self.requests else 0.0,
+            'credits': round(self.credits, 2),
+        }
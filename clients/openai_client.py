@@ -1,34 +1,36 @@
+import asyncio
+import weakref
 import openai
 import os
 import base64
 import io
-from typing import Literal
+from typing import AsyncIterator, Iterator, Literal, Optional
 from PIL import Image
 from api.models import ApiKey
-from django.utils import timezone
 from clients.gemini_client import GeminiClient
+from clients.async_http import get_async_http_client
 
 class OpenAIClient(GeminiClient):
-    def __init__(self, api_key=None, base_url=None, model="gemini-1.5-flash"):
+    def __init__(self, api_key=None, base_url=None, model="gemini-1.5-flash", api_key_model: ApiKey = None):
         self.api_key = api_key if api_key else os.getenv('OPENAI_API_KEY')
         self.base_url = base_url if base_url else os.getenv('OPENAI_API_BASE', "https://api.openai.com/v1")
         
-        try:
-            self.api_key_model = ApiKey.objects.get(key=self.api_key)
-        except ApiKey.DoesNotExist:
-            self.api_key_model = None
+        self.api_key_model = api_key_model if api_key_model else self._get_api_key_model(self.api_key)
         
         # 创建 OpenAI 模型客户端
         self.client = openai.Client(api_key=self.api_key, base_url=self.base_url)
+        # 异步客户端绑定事件循环，按事件循环分别创建：Web 服务和每个流水线线程各有自己的事件循环
+        self._async_clients = weakref.WeakKeyDictionary()
         
         self.text_model = model
         self.vision_model = model
 
 
-    def chat_with_text(self, message) -> dict:
+    def chat_with_text(self, message, timeout: Optional[float] = None) -> dict:
         """
         纯文本对话功能
         :param message: 用户输入的文本消息
+        :param timeout: 请求超时时间（秒），None 表示使用默认值
         :return: 模型的回复
         """
         try:
@@ -40,6 +42,8 @@ class OpenAIClient(GeminiClient):
                 "model": self.text_model,
                 "messages": messages,
             }
+            if timeout:
+                request_params["timeout"] = timeout
             response = self.client.chat.completions.create(**request_params)
             self.update_api_key_usage()
             return {
@@ -50,54 +54,82 @@ class OpenAIClient(GeminiClient):
             self.update_api_key_error(str(e))
             return {"error": str(e)}
 
-    def chat_with_image(self, message, image_data, image_type: Literal["base64", "path"] = "base64"):
+    @staticmethod
+    def _image_url(image_data, image_type: Literal["base64", "path"] = "base64") -> str:
+        """
+        将不同来源的图片统一转换为 base64 URL
+        :raises ValueError: 不支持的图片类型
+        """
+        if image_type == "base64":
+            # 如果已经是data URI格式，直接使用
+            if image_data.startswith('data:image/'):
+                return image_data
+            # 处理纯base64字符串
+            if ',' in image_data:
+                # 如果包含data URI前缀，提取base64部分
+                prefix, image_data = image_data.split(',', 1)
+            # 添加padding
+            padding = 4 - (len(image_data) % 4) if len(image_data) % 4 != 0 else 0
+            image_data += '=' * padding
+            # 构造完整的data URI
+            return f"data:image/jpeg;base64,{image_data}"
+        elif image_type == "path":
+            # 读取文件并转换为base64 URL
+            with open(image_data, 'rb') as img_file:
+                img_data = base64.b64encode(img_file.read()).decode()
+                return f"data:image/jpeg;base64,{img_data}"
+        raise ValueError("不支持的图片类型，请使用 base64 或 path")
+
+    @staticmethod
+    def _image_messages(message, image_urls: list[str]) -> list[dict]:
+        content = [{"type": "text", "text": message}]
+        for image_url in image_urls:
+            content.append({
+                "type": "image_url",
+                "image_url": {
+                    "url": image_url
+                }
+            })
+        return [{"role": "user", "content": content}]
+
+    def chat_with_image(self, message, image_data, image_type: Literal["base64", "path"] = "base64",
+                        timeout: Optional[float] = None):
         """
         图片+文本对话功能，使用 messages 模式  
         注：处理完图片后，将其作为文本传递
         """
         try:
-            # 将不同来源的图片统一转换为 base64 URL
-            if image_type == "base64":
-                # 如果已经是data URI格式，直接使用
-                if image_data.startswith('data:image/'):
-                    image_url = image_data
-                else:
-                    # 处理纯base64字符串
-                    if ',' in image_data:
-                        # 如果包含data URI前缀，提取base64部分
-                        prefix, image_data = image_data.split(',', 1)
-                    # 添加padding
-                    padding = 4 - (len(image_data) % 4) if len(image_data) % 4 != 0 else 0
-                    image_data += '=' * padding
-                    # 构造完整的data URI
-                    image_url = f"data:image/jpeg;base64,{image_data}"
-            
-            elif image_type == "path":
-                # 读取文件并转换为base64 URL
-                with open(image_data, 'rb') as img_file:
-                    img_data = base64.b64encode(img_file.read()).decode()
-                    image_url = f"data:image/jpeg;base64,{img_data}"
-            else:
-                return {"error": "不支持的图片类型，请使用 base64 或 path"}
-        
-            messages = [
-                {
-                    "role": "user", "content": [
-                        {"type": "text", "text": message},
-                        {
-                            "type": "image_url",
-                            "image_url": {
-                                "url": image_url
-                            }
-                        }
-                    ]
-                }
-            ]
+            try:
+                image_url = self._image_url(image_data, image_type)
+            except ValueError as e:
+                return {"error": str(e)}
 
             request_params = {
                 "model": self.vision_model,
-                "messages": messages,
+                "messages": self._image_messages(message, [image_url]),
+            }
+            if timeout:
+                request_params["timeout"] = timeout
+            response = self.client.chat.completions.create(**request_params)
+            self.update_api_key_usage()
+            return {
+                "text": response.choices[0].message.content
+            }
+        except Exception as e:
+            self.update_api_key_error(str(e))
+            return {"error": str(e)}
+
+    def chat_with_images(self, message, image_paths: list[str], timeout: Optional[float] = None) -> dict:
+        """
+        多张图片+文本对话功能，图片按列表顺序放在同一条消息中
+        """
+        try:
+            request_params = {
+                "model": self.vision_model,
+                "messages": self._image_messages(message, [self._image_url(path, 'path') for path in image_paths]),
             }
+            if timeout:
+                request_params["timeout"] = timeout
             response = self.client.chat.completions.create(**request_params)
             self.update_api_key_usage()
             return {
@@ -107,15 +139,130 @@ class OpenAIClient(GeminiClient):
             self.update_api_key_error(str(e))
             return {"error": str(e)}
 
-    def update_api_key_usage(self):
-        if not self.api_key_model:
-            return
-        self.api_key_model.counter += 1
-        self.api_key_model.last_used_at = timezone.now()
-        self.api_key_model.save()
-
-    def update_api_key_error(self, error_message):
-        if not self.api_key_model:
-            return
-        self.api_key_model.last_error_message = error_message
-        self.api_key_model.save()
+    # 流式接口：逐段返回生成的文本，失败时抛出异常
+    def _stream_completion(self, model, messages, timeout: Optional[float] = None) -> Iterator[str]:
+        request_params = {"model": model, "messages": messages, "stream": True}
+        if timeout:
+            request_params["timeout"] = timeout
+        try:
+            # 提前结束迭代时关闭响应，释放连接
+            with self.client.chat.completions.create(**request_params) as stream:
+                for chunk in stream:
+                    if chunk.choices and chunk.choices[0].delta.content:
+                        yield chunk.choices[0].delta.content
+            self.update_api_key_usage()
+        except Exception as e:
+            self.update_api_key_error(str(e))
+            raise
+
+    def stream_chat_with_text(self, message, timeout: Optional[float] = None) -> Iterator[str]:
+        """chat_with_text 的流式版本"""
+        return self._stream_completion(self.text_model, [
+            {"role": "system", "content": "You are a helpful assistant"},
+            {"role": "user", "content": message},
+        ], timeout)
+
+    def stream_chat_with_image(self, message, image_data, image_type: Literal["base64", "path"] = "base64",
+                               timeout: Optional[float] = None) -> Iterator[str]:
+        """chat_with_image 的流式版本"""
+        image_url = self._image_url(image_data, image_type)
+        return self._stream_completion(self.vision_model, self._image_messages(message, [image_url]), timeout)
+
+    # 异步接口：同一事件循环中的客户端共用 HTTP 连接池
+    def _get_async_client(self) -> openai.AsyncClient:
+        loop = asyncio.get_running_loop()
+        http_client = get_async_http_client()
+        cached = self._async_clients.get(loop)
+        # 连接池被关闭重建后，旧的客户端不能继续使用
+        if cached is not None and cached[0] is http_client:
+            return cached[1]
+        client = openai.AsyncClient(
+            api_key=self.api_key,
+            base_url=self.base_url,
+            http_client=http_client
+        )
+        self._async_clients[loop] = (http_client, client)
+        return client
+
+    async def _acreate_completion(self, model, messages, timeout: Optional[float] = None) -> str:
+        request_params = {"model": model, "messages": messages}
+        if timeout:
+            request_params["timeout"] = timeout
+        response = await self._get_async_client().chat.completions.create(**request_params)
+        return response.choices[0].message.content
+
+    async def _astream_completion(self, model, messages, timeout: Optional[float] = None) -> AsyncIterator[str]:
+        request_params = {"model": model, "messages": messages, "stream": True}
+        if timeout:
+            request_params["timeout"] = timeout
+        try:
+            stream = await self._get_async_client().chat.completions.create(**request_params)
+            async with stream:
+                async for chunk in stream:
+                    if chunk.choices and chunk.choices[0].delta.content:
+                        yield chunk.choices[0].delta.content
+            self.update_api_key_usage()
+        except Exception as e:
+            self.update_api_key_error(str(e))
+            raise
+
+    def astream_chat_with_text(self, message, timeout: Optional[float] = None) -> AsyncIterator[str]:
+        """stream_chat_with_text 的异步版本"""
+        return self._astream_completion(self.text_model, [
+            {"role": "system", "content": "You are a helpful assistant"},
+            {"role": "user", "content": message},
+        ], timeout)
+
+    async def astream_chat_with_image(self, message, image_data, image_type: Literal["base64", "path"] = "base64",
+                                      timeout: Optional[float] = None) -> AsyncIterator[str]:
+        """stream_chat_with_image 的异步版本"""
+        image_url = await asyncio.to_thread(self._image_url, image_data, image_type)
+        async for text in self._astream_completion(
+            self.vision_model, self._image_messages(message, [image_url]), timeout
+        ):
+            yield text
+
+    async def achat_with_text(self, message, timeout: Optional[float] = None) -> dict:
+        """chat_with_text 的异步版本"""
+        try:
+            text = await self._acreate_completion(self.text_model, [
+                {"role": "system", "content": "You are a helpful assistant"},
+                {"role": "user", "content": message},
+            ], timeout)
+            self.update_api_key_usage()
+            return {
+                "text": text
+            }
+        except Exception as e:
+            self.update_api_key_error(str(e))
+            return {"error": str(e)}
+
+    async def achat_with_image(self, message, image_data, image_type: Literal["base64", "path"] = "base64",
+                               timeout: Optional[float] = None):
+        """chat_with_image 的异步版本"""
+        try:
+            try:
+                image_url = await asyncio.to_thread(self._image_url, image_data, image_type)
+            except ValueError as e:
+                return {"error": str(e)}
+            text = await self._acreate_completion(self.vision_model, self._image_messages(message, [image_url]), timeout)
+            self.update_api_key_usage()
+            return {
+                "text": text
+            }
+        except Exception as e:
+            self.update_api_key_error(str(e))
+            return {"error": str(e)}
+
+    async def achat_with_images(self, message, image_paths: list[str], timeout: Optional[float] = None) -> dict:
+        """chat_with_images 的异步版本"""
+        try:
+            image_urls = [await asyncio.to_thread(self._image_url, path, 'path') for path in image_paths]
+            text = await self._acreate_completion(self.vision_model, self._image_messages(message, image_urls), timeout)
+            self.update_api_key_usage()
+            return {
+                "text": text
+            }
+        except Exception as e:
+            self.update_api_key_error(str(e))
+            return {"error": str(e)}
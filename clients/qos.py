@@ -0,0 +1,79 @@
+# 请求优先级通道
+# 交互请求（对话、思维导图、公式解析）和批量请求（文档解析、翻译）共用同一组 API 密钥。
+# 批量请求最多占用总并发名额扣除预留部分后的名额；有交互请求在排队时，批量请求让出新的名额，
+# 已发出的批量请求不会被取消。每个通道分别统计排队深度和等待时间。
+
+import math
+from collections import deque
+
+class Lane:
+    INTERACTIVE = 'interactive'
+    BATCH = 'batch'
+
+    ALL = (INTERACTIVE, BATCH)
+
+# 计算等待时间分位数时保留的最近样本数
+WAIT_SAMPLE_SIZE = 500
+
+class LaneStats:
+    """
+    单个通道的统计
+    不是线程安全的，由 ClientPool 在持有 pool_lock 时调用
+    """
+    def __init__(self):
+        self.waiting = 0        # 正在排队等待名额的请求数
+        self.max_waiting = 0    # 排队深度的峰值
+        self.active = 0         # 已占用名额、正在进行的请求数
+        self.acquired = 0       # 获得名额的总次数
+        self.abandoned = 0      # 排队期间放弃（超时、熔断或被取消）的请求数
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.recent_waits = deque(maxlen=WAIT_SAMPLE_SIZE)
+
+    def on_enqueued(self):
+        self.waiting += 1
+        self.max_waiting = max(self.max_waiting, self.waiting)
+
+    def on_acquired(self, wait_time: float, queued: bool):
+        """获得名额时调用，queued 表示之前是否在排队"""
+        if queued:
+            self.waiting = max(0, self.waiting - 1)
+        self.active += 1
+        self.acquired += 1
+        self.total_wait += wait_time
+        self.max_wait = max(self.max_wait, wait_time)
+        self.recent_waits.append(wait_time)
+
+    def on_abandoned(self):
+        self.waiting = max(0, self.waiting - 1)
+        self.abandoned += 1
+
+    def on_released(self):
+        self.active = max(0, self.active - 1)
+
+    def wait_percentile(self, percentile: float) -> float:
+        if not self.recent_waits:
+            return 0.0
+        waits = sorted(self.recent_waits)
+        return waits[min(len(waits) - 1, math.ceil(percentile / 100 * len(waits)) - 1)]
+
+    def status(self) -> dict:
+        return {
+            'waiting': self.waiting,
+            'max_waiting': self.max_waiting,
+            'active': self.active,
+            'acquired': self.acquired,
+            'abandoned': self.abandoned,
+            'avg_wait': round(self.total_wait / self.acquired, 3) if self.acquired else 0.0,
+            'p95_wait': round(self.wait_percentile(95), 3),
+            'max_wait': round(self.max_wait, 3),
+        }
+
+def reserved_slots(total_slots: int, reserved_fraction: float) -> int:
+    """
+    交互通道预留的并发名额：按比例向上取整，至少 1 个，
+    但至少给批量通道留 1 个名额
+    """
+    if reserved_fraction <= 0 or total_slots <= 1:
+        return 0
+    return min(max(math.ceil(total_slots * reserved_fraction), 1), total_slots - 1)
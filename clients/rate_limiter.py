@@ -0,0 +1,126 @@
+# API 密钥配额限制
+# 每个 API 密钥使用两个令牌桶分别限制每分钟请求数（RPM）和每分钟 token 数（TPM），
+# ClientPool 只选择配额充足的密钥，按配额控制请求节奏，而不是等到返回 429 之后再退避。
+
+import math
+import time
+from typing import Optional
+
+from PIL import Image
+
+# 视觉模型按 768x768 的图块计费，每个图块约 258 个 token
+IMAGE_TILE_SIZE = 768
+TOKENS_PER_TILE = 258
+# 无法读取尺寸的图片（例如 base64 数据）按 4 个图块估算
+DEFAULT_IMAGE_TOKENS = 4 * TOKENS_PER_TILE
+
+def estimate_text_tokens(text: str) -> int:
+    """粗略估算 token 数：非 ASCII 字符（如中文）每个约 1 个 token，其余约 4 个字符 1 个 token"""
+    non_ascii = sum(1 for char in text if ord(char) > 127)
+    return non_ascii + (len(text) - non_ascii) // 4 + 1
+
+def estimate_image_tokens(image_path: str) -> int:
+    """估算一张图片在请求中占用的 token 数，只读取图片头部的尺寸信息"""
+    with Image.open(image_path) as image:
+        width, height = image.size
+    return math.ceil(width / IMAGE_TILE_SIZE) * math.ceil(height / IMAGE_TILE_SIZE) * TOKENS_PER_TILE
+
+def estimate_request_tokens(operation: str, args: tuple, kwargs: dict) -> int:
+    """按操作类型估算一次请求的输入 token 数"""
+    message = args[0] if args else kwargs.get('message', '')
+    tokens = estimate_text_tokens(message) if isinstance(message, str) else 0
+    try:
+        if operation == 'chat_with_image':
+            image_data = args[1] if len(args) > 1 else kwargs.get('image_data')
+            image_type = args[2] if len(args) > 2 else kwargs.get('image_type', 'base64')
+            tokens += estimate_image_tokens(image_data) if image_type == 'path' else DEFAULT_IMAGE_TOKENS
+        elif operation == 'chat_with_images':
+            image_paths = args[1] if len(args) > 1 else kwargs.get('image_paths', [])
+            tokens += sum(estimate_image_tokens(image_path) for image_path in image_paths)
+    except Exception:
+        # 图片无法读取时请求本身会失败，这里只需要一个保守的估计
+        tokens += DEFAULT_IMAGE_TOKENS
+    return tokens
+
+class TokenBucket:
+    """令牌桶：容量为每分钟配额，令牌按配额匀速补充"""
+    def __init__(self, per_minute: int):
+        self.capacity = per_minute
+        self.tokens = float(per_minute)
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.capacity / 60)
+        self.updated = now
+
+    def set_limit(self, per_minute: int):
+        self._refill()
+        self.capacity = per_minute
+        self.tokens = min(self.tokens, per_minute)
+
+    def wait_time(self, amount: float) -> float:
+        """距离桶中有 amount 个令牌还需要等待的秒数；超过容量的请求只需等待桶满"""
+        self._refill()
+        missing = min(amount, self.capacity) - self.tokens
+        return max(missing, 0) * 60 / self.capacity
+
+    def consume(self, amount: float):
+        self._refill()
+        self.tokens -= min(amount, self.capacity)
+
+    def refund(self, amount: float):
+        self._refill()
+        self.tokens = min(self.capacity, self.tokens + min(amount, self.capacity))
+
+class RateLimiter:
+    """
+    一个 API 密钥的 RPM/TPM 配额，限额为 None 时不限制
+    不是线程安全的，由 ClientPool 在持有 pool_lock 时调用
+    """
+    def __init__(self, rpm_limit: Optional[int] = None, tpm_limit: Optional[int] = None):
+        self.requests: Optional[TokenBucket] = None
+        self.tokens: Optional[TokenBucket] = None
+        self.update_limits(rpm_limit, tpm_limit)
+
+    @staticmethod
+    def _update_bucket(bucket: Optional[TokenBucket], limit: Optional[int]) -> Optional[TokenBucket]:
+        if not limit:
+            return None
+        if bucket is None:
+            return TokenBucket(limit)
+        bucket.set_limit(limit)
+        return bucket
+
+    def update_limits(self, rpm_limit: Optional[int], tpm_limit: Optional[int]):
+        """修改配额，保留已消耗的令牌"""
+        self.requests = self._update_bucket(self.requests, rpm_limit)
+        self.tokens = self._update_bucket(self.tokens, tpm_limit)
+
+    def wait_time(self, tokens: int) -> float:
+        """距离可以发送一个包含 tokens 个 token 的请求还需要等待的秒数，0 表示配额充足"""
+        return max(
+            self.requests.wait_time(1) if self.requests else 0,
+            self.tokens.wait_time(tokens) if self.tokens else 0
+        )
+
+    def acquire(self, tokens: int):
+        if self.requests:
+            self.requests.consume(1)
+        if self.tokens:
+            self.tokens.consume(tokens)
+
+    def refund(self, tokens: int):
+        """请求没有实际发送（例如命中缓存）时退还配额"""
+        if self.requests:
+            self.requests.refund(1)
+        if self.tokens:
+            self.tokens.refund(tokens)
+
+    def status(self) -> dict:
+        return {
+            'rpm_limit': self.requests.capacity if self.requests else None,
+            'rpm_available': math.floor(self.requests.tokens) if self.requests else None,
+            'tpm_limit': self.tokens.capacity if self.tokens else None,
+            'tpm_available': math.floor(self.tokens.tokens) if self.tokens else None,
+        }
@@ -0,0 +1,147 @@
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import time
+from pathlib import Path
+from threading import Lock
+from typing import Any, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+class ResponseCache:
+    """
+    大模型响应的磁盘缓存
+
+    以 (操作, 模型, 输入内容哈希) 为键保存成功的响应，使用独立的 SQLite 文件，
+    不与 Django 的数据库争抢写锁。总大小超过上限时按最近访问时间淘汰（LRU）。
+    """
+    def __init__(self, path: Path, max_bytes: int = 512 * 1024 * 1024):
+        self.path = Path(path)
+        self.max_bytes = max_bytes
+        self.lock = Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False, isolation_level=None)
+        # WAL 模式允许 web 进程和流水线进程同时读写
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                last_access REAL NOT NULL
+            )
+        ''')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS responses_last_access ON responses (last_access)')
+        self.total_bytes = self.conn.execute('SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()[0]
+
+    @staticmethod
+    def _hash_argument(value: Any, digest):
+        """计算参数的哈希，指向文件的路径按文件内容计算"""
+        if isinstance(value, (list, tuple)):
+            digest.update(b'[')
+            for item in value:
+                ResponseCache._hash_argument(item, digest)
+            digest.update(b']')
+        elif isinstance(value, str) and len(value) < 4096 and os.path.isfile(value):
+            digest.update(b'file:')
+            with open(value, 'rb') as f:
+                for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                    digest.update(chunk)
+        else:
+            digest.update(json.dumps(value, ensure_ascii=False, default=str).encode('utf-8'))
+        digest.update(b'\0')
+
+    @classmethod
+    def hash_arguments(cls, args: tuple, kwargs: dict) -> str:
+        digest = hashlib.sha256()
+        cls._hash_argument(list(args), digest)
+        cls._hash_argument(sorted(kwargs.items()), digest)
+        return digest.hexdigest()
+
+    @staticmethod
+    def make_key(operation: str, model: str, arguments_hash: str) -> str:
+        return hashlib.sha256(f"{operation}\0{model}\0{arguments_hash}".encode('utf-8')).hexdigest()
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        with self.lock:
+            row = self.conn.execute('SELECT value FROM responses WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.conn.execute('UPDATE responses SET last_access = ? WHERE key = ?', (time.time(), key))
+        return json.loads(row[0])
+
+    def set(self, key: str, value: Dict[str, Any]):
+        data = json.dumps(value, ensure_ascii=False)
+        size = len(data.encode('utf-8'))
+        with self.lock:
+            old = self.conn.execute('SELECT size FROM responses WHERE key = ?', (key,)).fetchone()
+            self.conn.execute(
+                'INSERT OR REPLACE INTO responses (key, value, size, last_access) VALUES (?, ?, ?, ?)',
+                (key, data, size, time.time())
+            )
+            self.total_bytes += size - (old[0] if old else 0)
+            if self.total_bytes > self.max_bytes:
+                self._evict()
+
+    def _evict(self):
+        """淘汰最久未访问的条目，直到总大小降到上限的 90%"""
+        # 其它进程也可能写入，淘汰前重新统计总大小
+        self.total_bytes = self.conn.execute('SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()[0]
+        target = self.max_bytes * 0.9
+        while self.total_bytes > target:
+            rows = self.conn.execute(
+                'SELECT key, size FROM responses ORDER BY last_access LIMIT 100'
+            ).fetchall()
+            if not rows:
+                break
+            evicted = []
+            for key, size in rows:
+                if self.total_bytes <= target:
+                    break
+                evicted.append((key,))
+                self.total_bytes -= size
+            self.conn.executemany('DELETE FROM responses WHERE key = ?', evicted)
+            self.evictions += len(evicted)
+        logger.debug(f"Response cache evicted down to {self.total_bytes} bytes")
+
+    def stats(self) -> Dict[str, Any]:
+        """缓存命中统计"""
+        with self.lock:
+            entries = self.conn.execute('SELECT COUNT(*) FROM responses').fetchone()[0]
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'evictions': self.evictions,
+                'entries': entries,
+                'size_bytes': self.total_bytes,
+                'max_bytes': self.max_bytes,
+            }
+
+    def clear(self):
+        with self.lock:
+            self.conn.execute('DELETE FROM responses')
+            self.total_bytes = 0
+
+_response_cache: Optional[ResponseCache] = None
+_response_cache_lock = Lock()
+
+def get_response_cache() -> Optional[ResponseCache]:
+    """获取全局响应缓存，settings.LLM_CACHE_ENABLED 为 False 时返回 None"""
+    global _response_cache
+    from django.conf import settings
+    if not settings.LLM_CACHE_ENABLED:
+        return None
+    with _response_cache_lock:
+        if _response_cache is None:
+            _response_cache = ResponseCache(settings.LLM_CACHE_PATH, settings.LLM_CACHE_MAX_BYTES)
+        return _response_cache
@@ -0,0 +1,119 @@
+# API 密钥使用记录
+# 请求结束时只在内存中累加每个密钥的调用次数、延迟和错误，后台线程定期用 F() 表达式批量写回 ApiKey，
+# 避免每个请求各自保存 ApiKey 记录，与流水线的写入争抢 SQLite 的写锁。
+
+import atexit
+import logging
+import threading
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Optional
+
+from django.db import close_old_connections, transaction
+from django.db.models import F
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+@dataclass
+class PendingUsage:
+    """一个密钥尚未写回数据库的使用记录"""
+    requests: int = 0
+    errors: int = 0
+    latency_total: float = 0.0
+    latency_count: int = 0
+    last_used_at: Optional[datetime] = None
+    last_error_message: Optional[str] = None
+
+    def merge(self, newer: 'PendingUsage'):
+        """合并之后产生的记录，写回失败时与新记录合并后重试"""
+        self.requests += newer.requests
+        self.errors += newer.errors
+        self.latency_total += newer.latency_total
+        self.latency_count += newer.latency_count
+        self.last_used_at = newer.last_used_at or self.last_used_at
+        self.last_error_message = newer.last_error_message or self.last_error_message
+
+class UsageRecorder:
+    """在内存中汇总各密钥的使用情况，由后台线程每隔 flush_interval 秒写回数据库"""
+    def __init__(self, flush_interval: float = 5.0):
+        self.flush_interval = flush_interval
+        self.lock = threading.Lock()
+        self.pending: dict[int, PendingUsage] = {}
+        self.stop_event = threading.Event()
+        self.flush_thread = threading.Thread(target=self._flush_loop, daemon=True)
+        self.flush_thread.start()
+
+    def _pending_for(self, api_key_id: int) -> PendingUsage:
+        return self.pending.setdefault(api_key_id, PendingUsage())
+
+    def record_success(self, api_key_id: int):
+        with self.lock:
+            usage = self._pending_for(api_key_id)
+            usage.requests += 1
+            usage.last_used_at = timezone.now()
+
+    def record_error(self, api_key_id: int, error_message: str):
+        with self.lock:
+            usage = self._pending_for(api_key_id)
+            usage.errors += 1
+            usage.last_error_message = error_message
+
+    def record_latency(self, api_key_id: int, latency: float):
+        with self.lock:
+            usage = self._pending_for(api_key_id)
+            usage.latency_total += latency
+            usage.latency_count += 1
+
+    def flush(self):
+        """将汇总的记录写回数据库，每个密钥一条 UPDATE，在同一个事务中提交"""
+        from api.models import ApiKey
+        with self.lock:
+            pending, self.pending = self.pending, {}
+        if not pending:
+            return
+        try:
+            with transaction.atomic():
+                for api_key_id, usage in pending.items():
+                    updates = {
+                        'counter': F('counter') + usage.requests,
+                        'error_count': F('error_count') + usage.errors,
+                        'latency_total': F('latency_total') + usage.latency_total,
+                        'latency_count': F('latency_count') + usage.latency_count,
+                    }
+                    if usage.last_used_at:
+                        updates['last_used_at'] = usage.last_used_at
+                    if usage.last_error_message:
+                        updates['last_error_message'] = usage.last_error_message
+                    # 已删除的密钥没有匹配的记录，不会被重新插入
+                    ApiKey.objects.filter(pk=api_key_id).update(**updates)
+        except Exception as e:
+            logger.error(f"写回 API 密钥使用记录失败: {str(e)}")
+            with self.lock:
+                for api_key_id, usage in pending.items():
+                    usage.merge(self.pending.get(api_key_id, PendingUsage()))
+                    self.pending[api_key_id] = usage
+
+    def _flush_loop(self):
+        while not self.stop_event.wait(self.flush_interval):
+            self.flush()
+            close_old_connections()
+
+    def shutdown(self):
+        """停止后台线程并写回剩余的记录"""
+        self.stop_event.set()
+        self.flush_thread.join(timeout=5)
+        self.flush()
+
+_usage_recorder: Optional[UsageRecorder] = None
+_usage_recorder_lock = threading.Lock()
+
+def get_usage_recorder() -> UsageRecorder:
+    """获取全局使用记录器，首次调用时启动后台线程，写回间隔由 settings.API_KEY_USAGE_FLUSH_INTERVAL 配置"""
+    global _usage_recorder
+    with _usage_recorder_lock:
+        if _usage_recorder is None:
+            from django.conf import settings
+            _usage_recorder = UsageRecorder(settings.API_KEY_USAGE_FLUSH_INTERVAL)
+            atexit.register(_usage_recorder.shutdown)
+        return _usage_recorder
@@ -1,2 +1,3 @@
 python ./manage.py migrate
-python ./manage.py runserver 0.0.0.0:8000
+# 使用 ASGI 服务器运行，异步视图在同一个事件循环中等待大模型响应
+exec uvicorn backend.asgi:application --host 0.0.0.0 --port 8000 --timeout-keep-alive 75
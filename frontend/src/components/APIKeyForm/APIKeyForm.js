@@ -7,6 +7,8 @@ const APIKeyForm = ({ onAdd }) => {
     const [apiKey, setApiKey] = useState('');
     const [baseUrl, setBaseUrl] = useState('');
     const [apiType, setApiType] = useState('gemini');
+    const [rpmLimit, setRpmLimit] = useState('');
+    const [tpmLimit, setTpmLimit] = useState('');
     const [status, setStatus] = useState({ type: '', message: '' });
     const [isSubmitting, setIsSubmitting] = useState(false);
     const [file, setFile] = useState(null);
@@ -22,6 +24,8 @@ const APIKeyForm = ({ onAdd }) => {
             const response = await axios.post('/api/add_api_key', {
                 key: apiKey.trim(),
                 ...(baseUrl.trim() && { base_url: baseUrl.trim() }),
+                ...(rpmLimit && { rpm_limit: Number(rpmLimit) }),
+                ...(tpmLimit && { tpm_limit: Number(tpmLimit) }),
                 apiType
             });
 
@@ -33,6 +37,8 @@ const APIKeyForm = ({ onAdd }) => {
                 setApiKey('');
                 setBaseUrl('');
                 setApiType('gemini');
+                setRpmLimit('');
+                setTpmLimit('');
             }
         } catch (error) {
             setStatus({ type: 'error', message: '提交失败，请稍后重试' });
@@ -57,6 +63,12 @@ const APIKeyForm = ({ onAdd }) => {
         if (baseUrl.trim()) {
             formData.append('base_url', baseUrl.trim());
         }
+        if (rpmLimit) {
+            formData.append('rpm_limit', rpmLimit);
+        }
+        if (tpmLimit) {
+            formData.append('tpm_limit', tpmLimit);
+        }
 
         try {
             const response = await axios.post('/api/upload_api_keys', formData, {
@@ -109,6 +121,28 @@ const APIKeyForm = ({ onAdd }) => {
                         placeholder="请输入Base URL（可选）"
                     />
                 </div>
+                <div className="form-group">
+                    <label htmlFor="rpmLimit">每分钟请求数上限（选填）</label>
+                    <input
+                        id="rpmLimit"
+                        type="number"
+                        min="1"
+                        value={rpmLimit}
+                        onChange={(e) => setRpmLimit(e.target.value)}
+                        placeholder="留空表示不限制"
+                    />
+                </div>
+                <div className="form-group">
+                    <label htmlFor="tpmLimit">每分钟 token 数上限（选填）</label>
+                    <input
+                        id="tpmLimit"
+                        type="number"
+                        min="1"
+                        value={tpmLimit}
+                        onChange={(e) => setTpmLimit(e.target.value)}
+                        placeholder="留空表示不限制"
+                    />
+                </div>
                 <div className="form-group">
                     <label htmlFor="api-type">API 类型</label>
                     <Select
@@ -112,12 +112,14 @@ const APIKeyTable = ({ apiKeys, fetchApiKeys }) => {
                     ) : '暂无信息'}
                   </TableCell>
                   <TableCell align="center">
-                    <Chip 
-                      label={apiKey.counter || 0}
-                      color="primary"
-                      size="small"
-                      variant="outlined"
-                    />
+                    <Tooltip title={`失败 ${apiKey.error_count || 0} 次，平均耗时 ${apiKey.avg_latency ?? '-'} 秒`}>
+                      <Chip 
+                        label={apiKey.counter || 0}
+                        color="primary"
+                        size="small"
+                        variant="outlined"
+                      />
+                    </Tooltip>
                   </TableCell>
                   <TableCell align="center">
                     {apiKey.last_used_at ? (
@@ -1,5 +1,4 @@
 import React, { useState, useCallback, useRef, useEffect, forwardRef, useImperativeHandle } from 'react';
-import axios from 'axios';
 import ReactMarkdown from 'react-markdown';
 import remarkGfm from 'remark-gfm';
 import remarkMath from 'remark-math';
@@ -7,10 +6,41 @@ import rehypeKatex from 'rehype-katex';
 import rehypeRaw from 'rehype-raw';
 import './ChatBox.css';
 
+// 逐个解析 Server-Sent Events，返回 { event, data }
+async function* readEventStream(response) {
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+    while (true) {
+        const { value, done } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+        let boundary;
+        while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+            const block = buffer.slice(0, boundary);
+            buffer = buffer.slice(boundary + 2);
+            let event = 'message';
+            const dataLines = [];
+            for (const line of block.split('\n')) {
+                if (line.startsWith('event:')) {
+                    event = line.slice(6).trim();
+                } else if (line.startsWith('data:')) {
+                    dataLines.push(line.slice(5).trim());
+                }
+            }
+            if (dataLines.length > 0) {
+                yield { event, data: JSON.parse(dataLines.join('\n')) };
+            }
+        }
+    }
+}
+
 const ChatBox = forwardRef(({ pageContent, className }, ref) => {
     const [input, setInput] = useState('');
     const [response, setResponse] = useState('');
     const [isLoading, setIsLoading] = useState(false);
+    // 已开始收到回答，不再显示加载动画
+    const [isStreaming, setIsStreaming] = useState(false);
     const [imageData, setImageData] = useState(null);
     const [chatHistory, setChatHistory] = useState([]);
     const [showConfirmDialog, setShowConfirmDialog] = useState(false);
@@ -91,21 +121,58 @@ const ChatBox = forwardRef(({ pageContent, className }, ref) => {
 
             const fullContent = `你是辅导我课程内容的助手，需要回答我的课业问题。你需要全面地回答我的问题。请使用与课程教案相同的语言回答我。<|历史记录|>\n${messages.map(msg => `<|${msg.role}|>\n${msg.content.map(item => item.text || "").join('')}`).join('\n')}\n<|课程教案相关内容：|>\n${pageContent}\n<|当前问题|>\n${inputValue}`;
 
-            const result = await axios.post('/api/gemini_chat_image', {
-                prompt: fullContent,
-                image_data: imageData,
-            })
+            const result = await fetch('/api/gemini_chat_stream', {
+                method: 'POST',
+                headers: { 'Content-Type': 'application/json' },
+                body: JSON.stringify({
+                    prompt: fullContent,
+                    image_data: imageData,
+                }),
+            });
+            if (!result.ok) {
+                const error = new Error(`HTTP ${result.status}`);
+                error.response = { status: result.status };
+                throw error;
+            }
 
-            const assistantMessage = {
-                role: 'assistant',
-                content: [{
-                    "type": "text",
-                    "text": result.data.response || '未获取到回答'
-                }],
-                timestamp: new Date().toISOString(),
+            // 收到第一个片段时添加回答，之后逐段更新
+            let text = '';
+            const timestamp = new Date().toISOString();
+            const updateAnswer = (answer) => {
+                const assistantMessage = {
+                    role: 'assistant',
+                    content: [{
+                        "type": "text",
+                        "text": answer
+                    }],
+                    timestamp,
+                };
+                setChatHistory(prev => (
+                    prev.length > 0 && prev[prev.length - 1].timestamp === timestamp
+                        ? [...prev.slice(0, -1), assistantMessage]
+                        : [...prev, assistantMessage]
+                ));
+                return assistantMessage;
             };
 
-            setChatHistory(prev => [...prev, assistantMessage]);
+            for await (const { event, data } of readEventStream(result)) {
+                if (event === 'error') {
+                    if (!text) {
+                        throw new Error(data.error);
+                    }
+                    text += '\n\n（回答中断，请稍后再试）';
+                    break;
+                }
+                if (event === 'done') {
+                    break;
+                }
+                text += data.text || '';
+                setIsStreaming(true);
+                updateAnswer(text);
+                scrollToBottom();
+            }
+
+            const assistantMessage = updateAnswer(text || '未获取到回答');
             setResponse(assistantMessage.content);
             setImageData(null);
             scrollToBottom();
@@ -132,6 +199,7 @@ const ChatBox = forwardRef(({ pageContent, className }, ref) => {
             }
         } finally {
             setIsLoading(false);
+            setIsStreaming(false);
         }
     }
 
@@ -205,7 +273,7 @@ const ChatBox = forwardRef(({ pageContent, className }, ref) => {
                         </div>
                     ))
                 )}
-                {isLoading && (
+                {isLoading && !isStreaming && (
                     <div className="chat-message assistant-message">
                         <div className="loading-spinner">
                             <div className="spinner"></div>
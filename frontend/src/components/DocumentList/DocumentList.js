@@ -17,7 +17,7 @@ import {
     LinearProgress,
     CardMedia,
 } from '@mui/material';
-import { Description, Visibility, CheckCircle, Error, HourglassEmpty, Delete } from '@mui/icons-material';
+import { Description, Visibility, CheckCircle, Error, HourglassEmpty, Delete, Replay } from '@mui/icons-material';
 import './DocumentList.css';
 
 const DocumentList = ({updateTime, onViewDocument, collectionId, projectId}) => {
@@ -101,7 +101,7 @@ const DocumentList = ({updateTime, onViewDocument, collectionId, projectId}) =>
                     headers: {
                         'Content-Type': 'application/json',
                     },
-                    body: JSON.stringify({ document_id: docId }),
+                    body: JSON.stringify({ document_id: docId, collection_id: collectionId }),
                 });
             }
             if (taskId) {
@@ -123,6 +123,22 @@ const DocumentList = ({updateTime, onViewDocument, collectionId, projectId}) =>
         }
     };
 
+    // 重试失败的任务，已完成的页面不会重新处理
+    const handleRetryTask = async (taskId) => {
+        try {
+            const response = await fetch(`/api/documents/retry/${taskId}/`, {
+                method: 'POST',
+            });
+            if (!response.ok) {
+                const data = await response.json();
+                console.error('重试任务失败:', data.error);
+            }
+            fetchDocuments();
+        } catch (error) {
+            console.error('重试任务失败:', error);
+        }
+    };
+
     const handleCancelDelete = () => {
         setDeleteConfirmOpen(false);
         setDeleteTarget(null);
@@ -256,6 +272,15 @@ const DocumentList = ({updateTime, onViewDocument, collectionId, projectId}) =>
                                     </Typography>
                                 )}
                                 <Box sx={{ position: 'absolute', bottom: 5, right: 5 }}>
+                                    {task.status === 'FAILED' && (
+                                        <IconButton 
+                                            onClick={() => handleRetryTask(task.id)}
+                                            aria-label="重试任务"
+                                            size="small"
+                                        >
+                                        <Replay fontSize="small" />
+                                        </IconButton>
+                                    )}
                                     <IconButton 
                                         onClick={() => handleRemoveDocument(null, task.id)}
                                         aria-label="删除任务"
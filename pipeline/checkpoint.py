@@ -0,0 +1,102 @@
+import json
+import logging
+import os
+import shutil
+from pathlib import Path
+from typing import Iterable, Iterator, Optional
+
+from django.conf import settings
+from prepdocs.config import Section, Page, FileType
+
+logger = logging.getLogger(__name__)
+
+class TaskCheckpoint:
+    """
+    任务的逐页检查点
+
+    每个任务在 persist/checkpoints/<task_id>/ 下保存中间结果：
+     |--- manifest.json    预处理结果（页数、文件名）
+     |--- images/          渲染后的页面图片
+     |--- en/<index>.md    文本提取结果
+     |--- zh/<index>.md    翻译结果
+    任务重试时只需要处理缺失的页面，任务完成后删除整个目录。
+    """
+    def __init__(self, task_id: int):
+        self.root = Path(settings.PERSIST_DIR) / 'checkpoints' / str(task_id)
+        self.image_dir = self.root / 'images'
+        self.manifest_path = self.root / 'manifest.json'
+
+    @staticmethod
+    def _write_atomic(path: Path, content: str):
+        """先写临时文件再替换，进程中途退出时不会留下写了一半的文件"""
+        path.parent.mkdir(parents=True, exist_ok=True)
+        temp_path = path.with_name(f".{path.name}.tmp")
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            f.write(content)
+        os.replace(temp_path, path)
+
+    def load_image_section(self) -> Optional[Section]:
+        """读取预处理结果，检查点不存在或图片缺失时返回 None"""
+        if not self.manifest_path.exists():
+            return None
+        with open(self.manifest_path, 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+        pages = [Page(file_path=str(self.image_dir / name)) for name in manifest['images']]
+        if not all(os.path.exists(page.file_path) for page in pages):
+            logger.warning(f"检查点 {self.root} 的页面图片不完整，重新预处理")
+            return None
+        return Section(
+            title=manifest['title'],
+            pages=pages,
+            file_type=FileType.IMAGE,
+            filename=manifest['filename']
+        )
+
+    def iter_save_image_pages(self, title: str, filename: str, pages: Iterable[Page]) -> Iterator[Page]:
+        """
+        逐页将渲染好的页面图片移入检查点目录，产出指向新路径的 Page，全部完成后写入 manifest
+        预处理时已从文本层提取出内容的页面直接记为文本提取完成
+        """
+        self.image_dir.mkdir(parents=True, exist_ok=True)
+        names = []
+        for i, page in enumerate(pages):
+            name = f"page_{i + 1}{Path(page.file_path).suffix}"
+            shutil.move(page.file_path, self.image_dir / name)
+            names.append(name)
+            if page.content is not None:
+                self.save_page('en', i, page)
+            yield Page(file_path=str(self.image_dir / name), content=page.content)
+        self._write_atomic(self.manifest_path, json.dumps({
+            'title': title,
+            'filename': filename,
+            'images': names,
+        }, ensure_ascii=False))
+
+    def save_image_section(self, section: Section) -> Section:
+        """将渲染好的页面图片移入检查点目录，返回指向新路径的 Section"""
+        for _ in self.iter_save_image_pages(section.title, section.filename, section.pages):
+            pass
+        return self.load_image_section()
+
+    def _page_path(self, language: str, index: int) -> Path:
+        return self.root / language / f"{index}.md"
+
+    def load_page(self, language: str, index: int) -> Optional[Page]:
+        """读取某一页的文本结果，不存在时返回 None"""
+        path = self._page_path(language, index)
+        if not path.exists():
+            return None
+        with open(path, 'r', encoding='utf-8') as f:
+            return Page(content=f.read())
+
+    def save_page(self, language: str, index: int, page: Page):
+        """保存某一页的文本结果"""
+        self._write_atomic(self._page_path(language, index), page.content or '')
+
+    def load_pages(self, language: str, page_count: int) -> list[Optional[Page]]:
+        return [self.load_page(language, i) for i in range(page_count)]
+
+    def cleanup(self):
+        """任务完成后删除检查点"""
+        if self.root.exists():
+            shutil.rmtree(self.root)
@@ -1,105 +1,401 @@
+import asyncio
 import threading
-import queue
+import socket
 from concurrent.futures import ThreadPoolExecutor
-from datetime import datetime
+from datetime import datetime, timedelta
 from typing import Optional
+from django.db import transaction
+from django.db.models import Q, F
 from django.utils import timezone
 from django.conf import settings
+from asgiref.sync import sync_to_async
 import uuid
 import os
 import shutil
 import logging
-from api.models import Task, Document, TextSection, Project, Collection
+from api.models import Task, Document, TextSection, Project, Collection, PipelineWorker
 from prepdocs.config import Section, Page, FileType
+from pipeline.checkpoint import TaskCheckpoint
 
 logger = logging.getLogger(__name__)
 
+class LeaseLostError(Exception):
+    """任务的租约已过期并被其他 worker 领取，当前 worker 不能再写入该任务"""
+
 class DocumentPipeline:
-    def __init__(self, max_workers=3):
-        self.task_queue = queue.Queue()
-        self.thread_pool = ThreadPoolExecutor(max_workers=max_workers)
+    """
+    文档处理流水线
+
+    任务队列保存在数据库的 Task 表中：worker 通过条件更新领取任务并获得租约，
+    处理期间由心跳线程续约。进程崩溃或重启后，租约过期的任务会被重新领取，
+    未开始的任务也不会丢失。任务状态和处理结果只在仍持有租约时写入，
+    租约被其他 worker 领取后，原 worker 在下一次写入时停止处理，同一文档不会被保存两次。
+
+    多台机器共享 persist 目录时，每个 worker 在 PipelineWorker 表中登记自己的容量，
+    心跳线程定期更新正在处理的任务数。
+
+    创建后只负责添加任务，调用 start() 后才领取和处理任务。
+    Web 服务（PIPELINE_IN_WEB）和独立的 worker 进程（manage.py pipeline_worker）调用 start()，
+    其他管理命令（例如 migrate）不会领取任务。
+    """
+    def __init__(self, max_workers=3, lease_seconds=300, heartbeat_interval=None,
+                 poll_interval=1.0, max_attempts=3, streaming=True):
+        self.max_workers = max_workers
+        # 流式模式下，每页文本提取完成后立即开始翻译，不再等待整个文档
+        self.streaming = streaming
+        self.lease_seconds = lease_seconds
+        self.heartbeat_interval = heartbeat_interval or lease_seconds / 3
+        self.poll_interval = poll_interval
+        self.max_attempts = max_attempts
+        self.hostname = socket.gethostname()
+        self.worker_id = f"{self.hostname}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+        # 当前 worker 持有租约的任务
+        self.active_tasks = set()
+        self.active_lock = threading.Lock()
+        # 新任务到达时唤醒守护线程，避免等待下一次轮询
+        self.wakeup_event = threading.Event()
+        self.heartbeat_stop = threading.Event()
+        self.started = False
+        self.is_running = False
+
+    def start(self, max_workers: Optional[int] = None):
+        """
+        开始领取和处理任务
+        :param max_workers: 同时处理的文档数，默认使用创建时的 max_workers
+        """
+        if self.started:
+            return
+        if max_workers:
+            self.max_workers = max_workers
+        self.started = True
         self.is_running = True
-        # 删除之前未完成的任务
-        Task.objects.filter(status=Task.Status.PENDING).delete()
+        self.thread_pool = ThreadPoolExecutor(max_workers=self.max_workers)
+        # 创建转换进程池时预先启动 LibreOffice，不等到第一个 Office 文档
+        from prepdocs.office_pool import get_office_pool
+        get_office_pool()
+        try:
+            self._advertise()
+        except Exception as e:
+            # 数据库尚未迁移时（例如执行 migrate 命令），由心跳线程稍后登记
+            logger.error(f"登记 worker 失败: {str(e)}")
         # 启动守护线程处理任务
         self.daemon_thread = threading.Thread(target=self._process_queue, daemon=True)
         self.daemon_thread.start()
+        # 启动心跳线程续约
+        self.heartbeat_thread = threading.Thread(target=self._heartbeat_loop, daemon=True)
+        self.heartbeat_thread.start()
+        logger.info(f"Document Pipeline {self.worker_id} started with {self.max_workers} workers")
 
-    def add_task(self, title: str, file_path: str, collection_id: int) -> int:
-        """添加新任务到流水线，返回任务ID"""
+    def add_task(self, title: str, file_path: str, collection_id: int, content_hash: Optional[str] = None) -> int:
+        """
+        添加新任务到流水线，返回任务ID
+        已有相同内容哈希的文档处理完成时，直接将其链接到集合，不再重复处理
+        """
+        duplicate = self._find_duplicate(content_hash)
+        if duplicate is not None:
+            # 直接创建已完成的任务，不进入队列，避免 worker 在链接完成前领取
+            with transaction.atomic():
+                now = timezone.now()
+                task = Task.objects.create(
+                    title=title,
+                    file_path=file_path,
+                    status=Task.Status.COMPLETED,
+                    progress=100,
+                    completed_at=now,
+                    collection_id=collection_id,
+                    content_hash=content_hash,
+                    metadata={'duplicate_of': duplicate.id}
+                )
+                Collection.objects.get(id=collection_id).documents.add(duplicate)
+            if os.path.exists(file_path):
+                os.remove(file_path)
+            logger.info(f"任务 {task.id} 与文档 {duplicate.id} 内容相同，直接复用处理结果")
+            return task.id
         task = Task.objects.create(
             title=title,
             file_path=file_path,
             status=Task.Status.PENDING,
-            collection_id=collection_id
+            collection_id=collection_id,
+            content_hash=content_hash
         )
-        self.task_queue.put(task.id)
+        self.wakeup_event.set()
         return task.id
 
+    @staticmethod
+    def _find_duplicate(content_hash: Optional[str]) -> Optional[Document]:
+        """查找内容相同且已处理完成的文档"""
+        if not content_hash:
+            return None
+        return Document.objects.filter(
+            content_hash=content_hash,
+            linked_task__status=Task.Status.COMPLETED
+        ).order_by('created_at').first()
+
+    def _link_duplicate(self, task: Task, document: Document):
+        """将已有文档链接到任务的集合，并直接完成任务"""
+        collection = Collection.objects.get(id=task.collection_id)
+        collection.documents.add(document)
+        task.metadata = {**task.metadata, 'duplicate_of': document.id}
+        task.save(update_fields=['metadata'])
+        self._update_task_status(task, Task.Status.COMPLETED, 100)
+        if os.path.exists(task.file_path):
+            os.remove(task.file_path)
+        logger.info(f"任务 {task.id} 与文档 {document.id} 内容相同，直接复用处理结果")
+
     def _update_task_status(self, task: Task, status: str, progress: int = None, 
                           error_message: Optional[str] = None):
-        """更新任务状态"""
+        """
+        更新任务状态
+        只在任务仍由领取时的 worker 持有租约时写入，否则抛出 LeaseLostError
+        """
+        lease_owner = task.lease_owner
         task.status = status
         task.updated_at = timezone.now()
+        update_fields = ['status', 'updated_at']
         if progress is not None:
             task.progress = progress
+            update_fields.append('progress')
         if error_message:
             task.error_message = error_message
+            update_fields.append('error_message')
         if status == Task.Status.COMPLETED:
             task.completed_at = timezone.now()
-        task.save()
+            update_fields.append('completed_at')
+        if status in (Task.Status.COMPLETED, Task.Status.FAILED):
+            # 任务结束，释放租约
+            task.lease_owner = None
+            task.lease_expires_at = None
+            update_fields += ['lease_owner', 'lease_expires_at']
+        # 只写入修改过的字段，避免覆盖心跳线程写入的租约
+        updated = Task.objects.filter(id=task.id, lease_owner=lease_owner).update(
+            **{field: getattr(task, field) for field in update_fields}
+        )
+        if not updated:
+            raise LeaseLostError(f"任务 {task.id} 的租约已不属于 {lease_owner}")
 
     def _process_document(self, task: Task):
-        """处理单个文档的流水线逻辑"""
+        """处理单个文档的流水线逻辑，已完成的页面从检查点恢复"""
+        checkpoint = TaskCheckpoint(task.id)
         try:
-            
+            # 排队期间可能已有相同内容的文档处理完成
+            duplicate = self._find_duplicate(task.content_hash)
+            if duplicate is not None:
+                self._link_duplicate(task, duplicate)
+                checkpoint.cleanup()
+                return duplicate
+
             # ------------------预处理阶段------------------
             self._update_task_status(task, Task.Status.PREPROCESSING, 25)
-            # 实现预处理逻辑
-            image_section = self.stage_1(task.file_path, task.title)
-            logger.debug(f"预处理阶段完成: {image_section}")
-
-            # ------------------文本提取阶段------------------
-            self._update_task_status(task, Task.Status.EXTRACTING, 50)
-            # 实现预处理逻辑
-            english_section = self.stage_2(image_section)
-            logger.debug(f"文本提取阶段完成: {english_section}")
-
-            # ------------------翻译阶段------------------
-            self._update_task_status(task, Task.Status.TRANSLATING, 75)
-            # 实现翻译逻辑
-            chinese_section = self.stage_3(english_section)
-            logger.debug(f"翻译阶段完成: {chinese_section}")
+            image_section = checkpoint.load_image_section()
+            if image_section is not None:
+                logger.info(f"任务 {task.id} 从检查点恢复预处理结果，共 {len(image_section.pages)} 页")
+
+            if self.streaming:
+                # ------------------预处理、文本提取与翻译（按页流式）------------------
+                if image_section is None:
+                    # 页面边渲染边进入文本提取，不等待整个文档渲染完成
+                    page_count, pages = self.stage_1_stream(task.file_path, task.title)
+                    streaming_section = Section(
+                        title=task.title,
+                        pages=checkpoint.iter_save_image_pages(task.title, task.title, pages),
+                        file_type=FileType.IMAGE,
+                        filename=task.title
+                    )
+                else:
+                    page_count, streaming_section = len(image_section.pages), image_section
+                self._update_task_status(task, Task.Status.EXTRACTING, 50)
+                english_section, chinese_section = self.stage_2_3(streaming_section, task, checkpoint, page_count)
+                image_section = checkpoint.load_image_section()
+                logger.debug(f"文本提取与翻译阶段完成: {english_section}, {chinese_section}")
+            else:
+                if image_section is None:
+                    # 实现预处理逻辑
+                    image_section = checkpoint.save_image_section(self.stage_1(task.file_path, task.title))
+                    logger.debug(f"预处理阶段完成: {image_section}")
+
+                # ------------------文本提取阶段------------------
+                self._update_task_status(task, Task.Status.EXTRACTING, 50)
+                # 实现预处理逻辑
+                english_section = self.stage_2(image_section, checkpoint)
+                logger.debug(f"文本提取阶段完成: {english_section}")
+
+                # ------------------翻译阶段------------------
+                self._update_task_status(task, Task.Status.TRANSLATING, 75)
+                # 实现翻译逻辑
+                chinese_section = self.stage_3(english_section, checkpoint)
+                logger.debug(f"翻译阶段完成: {chinese_section}")
 
             # ------------------保存阶段------------------
+            # 保存结果和完成任务在同一个事务中，租约已丢失时不会保存
             document = self.stage_4(english_section, chinese_section, task.file_path, task, image_section)
-            # 完成
-            self._update_task_status(task, Task.Status.COMPLETED, 100)
+            checkpoint.cleanup()
             return document
+        except LeaseLostError as e:
+            # 检查点和上传文件由新持有租约的 worker 继续使用，不做清理
+            logger.warning(f"停止处理任务 {task.id}: {str(e)}")
+            return None
         except Exception as e:
             logger.error(f"处理文档失败: {str(e)}")
             self._update_task_status(task, Task.Status.FAILED, error_message=str(e))
             raise
 
+    def _run_task(self, task: Task):
+        """在线程池中执行任务，结束后从活跃任务中移除"""
+        try:
+            self._process_document(task)
+        finally:
+            with self.active_lock:
+                self.active_tasks.discard(task.id)
+            self.wakeup_event.set()
+
+    def _claimable_tasks(self):
+        """未结束且没有有效租约的任务，按创建时间先后排列"""
+        now = timezone.now()
+        return Task.objects.filter(
+            Q(lease_expires_at__isnull=True) | Q(lease_expires_at__lt=now),
+            status__in=Task.ACTIVE_STATUSES,
+        ).order_by('created_at')
+
+    def _claim_task(self) -> Optional[Task]:
+        """
+        领取一个任务
+        使用带原租约条件的 UPDATE 实现比较并交换，保证同一任务只会被一个 worker 领取
+        """
+        candidates = self._claimable_tasks().values_list('id', 'lease_owner', 'lease_expires_at', 'attempts')[:10]
+        for task_id, lease_owner, lease_expires_at, attempts in candidates:
+            now = timezone.now()
+            if attempts >= self.max_attempts:
+                # 多次领取仍未完成（例如处理过程中进程反复崩溃），不再重试
+                Task.objects.filter(
+                    id=task_id, lease_owner=lease_owner, lease_expires_at=lease_expires_at
+                ).update(
+                    status=Task.Status.FAILED,
+                    error_message=f"任务已重试 {attempts} 次仍未完成",
+                    lease_owner=None,
+                    lease_expires_at=None,
+                    updated_at=now,
+                )
+                continue
+            claimed = Task.objects.filter(
+                id=task_id, lease_owner=lease_owner, lease_expires_at=lease_expires_at
+            ).update(
+                lease_owner=self.worker_id,
+                lease_expires_at=now + timedelta(seconds=self.lease_seconds),
+                heartbeat_at=now,
+                attempts=F('attempts') + 1,
+            )
+            if claimed:
+                if lease_owner:
+                    logger.warning(f"任务 {task_id} 的租约已过期（原持有者 {lease_owner}），重新领取")
+                return Task.objects.get(id=task_id)
+        return None
+
     def _process_queue(self):
-        """守护线程：持续处理队列中的任务"""
+        """守护线程：持续从数据库领取任务"""
         while self.is_running:
             try:
-                task_id = self.task_queue.get(timeout=1)  # 1秒超时
-                task = Task.objects.get(id=task_id)
-                self.thread_pool.submit(self._process_document, task)
-            except queue.Empty:
-                continue  # 队列为空，继续等待
+                with self.active_lock:
+                    has_capacity = len(self.active_tasks) < self.max_workers
+                task = self._claim_task() if has_capacity else None
+                if task is None:
+                    # 没有空闲线程或没有可领取的任务，等待唤醒或下一次轮询
+                    self.wakeup_event.wait(timeout=self.poll_interval)
+                    self.wakeup_event.clear()
+                    continue
+                with self.active_lock:
+                    self.active_tasks.add(task.id)
+                self.thread_pool.submit(self._run_task, task)
             except Exception as e:
-                print(f"Error processing task: {str(e)}")
+                logger.error(f"Error processing task: {str(e)}")
+                self.wakeup_event.wait(timeout=self.poll_interval)
                 continue
 
+    def _advertise(self):
+        """在 worker 注册表中登记或更新容量和正在处理的任务数"""
+        with self.active_lock:
+            active_tasks = len(self.active_tasks)
+        PipelineWorker.objects.update_or_create(
+            worker_id=self.worker_id,
+            defaults={
+                'hostname': self.hostname,
+                'capacity': self.max_workers,
+                'active_tasks': active_tasks,
+                'heartbeat_at': timezone.now(),
+            }
+        )
+
+    def _prune_workers(self):
+        """删除长时间没有心跳的 worker 记录（进程被强制结束时没有注销）"""
+        PipelineWorker.objects.filter(
+            heartbeat_at__lt=timezone.now() - timedelta(seconds=self.lease_seconds * 10)
+        ).delete()
+
+    def get_worker_status(self) -> dict:
+        """注册的 worker 及其容量，在线 worker 的总容量和等待领取的任务数"""
+        # 超过一个租约周期没有心跳的 worker 视为离线，它持有的任务会被其他 worker 重新领取
+        online_since = timezone.now() - timedelta(seconds=self.lease_seconds)
+        workers = [{
+            'worker_id': worker.worker_id,
+            'hostname': worker.hostname,
+            'capacity': worker.capacity,
+            'active_tasks': worker.active_tasks,
+            'started_at': worker.started_at.isoformat(),
+            'heartbeat_at': worker.heartbeat_at.isoformat(),
+            'online': worker.heartbeat_at >= online_since,
+        } for worker in PipelineWorker.objects.all()]
+        online = [worker for worker in workers if worker['online']]
+        return {
+            'workers': workers,
+            'capacity': sum(worker['capacity'] for worker in online),
+            'active_tasks': sum(worker['active_tasks'] for worker in online),
+            'queued_tasks': self._claimable_tasks().count(),
+        }
+
+    def _heartbeat_loop(self):
+        """心跳线程：定期为正在处理的任务续约，并更新注册表中的容量"""
+        while not self.heartbeat_stop.wait(self.heartbeat_interval):
+            try:
+                self._advertise()
+                self._prune_workers()
+            except Exception as e:
+                logger.error(f"更新 worker 注册表失败: {str(e)}")
+            try:
+                with self.active_lock:
+                    task_ids = list(self.active_tasks)
+                if not task_ids:
+                    continue
+                now = timezone.now()
+                renewed = Task.objects.filter(
+                    id__in=task_ids, lease_owner=self.worker_id
+                ).update(
+                    lease_expires_at=now + timedelta(seconds=self.lease_seconds),
+                    heartbeat_at=now,
+                )
+                if renewed < len(task_ids):
+                    logger.warning(f"{len(task_ids) - renewed} 个任务的租约已丢失")
+            except Exception as e:
+                logger.error(f"任务心跳失败: {str(e)}")
+
     def shutdown(self):
-        """关闭流水线"""
+        """关闭流水线：停止领取新任务，等待已领取的任务完成后再停止心跳"""
+        if not self.started:
+            return
         self.is_running = False
+        self.wakeup_event.set()
+        self.daemon_thread.join(timeout=5)
         self.thread_pool.shutdown(wait=True)
-        self.daemon_thread.join(timeout=5) 
-        print("Document Pipeline shutdown complete")
+        self.heartbeat_stop.set()
+        self.heartbeat_thread.join(timeout=5)
+        try:
+            PipelineWorker.objects.filter(worker_id=self.worker_id).delete()
+        except Exception as e:
+            logger.error(f"注销 worker 失败: {str(e)}")
+        from prepdocs.render_pool import shutdown_render_pool
+        from prepdocs.office_pool import shutdown_office_pool
+        shutdown_render_pool()
+        shutdown_office_pool()
+        logger.info("Document Pipeline shutdown complete")
 
     # 具体实现
     def stage_1(self, file_path: str, title: str) -> Section:
@@ -112,23 +408,218 @@ class DocumentPipeline:
         ingester = DocsIngester()
         return ingester.process_document(file_path, title)
 
-    def stage_2(self, section: Section):
+    @staticmethod
+    def _resume_pages(section: Section, checkpoint: Optional[TaskCheckpoint], language: str, process) -> Section:
+        """
+        只对检查点中缺失的页面调用 process(sub_section, on_page_done)，
+        每页完成后立即写入检查点，最后按原始顺序从检查点组装结果
+        """
+        if checkpoint is None:
+            return process(section, None)
+        page_count = len(section.pages)
+        missing = [i for i, page in enumerate(checkpoint.load_pages(language, page_count)) if page is None]
+        if missing:
+            logger.debug(f"{section.title} 需要处理 {len(missing)}/{page_count} 页 ({language})")
+            sub_section = Section(
+                title=section.title,
+                pages=[section.pages[i] for i in missing],
+                file_type=section.file_type,
+                filename=section.filename
+            )
+            process(sub_section, lambda idx, page: checkpoint.save_page(language, missing[idx], page))
+        pages = checkpoint.load_pages(language, page_count)
+        failed_pages = [i + 1 for i, page in enumerate(pages) if page is None]
+        if failed_pages:
+            raise ValueError(f"以下页面处理失败: {failed_pages}")
+        return Section(
+            title=section.title,
+            pages=pages,
+            file_type=FileType.TEXT,
+            filename=section.filename
+        )
+
+    def stage_1_stream(self, file_path: str, title: str):
+        """
+        流式预处理阶段，返回页数和逐页渲染的 Page 生成器
+        """
+        logger.debug(f"Streaming {file_path} with title {title}")
+        from prepdocs.parse_page import DocsIngester
+
+        ingester = DocsIngester()
+        return ingester.iter_document(file_path, title)
+
+    def stage_2(self, section: Section, checkpoint: Optional[TaskCheckpoint] = None):
         """
         文本提取阶段，将图片转换为文本：使用ClientPool来调用GeminiClient的chat_with_image方法
         """
         from prepdocs.parse_images import parse_images
         logger.debug(f"Processing {section} with title {section.title}")
 
-        return parse_images(section)
+        return self._resume_pages(
+            section, checkpoint, 'en',
+            lambda sub_section, on_page_done: parse_images(sub_section, on_page_done=on_page_done)
+        )
 
-    def stage_3(self, section: Section):
+    def stage_3(self, section: Section, checkpoint: Optional[TaskCheckpoint] = None):
         """
         翻译阶段，将文本翻译为中文
         """
         from prepdocs.translate import translate_text
         logger.debug(f"Translating {section} with title {section.title}")
 
-        return translate_text(section, 'Simplified Chinese')
+        return self._resume_pages(
+            section, checkpoint, 'zh',
+            lambda sub_section, on_page_done: translate_text(sub_section, 'Simplified Chinese', on_page_done=on_page_done)
+        )
+
+    def stage_2_3(self, section: Section, task: Task, checkpoint: Optional[TaskCheckpoint] = None,
+                  page_count: Optional[int] = None) -> tuple[Section, Section]:
+        """
+        文本提取与翻译的流式实现：文本提取完成的页面凑满一个翻译请求的 token 预算后立即提交翻译，
+        文档总耗时接近最慢的单页链路，而不是两个阶段各自最慢页之和
+        section.pages 可以是逐页渲染的生成器，此时需要传入 page_count
+        """
+        from backend.setup_env import global_env
+        from clients.async_http import run_async
+        logger.debug(f"Streaming {section} with title {section.title}")
+
+        client_pool = global_env['gemini_client_pool']
+        if not client_pool._get_clients():
+            raise ValueError("No Client available. Please check your API keys.")
+        return run_async(self._astage_2_3(client_pool, section, task, checkpoint, page_count))
+
+    async def _astage_2_3(self, client_pool, section: Section, task: Task, checkpoint: Optional[TaskCheckpoint],
+                          page_count: Optional[int]) -> tuple[Section, Section]:
+        """stage_2_3 的实现，所有页面的请求在同一个事件循环中并发执行"""
+        from prepdocs.parse_images import process_page_batch, get_page_batcher
+        from prepdocs.translate import translate_pages
+        from clients.rate_limiter import estimate_text_tokens
+
+        if page_count is None:
+            page_count = len(section.pages)
+        english_section = Section(
+            title=section.title,
+            pages=[None] * page_count,  # 预分配空间以保持顺序
+            file_type=FileType.TEXT,
+            filename=section.filename
+        )
+        chinese_section = Section(
+            title=section.title,
+            pages=[None] * page_count,
+            file_type=FileType.TEXT,
+            filename=section.filename
+        )
+        if checkpoint is not None:
+            english_section.pages = checkpoint.load_pages('en', page_count)
+            chinese_section.pages = checkpoint.load_pages('zh', page_count)
+        # 从检查点恢复的页面计入已完成的步骤
+        finished_steps = sum(page is not None for page in english_section.pages + chinese_section.pages)
+        progress_lock = threading.Lock()
+        # 租约被其他 worker 领取后不再发送新的请求，等待已发出的请求结束后停止
+        lease_lost: Optional[LeaseLostError] = None
+
+        # 进度写入是独立的 ORM 更新，使用 thread_sensitive=False 在事件循环的线程池中执行，
+        # 不与其他文档排队等待 asgiref 全局的单个线程
+        def report_progress(status):
+            nonlocal finished_steps, lease_lost
+            with progress_lock:
+                finished_steps += 1
+                # 文本提取和翻译各占一半，进度从 50 推进到 90
+                progress = 50 + 40 * finished_steps // max(2 * page_count, 1)
+                try:
+                    self._update_task_status(task, status, progress)
+                except LeaseLostError as e:
+                    lease_lost = e
+
+        # 文本提取和翻译分别限制并发数，翻译请求不会排在剩余的提取请求之后
+        ocr_semaphore = asyncio.Semaphore(settings.LLM_MAX_IN_FLIGHT)
+        translate_semaphore = asyncio.Semaphore(settings.LLM_MAX_IN_FLIGHT)
+        extract_tasks = []
+        translate_tasks = []
+
+        async def translate_batch(indexes):
+            if lease_lost:
+                return
+
+            async def finish_page(i, result_page):
+                idx = indexes[i]
+                chinese_section.pages[idx] = result_page
+                if checkpoint is not None:
+                    await asyncio.to_thread(checkpoint.save_page, 'zh', idx, result_page)
+                await sync_to_async(report_progress, thread_sensitive=False)(Task.Status.TRANSLATING)
+
+            try:
+                await translate_pages(client_pool, [english_section.pages[idx].content for idx in indexes],
+                                      'Simplified Chinese', finish_page, translate_semaphore)
+            except Exception as e:
+                pages = ', '.join(str(idx + 1) for idx in indexes)
+                logger.error(f"翻译页面 {pages} 时发生错误: {str(e)}", exc_info=True)
+
+        # 文本提取完成的页面先放入缓冲区，累计达到一个翻译请求的 token 预算后一起提交，
+        # 小页面合并到同一个请求中；文本提取全部结束时提交剩余的页面
+        translate_buffer = []
+        buffered_tokens = 0
+
+        def flush_translations():
+            nonlocal translate_buffer, buffered_tokens
+            if translate_buffer:
+                translate_tasks.append(asyncio.create_task(translate_batch(translate_buffer)))
+            translate_buffer, buffered_tokens = [], 0
+
+        def queue_translation(idx):
+            nonlocal buffered_tokens
+            translate_buffer.append(idx)
+            buffered_tokens += estimate_text_tokens(english_section.pages[idx].content)
+            if buffered_tokens >= settings.TRANSLATE_CHUNK_TOKENS:
+                flush_translations()
+
+        async def extract_batch(batch):
+            if lease_lost:
+                return
+            try:
+                async with ocr_semaphore:
+                    results = await process_page_batch(client_pool, [page for _, page in batch])
+            except Exception as e:
+                pages = ', '.join(str(idx + 1) for idx, _ in batch)
+                logger.error(f"处理页面 {pages} 时发生错误: {str(e)}")
+                return
+            for (idx, _), result_page in zip(batch, results):
+                english_section.pages[idx] = result_page
+                if checkpoint is not None:
+                    await asyncio.to_thread(checkpoint.save_page, 'en', idx, result_page)
+                await sync_to_async(report_progress, thread_sensitive=False)(Task.Status.EXTRACTING)
+                queue_translation(idx)
+
+        def submit_batches(batches):
+            for batch in batches:
+                if batch:
+                    extract_tasks.append(asyncio.create_task(extract_batch(batch)))
+
+        # 页面可能仍在渲染中，在线程中等待下一页，每凑满一批就提交
+        batcher = get_page_batcher()
+        pages = iter(section.pages)
+        end_of_pages = object()
+        idx = 0
+        while (page := await asyncio.to_thread(next, pages, end_of_pages)) is not end_of_pages:
+            if idx >= page_count:
+                raise ValueError(f"渲染的页数超过预期的 {page_count} 页")
+            if english_section.pages[idx] is None:
+                submit_batches(batcher.add(idx, page))
+            elif chinese_section.pages[idx] is None:
+                queue_translation(idx)
+            idx += 1
+        submit_batches([batcher.flush()])
+
+        await asyncio.gather(*extract_tasks)
+        flush_translations()
+        await asyncio.gather(*translate_tasks)
+
+        if lease_lost:
+            raise lease_lost
+        failed_pages = [i + 1 for i, page in enumerate(chinese_section.pages) if page is None]
+        if failed_pages:
+            raise ValueError(f"以下页面处理失败: {failed_pages}")
+        return english_section, chinese_section
 
     def stage_4(self, english_section: Section, chinese_section: Section, original_file_path: str, task: Task, image_section: Section):
         """
@@ -143,43 +634,53 @@ class DocumentPipeline:
         os.makedirs(persist_dir / document_id, exist_ok=True)
         os.makedirs(persist_dir / document_id / "en", exist_ok=True)
         os.makedirs(persist_dir / document_id / "zh", exist_ok=True)
-        # 使用 shutil.move 替代 os.rename
         persist_file_path = persist_dir / document_id / task.title
-        shutil.move(original_file_path, persist_file_path)
-        # 保存缩略图
-        shutil.move(image_section.pages[0].file_path, persist_dir / document_id / "thumbnail.png")
-        for i, page in enumerate(english_section.pages):
-            english_file_path = persist_dir / document_id / "en" / f"{document_id}_index_{i}.md"
-            with open(english_file_path, 'w', encoding='utf-8') as f:
-                f.write(page.content)
-        for i, page in enumerate(chinese_section.pages):
-            chinese_file_path = persist_dir / document_id / "zh" / f"{document_id}_index_{i}.md"
-            with open(chinese_file_path, 'w', encoding='utf-8') as f:
-                f.write(page.content)
-        # ------------------保存到数据库------------------
-        document = Document.objects.create(
-            title=english_section.title,
-            linked_file_path=persist_dir / document_id,
-            linked_task=task
-        )
-        logger.debug(f"Creating document {document} with title {document.title}")
-        english_text_section = TextSection.objects.create(
-            title=english_section.title,
-            section=english_section.to_dict(),
-            linked_file_path=persist_file_path
-        )
-        chinese_text_section = TextSection.objects.create(
-            title=chinese_section.title,
-            section=chinese_section.to_dict(),
-            linked_file_path=persist_file_path
-        )
-        document.english_sections.add(english_text_section)
-        document.chinese_sections.add(chinese_text_section)
-        document.save()
+        try:
+            # 先复制，全部保存成功后再删除上传文件，保存失败时任务仍可重试
+            shutil.copy(original_file_path, persist_file_path)
+            # 保存缩略图
+            shutil.copy(image_section.pages[0].file_path, persist_dir / document_id / "thumbnail.png")
+            for i, page in enumerate(english_section.pages):
+                english_file_path = persist_dir / document_id / "en" / f"{document_id}_index_{i}.md"
+                with open(english_file_path, 'w', encoding='utf-8') as f:
+                    f.write(page.content)
+            for i, page in enumerate(chinese_section.pages):
+                chinese_file_path = persist_dir / document_id / "zh" / f"{document_id}_index_{i}.md"
+                with open(chinese_file_path, 'w', encoding='utf-8') as f:
+                    f.write(page.content)
+            # ------------------保存到数据库------------------
+            with transaction.atomic():
+                document = Document.objects.create(
+                    title=english_section.title,
+                    linked_file_path=persist_dir / document_id,
+                    linked_task=task,
+                    content_hash=task.content_hash
+                )
+                logger.debug(f"Creating document {document} with title {document.title}")
+                english_text_section = TextSection.objects.create(
+                    title=english_section.title,
+                    section=english_section.to_dict(),
+                    linked_file_path=persist_file_path
+                )
+                chinese_text_section = TextSection.objects.create(
+                    title=chinese_section.title,
+                    section=chinese_section.to_dict(),
+                    linked_file_path=persist_file_path
+                )
+                document.english_sections.add(english_text_section)
+                document.chinese_sections.add(chinese_text_section)
+                document.save()
 
-        # 链接项目和集合
-        collection = Collection.objects.get(id=task.collection_id)
-        collection.documents.add(document)
+                # 链接项目和集合
+                collection = Collection.objects.get(id=task.collection_id)
+                collection.documents.add(document)
+
+                # 完成
+                self._update_task_status(task, Task.Status.COMPLETED, 100)
+        except Exception:
+            shutil.rmtree(persist_dir / document_id, ignore_errors=True)
+            raise
+        os.remove(original_file_path)
 
         logger.debug(f"Document {document} with title {document.title} created")
         return document
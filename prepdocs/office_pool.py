@@ -0,0 +1,230 @@
+# LibreOffice 常驻转换进程池
+# 每个 worker 是一个常驻的 office_worker.py 进程，持有一个预热好的 soffice，
+# 使用独立的用户配置目录，转换前做健康检查，处理一定数量的任务后重启。
+
+import json
+import logging
+import os
+import queue
+import shutil
+import signal
+import subprocess
+import tempfile
+import threading
+import uuid
+from pathlib import Path
+from threading import Lock
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+WORKER_SCRIPT = Path(__file__).resolve().parent / 'office_worker.py'
+
+class OfficeWorkerUnavailable(Exception):
+    """无法启动常驻转换进程（例如缺少 uno 模块），需要回退到一次性转换"""
+
+class OfficeWorker:
+    def __init__(self, python: str, soffice: str):
+        self.python = python
+        self.soffice = soffice
+        self.profile_dir = tempfile.mkdtemp(prefix='lo_profile_')
+        self.pipe_name = f"thereader_{uuid.uuid4().hex}"
+        self.jobs = 0
+        self.process: Optional[subprocess.Popen] = None
+        self.responses = queue.Queue()
+
+    def _read_responses(self):
+        """读取线程：将 worker 的每一行输出放入队列，进程退出时放入 None"""
+        for line in self.process.stdout:
+            self.responses.put(line)
+        self.responses.put(None)
+
+    def _read(self, timeout: float) -> dict:
+        try:
+            line = self.responses.get(timeout=timeout)
+        except queue.Empty:
+            raise TimeoutError(f"LibreOffice worker 在 {timeout} 秒内没有响应")
+        if line is None:
+            raise RuntimeError("LibreOffice worker 已退出")
+        response = json.loads(line)
+        if not response.get('ok'):
+            raise RuntimeError(response.get('error', '未知错误'))
+        return response
+
+    def _request(self, payload: dict, timeout: float) -> dict:
+        self.process.stdin.write(json.dumps(payload) + '\n')
+        self.process.stdin.flush()
+        return self._read(timeout)
+
+    def start(self, timeout: float):
+        try:
+            self.process = subprocess.Popen(
+                [self.python, str(WORKER_SCRIPT),
+                 '--soffice', self.soffice,
+                 '--profile-dir', self.profile_dir,
+                 '--pipe-name', self.pipe_name,
+                 '--start-timeout', str(timeout)],
+                stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE,
+                text=True,
+                bufsize=1,
+                # worker 和它启动的 soffice 在同一个进程组中，停止时一起结束
+                start_new_session=True
+            )
+            threading.Thread(target=self._read_responses, daemon=True).start()
+            self._read(timeout + 10)
+        except Exception as e:
+            self.stop()
+            raise OfficeWorkerUnavailable(f"启动 LibreOffice worker 失败: {str(e)}")
+        logger.info(f"LibreOffice worker {self.pipe_name} started")
+
+    def is_healthy(self, timeout: float = 10) -> bool:
+        if self.process is None or self.process.poll() is not None:
+            return False
+        try:
+            self._request({'cmd': 'ping'}, timeout)
+            return True
+        except Exception as e:
+            logger.warning(f"LibreOffice worker {self.pipe_name} 健康检查失败: {str(e)}")
+            return False
+
+    def convert(self, input_file: str, output_pdf: str, timeout: float):
+        self._request({'cmd': 'convert', 'input': input_file, 'output': output_pdf}, timeout)
+        self.jobs += 1
+
+    def stop(self):
+        if self.process is not None:
+            try:
+                # 关闭标准输入后 worker 会关闭 soffice 并退出
+                self.process.stdin.close()
+                self.process.wait(timeout=15)
+            except Exception:
+                pass
+            # 无论 worker 是否正常退出，都结束整个进程组，不留下卡住的 soffice
+            try:
+                os.killpg(self.process.pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+            try:
+                self.process.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                logger.warning(f"LibreOffice worker {self.pipe_name} 未能结束")
+            self.process = None
+        shutil.rmtree(self.profile_dir, ignore_errors=True)
+
+class OfficeConverterPool:
+    def __init__(self, size: int = 2, max_jobs_per_worker: int = 50,
+                 python: str = '/usr/bin/python3', soffice: str = 'soffice',
+                 convert_timeout: float = 300, start_timeout: float = 60,
+                 max_start_failures: int = 3):
+        """
+        初始化转换进程池
+        :param size: 常驻 worker 数量，即最大并行转换数
+        :param max_jobs_per_worker: 每个 worker 处理多少个文档后重启，避免 soffice 内存持续增长
+        :param python: 带 uno 模块的 Python 解释器
+        :param max_start_failures: 连续启动失败多少次后停用进程池
+        """
+        self.size = size
+        self.max_jobs_per_worker = max_jobs_per_worker
+        self.python = python
+        self.soffice = soffice
+        self.convert_timeout = convert_timeout
+        self.start_timeout = start_timeout
+        self.max_start_failures = max_start_failures
+        self.start_failures = 0
+        self.closed = False
+        # 空闲 worker 槽位，None 表示该槽位的 worker 尚未启动或已被回收
+        self.idle_workers = queue.Queue()
+        for _ in range(size):
+            self.idle_workers.put(None)
+        # 在后台预先启动所有 worker，第一个文档不必等待 LibreOffice 冷启动
+        threading.Thread(target=self._prestart_workers, daemon=True).start()
+
+    @property
+    def available(self) -> bool:
+        return self.start_failures < self.max_start_failures
+
+    def _start_worker(self) -> OfficeWorker:
+        worker = OfficeWorker(self.python, self.soffice)
+        try:
+            worker.start(self.start_timeout)
+        except OfficeWorkerUnavailable:
+            self.start_failures += 1
+            if not self.available:
+                logger.error("LibreOffice worker 多次启动失败，停用转换进程池")
+            raise
+        self.start_failures = 0
+        return worker
+
+    def _prestart_workers(self):
+        """逐个占用槽位启动 worker；启动期间需要转换的文档会等待该槽位，而不是另外启动"""
+        for _ in range(self.size):
+            if not self.available or self.closed:
+                return
+            worker = self.idle_workers.get()
+            try:
+                if worker is None and not self.closed:
+                    worker = self._start_worker()
+            except OfficeWorkerUnavailable as e:
+                logger.warning(f"预启动 LibreOffice worker 失败: {str(e)}")
+            finally:
+                self.idle_workers.put(worker)
+
+    def convert(self, input_file: str, output_pdf: str):
+        """在空闲的 worker 上将文档转换为 PDF，没有空闲 worker 时等待"""
+        if not self.available:
+            raise OfficeWorkerUnavailable("转换进程池已停用")
+        worker = self.idle_workers.get()
+        try:
+            if worker is None or not worker.is_healthy():
+                if worker is not None:
+                    worker.stop()
+                worker = None
+                worker = self._start_worker()
+            worker.convert(input_file, output_pdf, self.convert_timeout)
+            if worker.jobs >= self.max_jobs_per_worker:
+                logger.info(f"LibreOffice worker {worker.pipe_name} 已处理 {worker.jobs} 个文档，重启")
+                worker.stop()
+                worker = None
+        except Exception:
+            # 转换失败或超时后 soffice 的状态不可信，回收该 worker
+            if worker is not None:
+                worker.stop()
+                worker = None
+            raise
+        finally:
+            self.idle_workers.put(worker)
+
+    def shutdown(self):
+        """关闭所有空闲的 worker"""
+        self.closed = True
+        for _ in range(self.size):
+            worker = self.idle_workers.get()
+            if worker is not None:
+                worker.stop()
+            self.idle_workers.put(None)
+        logger.info("Office converter pool shutdown complete")
+
+_office_pool: Optional[OfficeConverterPool] = None
+_office_pool_lock = Lock()
+
+def get_office_pool() -> OfficeConverterPool:
+    """获取全局转换进程池，参数由 settings.LIBREOFFICE_* 配置"""
+    global _office_pool
+    with _office_pool_lock:
+        if _office_pool is None:
+            from django.conf import settings
+            _office_pool = OfficeConverterPool(
+                size=settings.LIBREOFFICE_POOL_SIZE,
+                max_jobs_per_worker=settings.LIBREOFFICE_MAX_JOBS,
+                python=settings.LIBREOFFICE_PYTHON,
+                convert_timeout=settings.LIBREOFFICE_TIMEOUT,
+            )
+        return _office_pool
+
+def shutdown_office_pool():
+    global _office_pool
+    with _office_pool_lock:
+        if _office_pool is not None:
+            _office_pool.shutdown()
+            _office_pool = None
@@ -0,0 +1,135 @@
+# LibreOffice 常驻转换进程
+# 由 prepdocs/office_pool.py 使用带 uno 模块的 Python 解释器（例如安装了 python3-uno 的 /usr/bin/python3）启动，
+# 启动一个使用独立用户配置目录的 soffice，通过标准输入/输出按行交换 JSON 消息：
+#   {"cmd": "ping"}                                   -> {"ok": true}
+#   {"cmd": "convert", "input": ..., "output": ...}   -> {"ok": true} 或 {"ok": false, "error": ...}
+# 标准输入关闭时退出并关闭 soffice。本文件不能依赖项目中的其它模块。
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+import uno
+from com.sun.star.beans import PropertyValue
+from com.sun.star.connection import NoConnectException
+
+# 按文档类型选择 PDF 导出过滤器
+PDF_FILTERS = [
+    ('com.sun.star.presentation.PresentationDocument', 'impress_pdf_Export'),
+    ('com.sun.star.sheet.SpreadsheetDocument', 'calc_pdf_Export'),
+    ('com.sun.star.drawing.DrawingDocument', 'draw_pdf_Export'),
+    ('com.sun.star.text.TextDocument', 'writer_pdf_Export'),
+]
+
+def _properties(**kwargs):
+    properties = []
+    for name, value in kwargs.items():
+        prop = PropertyValue()
+        prop.Name = name
+        prop.Value = value
+        properties.append(prop)
+    return tuple(properties)
+
+def _reply(message: dict):
+    sys.stdout.write(json.dumps(message) + '\n')
+    sys.stdout.flush()
+
+def start_office(soffice: str, profile_dir: str, pipe_name: str) -> subprocess.Popen:
+    return subprocess.Popen([
+        soffice,
+        '--headless',
+        '--invisible',
+        '--nologo',
+        '--nodefault',
+        '--norestore',
+        '--nolockcheck',
+        f'-env:UserInstallation={uno.systemPathToFileUrl(profile_dir)}',
+        f'--accept=pipe,name={pipe_name};urp;StarOffice.ComponentContext',
+    ], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+def connect(office: subprocess.Popen, pipe_name: str, timeout: float):
+    """等待 soffice 启动完成并返回 Desktop 对象"""
+    local_context = uno.getComponentContext()
+    resolver = local_context.ServiceManager.createInstanceWithContext(
+        'com.sun.star.bridge.UnoUrlResolver', local_context
+    )
+    deadline = time.time() + timeout
+    while True:
+        if office.poll() is not None:
+            raise RuntimeError(f"soffice 启动失败，退出码 {office.returncode}")
+        try:
+            context = resolver.resolve(f'uno:pipe,name={pipe_name};urp;StarOffice.ComponentContext')
+            return context.ServiceManager.createInstanceWithContext('com.sun.star.frame.Desktop', context)
+        except NoConnectException:
+            if time.time() > deadline:
+                raise RuntimeError("等待 soffice 启动超时")
+            time.sleep(0.5)
+
+def convert(desktop, input_path: str, output_path: str):
+    document = desktop.loadComponentFromURL(
+        uno.systemPathToFileUrl(os.path.abspath(input_path)), '_blank', 0,
+        _properties(Hidden=True, ReadOnly=True)
+    )
+    if document is None:
+        raise RuntimeError(f"无法打开文档: {input_path}")
+    try:
+        filter_name = next(
+            (name for service, name in PDF_FILTERS if document.supportsService(service)),
+            'writer_pdf_Export'
+        )
+        document.storeToURL(
+            uno.systemPathToFileUrl(os.path.abspath(output_path)),
+            _properties(FilterName=filter_name)
+        )
+    finally:
+        try:
+            document.close(True)
+        except Exception:
+            document.dispose()
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--soffice', default='soffice')
+    parser.add_argument('--profile-dir', required=True)
+    parser.add_argument('--pipe-name', required=True)
+    parser.add_argument('--start-timeout', type=float, default=60)
+    args = parser.parse_args()
+
+    office = start_office(args.soffice, args.profile_dir, args.pipe_name)
+    desktop = None
+    try:
+        desktop = connect(office, args.pipe_name, args.start_timeout)
+        _reply({'ok': True, 'ready': True})
+        for line in sys.stdin:
+            if not line.strip():
+                continue
+            try:
+                request = json.loads(line)
+                if request['cmd'] == 'ping':
+                    # 通过一次 uno 调用确认 soffice 仍然可以响应
+                    desktop.getComponents()
+                elif request['cmd'] == 'convert':
+                    convert(desktop, request['input'], request['output'])
+                else:
+                    raise ValueError(f"未知命令: {request['cmd']}")
+                _reply({'ok': True})
+            except Exception as e:
+                _reply({'ok': False, 'error': str(e)})
+    except Exception as e:
+        _reply({'ok': False, 'error': str(e)})
+    finally:
+        if desktop is not None:
+            try:
+                desktop.terminate()
+            except Exception:
+                pass
+        try:
+            office.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            office.kill()
+
+if __name__ == '__main__':
+    main()
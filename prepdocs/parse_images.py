@@ -1,50 +1,152 @@
 # 解析图片
+import asyncio
+import logging
+import re
+
 from api.views import global_env
 from clients.client_pool import ClientPool
 from prepdocs.config import Section, Page, FileType
 from api.views import GeminiClient
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from clients.async_http import run_async
+from clients.rate_limiter import estimate_image_tokens
+
+logger = logging.getLogger(__name__)
+
+PAGE_MARKER_RE = re.compile(r'^[ \t]*<<<PAGE (\d+)>>>[ \t]*$', re.MULTILINE)
 
 def get_parse_markdown_system_prompt() -> str:
     return """
 You are a markdown parser, convert images to markdown format. Format tables using markdown tables, and use $..$ or $$..$$ to wrap formulas, prevent using html tags. Replace images with as accurate descriptions as possible, and never output image links. Only ignore prescript, postscript and small icons in them at the very beginning or end of the image.
 """
 
-def process_single_page(client_pool, page):
-    response = client_pool.execute_with_retry(
-        "chat_with_image", 
-        get_parse_markdown_system_prompt(), 
-        page.file_path, 
+def get_parse_markdown_batch_system_prompt(page_count: int) -> str:
+    return get_parse_markdown_system_prompt() + f"""
+The {page_count} images are consecutive pages of one document. Convert every image separately and in order. Before the markdown of each page, output a line containing only its marker, from <<<PAGE 1>>> to <<<PAGE {page_count}>>>, and never output the markers anywhere else.
+"""
+
+class PageBatcher:
+    """
+    将需要视觉模型解析的连续页面打包，每批不超过 max_pages 张图片和 max_tokens 个图片 token；
+    已有文本内容的页面不需要调用模型，单独成批；返回的批次可能为空，提交前需要跳过
+    """
+    def __init__(self, max_pages: int, max_tokens: int):
+        self.max_pages = max(max_pages, 1)
+        self.max_tokens = max_tokens
+        self.pending: list[tuple[int, Page]] = []
+        self.pending_tokens = 0
+
+    def add(self, idx: int, page: Page) -> list[list[tuple[int, Page]]]:
+        """加入一页，返回已经装满、可以提交的批次"""
+        if page.content is not None:
+            # 批次中的页面保持连续，先提交已打包的页面
+            return [self.flush(), [(idx, page)]]
+        tokens = estimate_image_tokens(page.file_path) if self.max_pages > 1 else 0
+        batches = []
+        if self.pending and self.pending_tokens + tokens > self.max_tokens:
+            batches.append(self.flush())
+        self.pending.append((idx, page))
+        self.pending_tokens += tokens
+        if len(self.pending) >= self.max_pages:
+            batches.append(self.flush())
+        return batches
+
+    def flush(self) -> list[tuple[int, Page]]:
+        batch, self.pending, self.pending_tokens = self.pending, [], 0
+        return batch
+
+def get_page_batcher() -> PageBatcher:
+    """按 settings.OCR_BATCH_PAGES 和 settings.OCR_BATCH_MAX_TOKENS 创建页面打包器"""
+    from django.conf import settings
+    return PageBatcher(settings.OCR_BATCH_PAGES, settings.OCR_BATCH_MAX_TOKENS)
+
+def split_marked_pages(text: str, page_count: int) -> list[str]:
+    """
+    按页面标记拆分批量解析的结果，返回从第 1 页开始、确定完整的页面内容；
+    标记按顺序出现但数量不足时（例如输出被截断），最后一个标记之后的内容不可信，不计入结果
+    """
+    parts = PAGE_MARKER_RE.split(text)
+    ids, contents = parts[1::2], [part.strip() for part in parts[2::2]]
+    if parts[0].strip() or not ids or ids != [str(i + 1) for i in range(len(ids))] or len(ids) > page_count:
+        return []
+    if len(ids) < page_count:
+        return contents[:-1]
+    return contents
+
+async def process_single_page(client_pool, page):
+    if page.content is not None:
+        # 预处理阶段已从 PDF 文本层提取出内容，不需要调用视觉模型
+        return Page(content=page.content)
+    response = await client_pool.aexecute_with_retry(
+        "chat_with_image",
+        get_parse_markdown_system_prompt(),
+        page.file_path,
         'path'
     )
     if 'error' in response:
         raise ValueError(f"解析图片失败: {response['error']}")
     return Page(content=response['text'])
 
-def parse_images(section):
+async def process_page_batch(client_pool, pages: list[Page]) -> list[Page]:
+    """
+    在一次请求中解析多页，结果按页面标记拆分；
+    拆分失败的页面逐页重新解析
+    """
+    if len(pages) == 1:
+        return [await process_single_page(client_pool, pages[0])]
+    response = await client_pool.aexecute_with_retry(
+        "chat_with_images",
+        get_parse_markdown_batch_system_prompt(len(pages)),
+        [page.file_path for page in pages]
+    )
+    contents = [] if 'error' in response else split_marked_pages(response['text'], len(pages))
+    if len(contents) < len(pages):
+        logger.warning(f"批量解析只得到 {len(contents)}/{len(pages)} 页，其余页面逐页解析")
+    retried = await asyncio.gather(*(process_single_page(client_pool, page) for page in pages[len(contents):]))
+    return [Page(content=content) for content in contents] + list(retried)
+
+async def aparse_images(section, on_page_done=None):
+    """
+    在事件循环中并发解析图片，保持原始顺序，连续的页面按 PageBatcher 打包后在一次请求中解析，
+    同时进行的请求数由 settings.LLM_MAX_IN_FLIGHT 限制
+    :param on_page_done: 可选回调 on_page_done(index, page)，每页解析完成后调用，用于保存检查点
+    """
+    from django.conf import settings
     client_pool: ClientPool = global_env['gemini_client_pool']
-    if not client_pool._get_clients():
-        raise ValueError("No Client available. Please check your API keys.")
     result_section = Section(
         title=section.title,
         pages=[None] * len(section.pages),  # 预分配空间以保持顺序
         file_type=FileType.TEXT,
         filename=section.filename
     )
-    max_workers = min(len(client_pool._get_clients()) * 2, 8)
-    # 使用线程池并行处理图片，但保持顺序
-    with ThreadPoolExecutor(max_workers=max_workers) as executor:
-        future_to_index = {
-            executor.submit(process_single_page, client_pool, page): idx
-            for idx, page in enumerate(section.pages)
-        }
-        
-        for future in as_completed(future_to_index):
-            idx = future_to_index[future]
-            try:
-                result_page = future.result()
+    batcher = get_page_batcher()
+    batches = []
+    for idx, page in enumerate(section.pages):
+        batches.extend(batcher.add(idx, page))
+    batches.append(batcher.flush())
+
+    semaphore = asyncio.Semaphore(settings.LLM_MAX_IN_FLIGHT)
+
+    async def process_batch(batch):
+        indexes = [idx for idx, _ in batch]
+        try:
+            async with semaphore:
+                results = await process_page_batch(client_pool, [page for _, page in batch])
+            for idx, result_page in zip(indexes, results):
                 result_section.pages[idx] = result_page  # 使用原始索引存储结果
-            except Exception as e:
-                print(f"处理页面 {idx + 1} 时发生错误: {str(e)}")
+                if on_page_done:
+                    await asyncio.to_thread(on_page_done, idx, result_page)
+        except Exception as e:
+            logger.error(f"处理页面 {', '.join(str(idx + 1) for idx in indexes)} 时发生错误: {str(e)}", exc_info=True)
 
+    await asyncio.gather(*(process_batch(batch) for batch in batches if batch))
     return result_section
+
+def parse_images(section, on_page_done=None):
+    """
+    解析图片，所有页面的请求在同一个事件循环中并发执行
+    :param on_page_done: 可选回调 on_page_done(index, page)，每页解析完成后调用，用于保存检查点
+    """
+    client_pool: ClientPool = global_env['gemini_client_pool']
+    if not client_pool._get_clients():
+        raise ValueError("No Client available. Please check your API keys.")
+    return run_async(aparse_images(section, on_page_done))
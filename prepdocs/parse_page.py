@@ -6,26 +6,48 @@ import shutil
 import tempfile
 import uuid
 import subprocess
+from collections import deque
 from pathlib import Path
+from typing import Iterator, Optional
 
-from pdf2image import convert_from_path
+from pdf2image import pdfinfo_from_path
 from prepdocs.config import Section, Page, FileType
+from prepdocs.office_pool import get_office_pool
+from prepdocs.render_pool import get_render_pool, render_pool_size, render_window_with_text
 
 logger = logging.getLogger(__name__)
 
 class DocsIngester:
-    def __init__(self):
+    def __init__(self, use_text_layer: bool = True):
         self.temp_dir = tempfile.mkdtemp()
         self.supported_formats = {'pdf', 'docx', 'pptx'}
+        # 是否提取 PDF 自带的文本层，文本层可用的页面不再需要视觉模型解析
+        self.use_text_layer = use_text_layer
+        # 每次渲染的页数，内存占用只与窗口大小有关，与文档页数无关
+        self.render_window = 4
 
     def _convert_to_pdf_with_libreoffice(self, input_file: str) -> str:
-        """使用 LibreOffice 将文档转换为 PDF"""
+        """使用 LibreOffice 将文档转换为 PDF，优先使用常驻转换进程池"""
         output_pdf = os.path.join(self.temp_dir, f"{uuid.uuid4()}.pdf")
+        office_pool = get_office_pool()
+        if office_pool.available:
+            try:
+                office_pool.convert(input_file, output_pdf)
+                logger.info(f"文件成功转换为 PDF: {output_pdf}")
+                return output_pdf
+            except Exception as e:
+                logger.warning(f"转换进程池转换失败，改用单次转换: {str(e)}")
+        return self._convert_to_pdf_with_soffice(input_file, output_pdf)
+
+    def _convert_to_pdf_with_soffice(self, input_file: str, output_pdf: str) -> str:
+        """启动一次性的 soffice 进行转换，使用独立的用户配置目录，避免并发转换相互冲突"""
+        profile_dir = tempfile.mkdtemp(prefix='lo_profile_')
         try:
             # 使用 LibreOffice 进行转换
             cmd = [
                 'soffice',
                 '--headless',
+                f'-env:UserInstallation={Path(profile_dir).as_uri()}',
                 '--convert-to',
                 'pdf',
                 '--outdir',
@@ -51,9 +73,14 @@ class DocsIngester:
         except Exception as e:
             logger.error(f"转换文件失败: {str(e)}")
             raise
+        finally:
+            shutil.rmtree(profile_dir, ignore_errors=True)
 
-    def process_document(self, file_path: str, title: str) -> Section:
-        """处理文档并返回Section对象"""
+    def iter_document(self, file_path: str, title: str) -> tuple[int, Iterator[Page]]:
+        """
+        流式处理文档，返回页数和逐页产出 Page 的生成器
+        页面渲染完成一页就产出一页，下游可以在整个文档渲染完之前开始处理
+        """
         file_path = Path(file_path)
         if not file_path.exists():
             raise FileNotFoundError(f"文件不存在: {file_path}")
@@ -62,39 +89,54 @@ class DocsIngester:
             logger.debug(f"不支持的文件格式: {title.split('.')[-1]}")
             raise ValueError(f"不支持的文件格式: {title.split('.')[-1]}")
 
-        # 根据文件类型处理并获取图片路径列表
-        image_paths = []
-        if title.split('.')[-1].lower() == 'pdf':
-            image_paths = self._process_pdf(file_path)
-        else:
-            # 对于 docx 和 pptx，先转换为 PDF
+        if title.split('.')[-1].lower() != 'pdf':
+            # 对于 docx 和 pptx，先转换为 PDF，并将转换后的 PDF 移动到原始文件位置
             pdf_path = self._convert_to_pdf_with_libreoffice(str(file_path))
-            image_paths = self._process_pdf(Path(pdf_path))
-            # 将转换后的 PDF 移动到原始文件位置
             shutil.move(pdf_path, file_path)
 
-        # 将图片路径转换为Page对象列表
-        pages = [Page(file_path=path) for path in image_paths]
+        page_count = pdfinfo_from_path(file_path)['Pages']
+
+        def pages() -> Iterator[Page]:
+            # 文本层与页面渲染按窗口一起提取，可用的页面直接带上文本内容
+            for path, text in self.iter_pdf_pages(file_path, page_count):
+                yield Page(file_path=path, content=text)
+
+        return page_count, pages()
+
+    def process_document(self, file_path: str, title: str) -> Section:
+        """处理文档并返回Section对象"""
+        _, pages = self.iter_document(file_path, title)
         
         # 创建并返回Section对象
         return Section(
             title=title,
-            pages=pages,
+            pages=list(pages),
             file_type=FileType.IMAGE,
             filename=title
         )
 
-    def _process_pdf(self, file_path: Path) -> list[str]:
-        """处理 PDF 文件"""
-        images = convert_from_path(file_path)
-        image_paths = []
-        
-        for i, image in enumerate(images):
-            image_path = os.path.join(self.temp_dir, f"page_{i+1}.png")
-            image.save(image_path, "PNG")
-            image_paths.append(image_path)
-        
-        return image_paths
+    def iter_pdf_pages(self, file_path: Path, page_count: int) -> Iterator[tuple[str, Optional[str]]]:
+        """
+        按窗口渲染 PDF 页面并提取文本层，逐页产出图片路径和文本层（不可用时为 None）
+        渲染任务提交到独立的渲染进程池并行执行，同时在途的窗口数有上限，
+        由 pdftoppm 直接写入 PNG 文件，峰值内存与文档页数无关
+        """
+        render_pool = get_render_pool()
+        max_in_flight = render_pool_size() * 2
+        windows = [
+            (first_page, min(first_page + self.render_window - 1, page_count))
+            for first_page in range(1, page_count + 1, self.render_window)
+        ]
+        futures = deque()
+        for first_page, last_page in windows:
+            futures.append(render_pool.submit(
+                render_window_with_text, str(file_path), first_page, last_page, self.temp_dir, self.use_text_layer
+            ))
+            # 按顺序产出已完成的窗口，保证页面顺序
+            while len(futures) >= max_in_flight or (futures and futures[0].done()):
+                yield from futures.popleft().result()
+        while futures:
+            yield from futures.popleft().result()
 
     def cleanup(self):
         """清理临时文件"""
@@ -0,0 +1,88 @@
+# 页面渲染进程池
+# PDF 渲染和 PNG 编码是 CPU 密集型操作，放在独立的进程池中执行，
+# 不占用处理 API 请求的线程池，也不与其争抢 GIL。
+# 本模块会在子进程中被导入，不能在模块级别依赖 Django。
+
+import logging
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from threading import Lock
+from typing import Optional
+
+from pdf2image import convert_from_path
+
+logger = logging.getLogger(__name__)
+
+_render_pool: Optional[ProcessPoolExecutor] = None
+_render_pool_size = 0
+_render_pool_lock = Lock()
+
+def get_render_pool() -> ProcessPoolExecutor:
+    """获取全局渲染进程池，进程数由 settings.RENDER_PROCESSES 配置"""
+    global _render_pool, _render_pool_size
+    with _render_pool_lock:
+        # 子进程异常退出后进程池不可再用，重新创建
+        if _render_pool is None or getattr(_render_pool, '_broken', False):
+            from django.conf import settings
+            max_workers = getattr(settings, 'RENDER_PROCESSES', None) or os.cpu_count() or 1
+            # 使用 spawn 启动子进程，避免 fork 复制 web 进程中的线程和数据库连接
+            _render_pool = ProcessPoolExecutor(
+                max_workers=max_workers,
+                mp_context=multiprocessing.get_context('spawn')
+            )
+            _render_pool_size = max_workers
+            logger.info(f"Render pool initialized with {max_workers} processes")
+        return _render_pool
+
+def render_pool_size() -> int:
+    """渲染进程池的进程数"""
+    get_render_pool()
+    return _render_pool_size
+
+def render_window(file_path: str, first_page: int, last_page: int, output_folder: str) -> list[str]:
+    """
+    在子进程中渲染 [first_page, last_page] 范围内的页面，
+    由 pdftoppm 直接写入 PNG 文件，返回 page_<页码>.png 路径列表
+    """
+    # 每个窗口使用独立的文件名前缀，pdf2image 按前缀收集本窗口的输出文件
+    window_paths = convert_from_path(
+        file_path,
+        first_page=first_page,
+        last_page=last_page,
+        output_folder=output_folder,
+        output_file=f"window_{first_page:06d}_",
+        fmt='png',
+        paths_only=True
+    )
+    image_paths = []
+    for page_number, window_path in enumerate(window_paths, start=first_page):
+        image_path = os.path.join(output_folder, f"page_{page_number}.png")
+        os.replace(window_path, image_path)
+        image_paths.append(image_path)
+    return image_paths
+
+def render_window_with_text(file_path: str, first_page: int, last_page: int, output_folder: str,
+                            use_text_layer: bool) -> list[tuple[str, Optional[str]]]:
+    """
+    在子进程中渲染窗口内的页面，同时提取这些页面的文本层
+    返回 (图片路径, 文本层) 列表，文本层不可用的页面为 None
+    """
+    from prepdocs.text_layer import extract_text_layer
+
+    image_paths = render_window(file_path, first_page, last_page, output_folder)
+    page_texts = extract_text_layer(Path(file_path), first_page, last_page) if use_text_layer else []
+    if len(page_texts) != len(image_paths):
+        # 页数与渲染结果不一致时不使用文本层，全部交给视觉模型
+        page_texts = [None] * len(image_paths)
+    return list(zip(image_paths, page_texts))
+
+def shutdown_render_pool():
+    """关闭渲染进程池"""
+    global _render_pool
+    with _render_pool_lock:
+        if _render_pool is not None:
+            _render_pool.shutdown(wait=True)
+            _render_pool = None
+            logger.info("Render pool shutdown complete")
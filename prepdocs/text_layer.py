@@ -0,0 +1,157 @@
+# 提取 PDF 自带的文本层
+
+import logging
+import re
+import statistics
+import subprocess
+import xml.etree.ElementTree as ET
+from pathlib import Path
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+XHTML_NS = '{http://www.w3.org/1999/xhtml}'
+
+# 文本层可用的判定阈值
+MIN_LETTERS = 80              # 有效字符过少（扫描件、纯图片页）时交给视觉模型
+MAX_BROKEN_RATIO = 0.02       # 乱码字符（替换符、私有区字符）占比上限，超过说明字体编码损坏
+MIN_LETTER_RATIO = 0.5        # 字母/文字占非空白字符的最低比例
+MAX_MATH_RATIO = 0.02         # 数学符号占比上限，公式密集的页面交给视觉模型生成 LaTeX
+MAX_IMAGE_COVERAGE = 0.3      # 图片覆盖页面面积的上限，图片较多的页面需要视觉模型描述
+
+BULLET_RE = re.compile(r'^([•●○▪■◦‣∙·\-\*]|\d{1,3}[\.\)])\s+')
+
+def _is_math_char(char: str) -> bool:
+    code = ord(char)
+    return (0x0370 <= code <= 0x03FF          # 希腊字母
+            or 0x2200 <= code <= 0x22FF       # 数学运算符
+            or 0x27C0 <= code <= 0x27EF
+            or 0x2980 <= code <= 0x2AFF
+            or 0x1D400 <= code <= 0x1D7FF)    # 数学字母数字符号
+
+def _is_broken_char(char: str) -> bool:
+    code = ord(char)
+    return char == '\ufffd' or 0xE000 <= code <= 0xF8FF
+
+def _run(cmd: list[str]) -> str:
+    process = subprocess.run(cmd, capture_output=True, encoding='utf-8', errors='replace', timeout=300)
+    if process.returncode != 0:
+        raise RuntimeError(f"{cmd[0]} 执行失败: {process.stderr.strip()}")
+    return process.stdout
+
+def _page_range(first_page: Optional[int], last_page: Optional[int]) -> list[str]:
+    """poppler 工具的页码范围参数"""
+    args = []
+    if first_page is not None:
+        args += ['-f', str(first_page)]
+    if last_page is not None:
+        args += ['-l', str(last_page)]
+    return args
+
+def _image_coverage(pdf_path: Path, first_page: Optional[int] = None, last_page: Optional[int] = None) -> dict[int, float]:
+    """使用 pdfimages -list 统计每页图片的面积（平方磅），页码为文档中的页码"""
+    areas = {}
+    output = _run(['pdfimages', '-list', *_page_range(first_page, last_page), str(pdf_path)])
+    for line in output.splitlines()[2:]:
+        fields = line.split()
+        # page num type width height color comp bpc enc interp object ID x-ppi y-ppi size ratio
+        if len(fields) < 14 or fields[2] != 'image':
+            continue
+        try:
+            page, width, height = int(fields[0]), int(fields[3]), int(fields[4])
+            x_ppi, y_ppi = float(fields[12]), float(fields[13])
+        except ValueError:
+            continue
+        if x_ppi <= 0 or y_ppi <= 0:
+            continue
+        areas[page] = areas.get(page, 0.0) + (width / x_ppi * 72) * (height / y_ppi * 72)
+    return areas
+
+def _block_lines(block: ET.Element) -> list[tuple[str, float]]:
+    """返回块中每一行的文本和行高"""
+    lines = []
+    for line in block.iter(f'{XHTML_NS}line'):
+        words = [word.text or '' for word in line.iter(f'{XHTML_NS}word')]
+        text = ' '.join(word for word in words if word)
+        if text:
+            lines.append((text, float(line.get('yMax')) - float(line.get('yMin'))))
+    return lines
+
+def _join_lines(lines: list[str]) -> str:
+    """合并同一段落中被折行的文本，去掉行尾连字符"""
+    text = ''
+    for line in lines:
+        if text.endswith('-') and line[:1].islower():
+            text = text[:-1] + line
+        elif text:
+            text += ' ' + line
+        else:
+            text = line
+    return text
+
+def _page_to_markdown(blocks: list[list[tuple[str, float]]], body_height: float) -> str:
+    """根据行高识别标题，根据行首符号识别列表，其余文本块作为段落"""
+    paragraphs = []
+    for lines in blocks:
+        height = max(h for _, h in lines)
+        texts = [text for text, _ in lines]
+        if len(lines) <= 2 and body_height and height >= body_height * 1.3:
+            level = '#' if height >= body_height * 1.8 else '##'
+            paragraphs.append(f"{level} {' '.join(texts)}")
+        elif BULLET_RE.match(texts[0]):
+            items = []
+            for text in texts:
+                if BULLET_RE.match(text) or not items:
+                    items.append([BULLET_RE.sub('', text)])
+                else:
+                    items[-1].append(text)
+            paragraphs.append('\n'.join(f"- {_join_lines(item)}" for item in items))
+        else:
+            paragraphs.append(_join_lines(texts))
+    return '\n\n'.join(paragraphs)
+
+def _is_usable(text: str, image_coverage: float) -> bool:
+    chars = [c for c in text if not c.isspace()]
+    letters = sum(c.isalpha() for c in chars)
+    if letters < MIN_LETTERS:
+        return False
+    if sum(_is_broken_char(c) for c in chars) / len(chars) > MAX_BROKEN_RATIO:
+        return False
+    if letters / len(chars) < MIN_LETTER_RATIO:
+        return False
+    if sum(_is_math_char(c) for c in chars) / len(chars) > MAX_MATH_RATIO:
+        return False
+    return image_coverage <= MAX_IMAGE_COVERAGE
+
+def extract_text_layer(pdf_path: Path, first_page: Optional[int] = None,
+                       last_page: Optional[int] = None) -> list[Optional[str]]:
+    """
+    提取 PDF 每一页的文本层并转换为 markdown
+    文本层不可用的页面（扫描件、乱码、公式或图片较多）返回 None，需要交给视觉模型解析
+    依赖 poppler-utils 中的 pdftotext 和 pdfimages，执行失败时返回空列表
+    :param first_page: 只提取 [first_page, last_page] 范围内的页面，按渲染窗口提取时不必等待整个文档
+    """
+    page_range = _page_range(first_page, last_page)
+    try:
+        root = ET.fromstring(_run(['pdftotext', '-bbox-layout', *page_range, str(pdf_path), '-']))
+        image_areas = _image_coverage(pdf_path, first_page, last_page)
+    except Exception as e:
+        logger.warning(f"提取文本层失败，全部页面使用视觉模型: {str(e)}")
+        return []
+
+    pages = []
+    for page in root.iter(f'{XHTML_NS}page'):
+        blocks = [lines for lines in map(_block_lines, page.iter(f'{XHTML_NS}block')) if lines]
+        pages.append((page, blocks))
+    # 正文行高取提取范围内的中位数，用于识别标题
+    heights = [h for _, blocks in pages for lines in blocks for _, h in lines]
+    body_height = statistics.median(heights) if heights else 0
+
+    results = []
+    for page_number, (page, blocks) in enumerate(pages, start=first_page or 1):
+        page_area = float(page.get('width', 0)) * float(page.get('height', 0))
+        coverage = min(image_areas.get(page_number, 0.0) / page_area, 1.0) if page_area else 1.0
+        text = _page_to_markdown(blocks, body_height)
+        results.append(text if _is_usable(text, coverage) else None)
+    logger.debug(f"{pdf_path} 提取 {len(results)} 页，{sum(r is not None for r in results)} 页使用文本层")
+    return results
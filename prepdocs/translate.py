@@ -1,56 +1,227 @@
 # 解析英文文档
+import asyncio
+import logging
+import re
+from typing import Optional
+
+from asgiref.sync import sync_to_async
+
 from prepdocs.config import Section, Page, FileType
+from prepdocs import translation_memory
+from prepdocs.translation_memory import split_segments, join_segments, segment_hash, needs_translation, is_aligned
 
 from api.views import global_env
 from clients.client_pool import ClientPool
 from api.views import GeminiClient
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from clients.async_http import run_async
+from clients.rate_limiter import estimate_text_tokens
+
+logger = logging.getLogger(__name__)
+
+SEGMENT_MARKER_RE = re.compile(r'^[ \t]*<<<(\d+)>>>[ \t]*$', re.MULTILINE)
+
+# 一个翻译请求最多包含的段落数，段落过多时模型容易遗漏标记
+MAX_SEGMENTS_PER_CHUNK = 40
+
+# 翻译提示词版本，修改提示词时递增，翻译记忆中旧版本的译文不再复用
+PROMPT_VERSION = '1'
 
 def get_translate_system_prompt(target_language: str) -> str:
     return f"""
 You are a professional translator, translate the following text into {target_language}, and cannot output any other extra content: 
 """
 
-def process_single_translation(client_pool, page_content: str, target_language: str) -> Page:
-    response = client_pool.execute_with_retry(
-        "chat_with_text", 
-        f"{get_translate_system_prompt(target_language)}\n{page_content}"
-    )
+def get_segments_translate_system_prompt(target_language: str) -> str:
+    return f"""
+You are a professional translator. The following text consists of segments, each starting with a marker line such as <<<1>>>. Translate every segment into {target_language}. Keep every marker line unchanged and in the same order, put each translation right after its marker, and cannot output any other extra content: 
+"""
+
+async def request_translation(client_pool, prompt: str) -> tuple[str, str]:
+    """返回译文和生成译文的模型"""
+    response = await client_pool.aexecute_with_retry("chat_with_text", prompt)
     if 'error' in response:
         raise ValueError(f"翻译失败: {response['error']}")
-    return Page(content=response['text'])
+    return response['text'], response.get('model', '')
+
+def split_marked_translation(text: str, count: int) -> Optional[list[str]]:
+    """按标记行拆分译文，标记缺失、乱序或某段为空时返回 None"""
+    parts = SEGMENT_MARKER_RE.split(text)
+    ids, translations = parts[1::2], [part.strip() for part in parts[2::2]]
+    if parts[0].strip() or ids != [str(i + 1) for i in range(count)] or not all(translations):
+        return None
+    return translations
+
+async def translate_segments(client_pool, segments: list[str], target_language: str) -> tuple[Optional[list[str]], str]:
+    """
+    一次请求翻译多个段落，返回与输入一一对应的译文和生成译文的模型；
+    无法拆分，或某段译文与原文长度明显不对应（标记错位）时译文为 None
+    """
+    if len(segments) == 1:
+        text, model = await request_translation(client_pool, f"{get_translate_system_prompt(target_language)}\n{segments[0]}")
+        return [text.strip()], model
+    marked_text = '\n\n'.join(f"<<<{i + 1}>>>\n{segment}" for i, segment in enumerate(segments))
+    text, model = await request_translation(client_pool, f"{get_segments_translate_system_prompt(target_language)}\n{marked_text}")
+    translations = split_marked_translation(text, len(segments))
+    if translations is not None and not all(map(is_aligned, segments, translations)):
+        return None, model
+    return translations, model
+
+def pack_segments(segments: list[tuple[str, str]], max_tokens: int) -> list[list[tuple[str, str]]]:
+    """
+    按原始顺序将 (段落哈希, 段落) 打包成若干请求，每个请求不超过 max_tokens 个 token
+    和 MAX_SEGMENTS_PER_CHUNK 个段落；超出预算的单个段落单独成为一个请求
+    """
+    chunks = []
+    current, current_tokens = [], 0
+    for segment in segments:
+        tokens = estimate_text_tokens(segment[1])
+        if current and (current_tokens + tokens > max_tokens or len(current) >= MAX_SEGMENTS_PER_CHUNK):
+            chunks.append(current)
+            current, current_tokens = [], 0
+        current.append(segment)
+        current_tokens += tokens
+    if current:
+        chunks.append(current)
+    return chunks
+
+async def translate_chunk(client_pool, chunk: list[tuple[str, str]], target_language: str) -> dict[str, str]:
+    """
+    翻译一个请求中的段落并写入翻译记忆，返回 {段落哈希: 译文}；
+    译文无法按标记拆分时将段落对半拆分后分别重试
+    """
+    sources = [segment for _, segment in chunk]
+    results, model = await translate_segments(client_pool, sources, target_language)
+    if results is None:
+        logger.warning(f"按段落拆分译文失败，拆分为两个请求重试 ({len(chunk)} 个段落)")
+        middle = len(chunk) // 2
+        first, second = await asyncio.gather(
+            translate_chunk(client_pool, chunk[:middle], target_language),
+            translate_chunk(client_pool, chunk[middle:], target_language)
+        )
+        return {**first, **second}
+    await sync_to_async(translation_memory.store)(list(zip(sources, results)), target_language, PROMPT_VERSION, model)
+    return {source_hash: result for (source_hash, _), result in zip(chunk, results)}
+
+class PageTranslation:
+    """一页的翻译状态：按段落切分页面，记录翻译记忆中已有的译文和仍需翻译的段落"""
+    def __init__(self, content: str, memory: dict[str, str]):
+        self.segments = split_segments(content)
+        # 不需要翻译的段落原样保留
+        self.translated = [memory.get(segment_hash(segment), segment) for segment in self.segments]
+        # {段落哈希: 段落下标列表}，页内重复的段落只翻译一次
+        self.missing: dict[str, list[int]] = {}
+        for i, segment in enumerate(self.segments):
+            if needs_translation(segment) and segment_hash(segment) not in memory:
+                self.missing.setdefault(segment_hash(segment), []).append(i)
 
-def translate_text(section: Section, target_language: str='Simplified Chinese') -> Section:
+    def missing_segments(self) -> list[tuple[str, str]]:
+        return [(source_hash, self.segments[indexes[0]]) for source_hash, indexes in self.missing.items()]
+
+    def to_page(self, results: dict[str, str]) -> Page:
+        for source_hash, indexes in self.missing.items():
+            for i in indexes:
+                self.translated[i] = results[source_hash]
+        return Page(content=join_segments(self.translated))
+
+def plan_translations(contents: list[str], target_language: str) -> tuple[list[PageTranslation], list[list[tuple[str, str]]]]:
     """
-    多线程翻译文本，保持原始顺序
+    查询翻译记忆并将各页未命中的段落按 token 预算打包，
+    小页面合并到同一个请求中，超出预算的页面在段落边界拆分
     """
+    from django.conf import settings
+    segments = [segment for content in contents for segment in split_segments(content) if needs_translation(segment)]
+    # 同一段落有多个模型的译文时，优先使用当前客户端所用模型的译文
+    client_pool: ClientPool = global_env['gemini_client_pool']
+    models = client_pool.get_model_names('chat_with_text')
+    memory = translation_memory.lookup(segments, target_language, PROMPT_VERSION, models)
+    pages = [PageTranslation(content, memory) for content in contents]
+    # 多页中重复的段落只翻译一次
+    missing = {}
+    for page in pages:
+        missing.update(page.missing_segments())
+    chunks = pack_segments(list(missing.items()), settings.TRANSLATE_CHUNK_TOKENS)
+    logger.debug(f"翻译记忆命中 {len(memory)} 个段落，{len(missing)} 个段落打包为 {len(chunks)} 个请求")
+    return pages, chunks
+
+async def translate_pages(client_pool, contents: list[str], target_language: str, on_page_done,
+                          semaphore: asyncio.Semaphore):
+    """
+    翻译一组页面：各页的段落按 token 预算打包成请求，小页面合并到同一个请求中，
+    一页涉及的请求全部完成后组装该页；处理失败的页面不会调用回调
+    :param on_page_done: 协程函数 on_page_done(index, page)，index 为页面在 contents 中的下标
+    :param semaphore: 限制同时进行的翻译请求数
+    """
+    pages, chunks = await sync_to_async(plan_translations)(contents, target_language)
+
+    # 每页还在等待的请求数
+    chunk_pages = []
+    pending = [0] * len(pages)
+    for chunk in chunks:
+        hashes = {source_hash for source_hash, _ in chunk}
+        owners = [idx for idx, page in enumerate(pages) if hashes & page.missing.keys()]
+        chunk_pages.append(owners)
+        for idx in owners:
+            pending[idx] += 1
+
+    results = {}
+
+    async def finish_page(idx):
+        try:
+            await on_page_done(idx, pages[idx].to_page(results))
+        except Exception as e:
+            logger.error(f"翻译页面 {idx + 1} 时发生错误: {str(e)}", exc_info=True)
+
+    async def process_chunk(chunk, owners):
+        try:
+            async with semaphore:
+                results.update(await translate_chunk(client_pool, chunk, target_language))
+        except Exception as e:
+            logger.error(f"翻译页面 {', '.join(str(idx + 1) for idx in owners)} 时发生错误: {str(e)}", exc_info=True)
+            return
+        for idx in owners:
+            pending[idx] -= 1
+            if pending[idx] == 0:
+                await finish_page(idx)
+
+    for idx in range(len(pages)):
+        if pending[idx] == 0:
+            await finish_page(idx)
+    await asyncio.gather(*(process_chunk(chunk, owners) for chunk, owners in zip(chunks, chunk_pages)))
+
+async def atranslate_text(section: Section, target_language: str='Simplified Chinese', on_page_done=None) -> Section:
+    """
+    在事件循环中并发翻译文本，保持原始顺序；各页的段落按 token 预算打包成请求，
+    一页涉及的请求全部完成后组装该页，同时进行的请求数由 settings.LLM_MAX_IN_FLIGHT 限制
+    :param on_page_done: 可选回调 on_page_done(index, page)，每页翻译完成后调用，用于保存检查点
+    """
+    from django.conf import settings
     client_pool: ClientPool = global_env['gemini_client_pool']
-    if not client_pool._get_clients():
-        raise ValueError("No GeminiClient available. Please check your API keys and permissions.")
     result_section = Section(
         title=section.title,
         pages=[None] * len(section.pages),  # 预分配空间以保持顺序
         file_type=FileType.TEXT,
         filename=section.filename
     )
-    max_workers = min(len(client_pool._get_clients()) * 2, 8)
-    # 使用线程池并行处理翻译，但保持顺序
-    with ThreadPoolExecutor(max_workers=max_workers) as executor:
-        future_to_index = {
-            executor.submit(process_single_translation, client_pool, page.content, target_language): idx
-            for idx, page in enumerate(section.pages)
-        }
-        
-        # 收集翻译结果
-        for future in as_completed(future_to_index):
-            idx = future_to_index[future]
-            try:
-                result_page = future.result()
-                result_section.pages[idx] = result_page  # 使用原始索引存储结果
-            except Exception as e:
-                print(f"翻译页面 {idx + 1} 时发生错误: {str(e)}")
-    
+
+    async def finish_page(idx, result_page):
+        result_section.pages[idx] = result_page  # 使用原始索引存储结果
+        if on_page_done:
+            await asyncio.to_thread(on_page_done, idx, result_page)
+
+    await translate_pages(client_pool, [page.content for page in section.pages], target_language, finish_page,
+                          asyncio.Semaphore(settings.LLM_MAX_IN_FLIGHT))
+
     # 移除任何处理失败的页面（None值）
     result_section.pages = [page for page in result_section.pages if page is not None]
-                
+
     return result_section
+
+def translate_text(section: Section, target_language: str='Simplified Chinese', on_page_done=None) -> Section:
+    """
+    翻译文本，所有请求在同一个事件循环中并发执行
+    :param on_page_done: 可选回调 on_page_done(index, page)，每页翻译完成后调用，用于保存检查点
+    """
+    client_pool: ClientPool = global_env['gemini_client_pool']
+    if not client_pool._get_clients():
+        raise ValueError("No GeminiClient available. Please check your API keys and permissions.")
+    return run_async(atranslate_text(section, target_language, on_page_done))
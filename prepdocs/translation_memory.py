@@ -0,0 +1,130 @@
+# 翻译记忆：按段落复用已有译文
+
+import hashlib
+import logging
+import re
+from typing import Optional
+
+from django.db.models import F
+from api.models import TranslationMemory
+
+logger = logging.getLogger(__name__)
+
+FENCE_RE = re.compile(r'^\s*(```|\$\$)')
+
+# 每次查询的哈希数，避免超过 SQLite 的绑定参数上限
+LOOKUP_BATCH_SIZE = 500
+
+# 译文与原文的字符数之比超出该范围时，认为译文没有与原文对齐（例如标记错位），不写入翻译记忆；
+# 原文较短时比例不稳定，不做判断
+MIN_LENGTH_RATIO = 0.15
+MAX_LENGTH_RATIO = 4.0
+MIN_CHECKED_LENGTH = 40
+
+def split_segments(content: str) -> list[str]:
+    """
+    按空行将页面切分为段落，代码块和 $$ 公式块内部的空行不作为分隔
+    """
+    segments = []
+    current = []
+    fence = None
+    for line in (content or '').splitlines():
+        match = FENCE_RE.match(line)
+        if match:
+            marker = match.group(1)
+            if fence is None:
+                # 单行的 $$...$$ 不开启公式块
+                if not (marker == '$$' and line.strip().endswith('$$') and len(line.strip()) > 2):
+                    fence = marker
+            elif marker == fence:
+                fence = None
+        if not line.strip() and fence is None:
+            if current:
+                segments.append('\n'.join(current))
+                current = []
+            continue
+        current.append(line)
+    if current:
+        segments.append('\n'.join(current))
+    return segments
+
+def join_segments(segments: list[str]) -> str:
+    return '\n\n'.join(segments)
+
+def normalize(segment: str) -> str:
+    """规范化空白字符，排版差异不影响复用"""
+    return ' '.join(segment.split())
+
+def segment_hash(segment: str) -> str:
+    return hashlib.sha256(normalize(segment).encode('utf-8')).hexdigest()
+
+def needs_translation(segment: str) -> bool:
+    """不含任何文字的段落（页码、纯数字、分隔线等）原样保留"""
+    return any(char.isalpha() for char in segment)
+
+def is_aligned(source: str, translated: str) -> bool:
+    """按字符数之比粗略判断译文是否对应原文"""
+    source_length = len(normalize(source))
+    if source_length < MIN_CHECKED_LENGTH:
+        return bool(translated.strip())
+    ratio = len(normalize(translated)) / source_length
+    return MIN_LENGTH_RATIO <= ratio <= MAX_LENGTH_RATIO
+
+def _batches(items: list, size: int = LOOKUP_BATCH_SIZE):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+def lookup(segments: list[str], target_language: str, prompt_version: str,
+           models: Optional[list[str]] = None) -> dict[str, str]:
+    """
+    查询段落在当前提示词版本下的已有译文，返回 {段落哈希: 译文}
+    同一段落有多个模型的译文时，按 models 中的顺序优先使用当前模型的译文，
+    其余模型的译文按写入先后取最早的一条；只有被采用的译文计入复用次数
+    :param models: 当前使用的模型，按优先顺序排列
+    """
+    rank = {model: i for i, model in enumerate(models or [])}
+    hashes = sorted({segment_hash(segment) for segment in segments})
+    best = {}
+    for batch in _batches(hashes):
+        rows = TranslationMemory.objects.filter(
+            source_hash__in=batch, target_language=target_language, prompt_version=prompt_version
+        ).order_by('id').values_list('id', 'source_hash', 'model', 'translated_text')
+        for row_id, source_hash, model, translated_text in rows:
+            key = (rank.get(model, len(rank)), row_id)
+            if source_hash not in best or key < best[source_hash][0]:
+                best[source_hash] = (key, row_id, translated_text)
+    used_ids = [row_id for _, row_id, _ in best.values()]
+    for batch in _batches(used_ids):
+        TranslationMemory.objects.filter(id__in=batch).update(hit_count=F('hit_count') + 1)
+    return {source_hash: translated_text for source_hash, (_, _, translated_text) in best.items()}
+
+def store(pairs: list[tuple[str, str]], target_language: str, prompt_version: str, model: str):
+    """保存 (原文, 译文) 段落对，记录生成译文的模型和提示词版本；与原文明显不对应的译文不保存"""
+    records = {}
+    for source, translated in pairs:
+        if not is_aligned(source, translated):
+            logger.warning(f"译文与原文长度差异过大，不写入翻译记忆: {source[:30]}")
+            continue
+        source_hash = segment_hash(source)
+        records[source_hash] = TranslationMemory(
+            source_hash=source_hash,
+            target_language=target_language,
+            prompt_version=prompt_version,
+            model=model,
+            source_text=source,
+            translated_text=translated.strip()
+        )
+    TranslationMemory.objects.bulk_create(records.values(), ignore_conflicts=True)
+
+def evict(model: Optional[str] = None, prompt_version: Optional[str] = None,
+          target_language: Optional[str] = None) -> int:
+    """删除指定模型、提示词版本或目标语言的翻译记忆，返回删除的条数；不指定条件时不删除"""
+    filters = {
+        key: value for key, value in (
+            ('model', model), ('prompt_version', prompt_version), ('target_language', target_language)
+        ) if value is not None
+    }
+    if not filters:
+        return 0
+    deleted, _ = TranslationMemory.objects.filter(**filters).delete()
+    return deleted